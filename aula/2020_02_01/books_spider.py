@@ -1,27 +1,61 @@
 import scrapy
 
+from rastreamento_incremental import RastreamentoIncremental
 
-class BooksSpider(scrapy.Spider):
+
+class BooksSpider(RastreamentoIncremental, scrapy.Spider):
+    '''
+    Rastreamento completo:
+        scrapy runspider books_spider.py -o books.jl
+
+    Rastreamento incremental (ver rastreamento_incremental.py), aqui contra o
+    servidor local de servidor_livros.py:
+        scrapy runspider books_spider.py -a url=http://localhost:8000/ \\
+            -a estado=books.estado.json -o alteracoes.jl
+    '''
 
     name = 'books.toscrape.com'
     start_urls = ['http://books.toscrape.com']
 
+    url = None
+
+    def start_requests(self):
+        for url in [self.url] if self.url else self.start_urls:
+            yield self.requisicao(
+                url,
+                callback=self.parse,
+                dont_filter=True
+            )
+
     def parse(self, response):
-        for book in response.css('.product_pod'):
-            href = book.css('h3 a::attr(href)').get()
-            yield response.follow(
-                href,
+        pagina = self.extrair(response, self.extrair_listagem)
+        for url in pagina['livros']:
+            yield self.requisicao(
+                url,
                 callback=self.parse_book
             )
 
-        href = response.css('.next a::attr(href)').get()
-        if href:
-            yield response.follow(
-                href,
+        if pagina['proxima']:
+            yield self.requisicao(
+                pagina['proxima'],
                 callback=self.parse
             )
 
+    def extrair_listagem(self, response):
+        href = response.css('.next a::attr(href)').get()
+        return {
+            'livros': [
+                response.urljoin(href)
+                for href in response.css('.product_pod h3 a::attr(href)').getall()
+            ],
+            'proxima': response.urljoin(href) if href else None
+        }
+
     def parse_book(self, response):
+        livro = self.extrair(response, self.extrair_livro)
+        return self.emitir(livro['url'], livro)
+
+    def extrair_livro(self, response):
         titulo = response.css(
             '.product_main h1::text'
         ).get()
@@ -32,4 +66,4 @@ class BooksSpider(scrapy.Spider):
             'url': response.url,
             'titulo': titulo,
             'descricao': desc
-        }
\ No newline at end of file
+        }
@@ -1,43 +1,61 @@
 import scrapy
 
+from rastreamento_incremental import RastreamentoIncremental
 
-class QuotesSpider(scrapy.Spider):
+
+class QuotesSpider(RastreamentoIncremental, scrapy.Spider):
     name = 'quotes.toscrape.com'
     start_urls = ['http://quotes.toscrape.com/']
 
-    # def start_requests(self):
-    #     for url in self.start_urls:
-    #         yield scrapy.Request(url)
-
     def parse(self, response):
-        for quote in response.css('.quote'):
-            frase = quote.css('.text::text').get()
-            autor = quote.css('.author::text').get()
-            href = quote.css('.author + a::attr(href)').get()
-            href = response.urljoin(href)
-            yield scrapy.Request(
-                href,
+        pagina = self.extrair(response, self.extrair_frases)
+        for dados in pagina['frases']:
+            # a página do autor é pedida uma vez por frase; no modo
+            # incremental, as repetidas são condicionais e voltam como 304
+            yield self.requisicao(
+                dados['href'],
                 dont_filter=True,
                 callback=self.parse_autor,
                 meta={
                     'dados': {
-                        'frase': frase,
-                        'autor': autor
+                        'frase': dados['frase'],
+                        'autor': dados['autor']
                     }
                 }
             )
-        
-        href = response.css('.next a::attr(href)').get()
-        if href:
-            yield response.follow(
-                href,
+
+        if pagina['proxima']:
+            yield self.requisicao(
+                pagina['proxima'],
                 callback=self.parse
             )
 
+    def extrair_frases(self, response):
+        frases = []
+        for quote in response.css('.quote'):
+            frase = quote.css('.text::text').get()
+            autor = quote.css('.author::text').get()
+            href = quote.css('.author + a::attr(href)').get()
+            frases.append({
+                'frase': frase,
+                'autor': autor,
+                'href': response.urljoin(href)
+            })
+
+        href = response.css('.next a::attr(href)').get()
+        return {
+            'frases': frases,
+            'proxima': response.urljoin(href) if href else None
+        }
+
     def parse_autor(self, response):
+        autor = self.extrair(response, self.extrair_autor)
+        dados = response.meta['dados']
+        dados['data'] = autor['data']
+        return self.emitir(dados['autor'] + '\n' + dados['frase'], dados)
+
+    def extrair_autor(self, response):
         data = response.css(
             '.author-born-date::text'
         ).get()
-        dados = response.meta['dados']
-        dados['data'] = data
-        return dados
+        return {'data': data}
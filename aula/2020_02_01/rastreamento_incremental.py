@@ -0,0 +1,164 @@
+'''
+Rastreamento incremental com requisições condicionais.
+
+Com o argumento estado (-a estado=books.estado.json), o spider guarda em um
+arquivo JSON, para cada url, o ETag e o Last-Modified da resposta e os dados
+extraídos da página e, para cada item, um hash do seu conteúdo. Na execução
+seguinte:
+- as páginas já vistas são pedidas com If-None-Match/If-Modified-Since; se o
+  servidor responde 304 (Not Modified), o corpo não é baixado e os dados
+  extraídos da última vez são reaproveitados, então uma listagem que não
+  mudou continua levando às mesmas páginas de detalhe;
+- um item só é emitido se for novo ou se o hash do seu conteúdo mudou (isso
+  também cobre servidores que não mandam validadores), com o campo
+  alteracao igual a 'novo' ou 'alterado'.
+
+Assim, um novo rastreamento baixa só as páginas que mudaram e emite só os
+itens que mudaram. Sem o argumento estado, o spider funciona como antes.
+
+Como só os itens novos e alterados são emitidos, o arquivo .jl gravado em um
+rastreamento incremental contém só as alterações, não o catálogo inteiro.
+'''
+import hashlib
+import json
+import os
+
+import scrapy
+
+
+# cabeçalho da resposta -> cabeçalho da requisição condicional
+VALIDADORES = (
+    ('ETag', 'If-None-Match'),
+    ('Last-Modified', 'If-Modified-Since'),
+)
+
+
+class EstadoRastreamento:
+    '''
+    Validadores e dados extraídos de cada página e hash de cada item,
+    gravados em um arquivo JSON entre um rastreamento e outro.
+    '''
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.paginas = {}
+        self.itens = {}
+        if os.path.exists(caminho):
+            with open(caminho, 'r', encoding='utf-8') as arquivo:
+                estado = json.load(arquivo)
+            self.paginas = estado['paginas']
+            self.itens = estado['itens']
+
+    def cabecalhos(self, url):
+        '''
+        Cabeçalhos da requisição condicional de url (vazio se url não foi
+        visto ou se os dados extraídos dele não foram guardados, como em um
+        estado de uma versão anterior: um 304 não teria de onde tirar os dados)
+        '''
+        pagina = self.paginas.get(url, {})
+        if 'dados' not in pagina:
+            return {}
+        return {
+            condicional: pagina[validador]
+            for (validador, condicional) in VALIDADORES
+            if validador in pagina
+        }
+
+    def registrar_pagina(self, url, cabecalhos, dados):
+        '''Guarda os validadores da resposta de url e os dados extraídos dela'''
+        pagina = {'dados': dados}
+        for (validador, _) in VALIDADORES:
+            valor = cabecalhos.get(validador)
+            if valor:
+                pagina[validador] = valor.decode('latin-1')
+        self.paginas[url] = pagina
+
+    def registrar_item(self, chave, item):
+        '''Guarda o hash do item; retorna 'novo', 'alterado' ou None se não mudou'''
+        conteudo = json.dumps(item, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        hash_item = hashlib.sha1(conteudo).hexdigest()
+        anterior = self.itens.get(chave)
+        if anterior == hash_item:
+            return None
+        self.itens[chave] = hash_item
+        return 'novo' if anterior is None else 'alterado'
+
+    def salvar(self):
+        '''Grava o estado (em um arquivo temporário que depois substitui o anterior)'''
+        temporario = self.caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump({'paginas': self.paginas, 'itens': self.itens}, arquivo, ensure_ascii=False)
+        os.replace(temporario, self.caminho)
+
+
+class RastreamentoIncremental:
+    '''
+    Mixin de scrapy.Spider para o rastreamento incremental. O spider pede as
+    páginas com requisicao, obtém os dados de cada resposta com extrair e
+    passa os itens por emitir.
+    '''
+
+    estado = None
+    rastreamento = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if spider.estado:
+            spider.rastreamento = EstadoRastreamento(spider.estado)
+        return spider
+
+    def start_requests(self):
+        for url in self.start_urls:
+            yield self.requisicao(url, callback=self.parse, dont_filter=True)
+
+    async def start(self):
+        # Scrapy 2.13 ou mais novo
+        for requisicao in self.start_requests():
+            yield requisicao
+
+    def requisicao(self, url, callback, **kwargs):
+        '''scrapy.Request para url, condicional se url já foi visto'''
+        requisicao = scrapy.Request(url, callback=callback, **kwargs)
+        if self.rastreamento is None:
+            return requisicao
+        cabecalhos = self.rastreamento.cabecalhos(requisicao.url)
+        if not cabecalhos:
+            # um 304 para uma requisição não condicional é descartado como
+            # erro (HttpErrorMiddleware) e a página é pulada
+            return requisicao
+        # o 304 chega ao callback em vez de ser descartado como erro
+        requisicao.meta['handle_httpstatus_list'] = [304]
+        requisicao.headers.update(cabecalhos)
+        return requisicao
+
+    def extrair(self, response, extrator):
+        '''
+        Dados da página: extrator(response) ou, se a resposta for um 304, os
+        dados extraídos no rastreamento em que a página foi baixada.
+        '''
+        if self.rastreamento is None:
+            return extrator(response)
+        # com redirecionamentos, a página fica com a url que foi pedida
+        url = response.meta.get('redirect_urls', [response.url])[0]
+        if response.status == 304:
+            self.crawler.stats.inc_value('incremental/paginas_nao_modificadas')
+            return self.rastreamento.paginas[url]['dados']
+        dados = extrator(response)
+        self.rastreamento.registrar_pagina(url, response.headers, dados)
+        return dados
+
+    def emitir(self, chave, item):
+        '''O item com o campo alteracao, ou None se o item não mudou'''
+        if self.rastreamento is None:
+            return item
+        alteracao = self.rastreamento.registrar_item(chave, item)
+        self.crawler.stats.inc_value(f'incremental/itens_{alteracao or "inalterado"}s')
+        if alteracao is None:
+            return None
+        return dict(item, alteracao=alteracao)
+
+    def closed(self, reason):
+        if self.rastreamento is not None:
+            self.rastreamento.salvar()
+            self.logger.info(f'Estado do rastreamento gravado em {self.estado}')
@@ -0,0 +1,219 @@
+'''
+Servidor HTTP local que imita o books.toscrape.com, para testar o
+rastreamento incremental (rastreamento_incremental.py) sem depender do site.
+
+O catálogo é um arquivo .jl de livros (o books.jl de um rastreamento
+completo serve) e é relido sempre que o arquivo muda: alterar, acrescentar
+ou remover livros entre dois rastreamentos simula as alterações do catálogo.
+Cada página tem ETag (hash do corpo) e Last-Modified (quando o corpo mudou
+pela última vez), e as requisições condicionais de páginas que não mudaram
+recebem 304 (Not Modified).
+
+Rotas:
+    GET /  e  /catalogue/page-<n>.html    listagem, --por-pagina livros por página
+    GET /catalogue/livro-<i>/index.html   página do i-ésimo livro do catálogo
+
+Uso:
+    python servidor_livros.py --catalogo books.jl
+    scrapy runspider books_spider.py -a url=http://localhost:8000/ \\
+        -a estado=books.estado.json -o alteracoes.jl
+'''
+from argparse import ArgumentParser
+from email.utils import formatdate, parsedate_to_datetime
+import hashlib
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+LISTAGEM = re.compile(r'/(?:index\.html)?|/catalogue/page-(\d+)\.html')
+LIVRO = re.compile(r'/catalogue/livro-(\d+)/index\.html')
+
+
+def parse_args():
+    ap = ArgumentParser()
+
+    ap.add_argument(
+        '--catalogo',
+        type=str,
+        required=True,
+        help='Caminho para o arquivo .jl com os livros (url, titulo, descricao)'
+    )
+
+    ap.add_argument(
+        '--endereco',
+        type=str,
+        required=False,
+        default='localhost',
+        help='Endereço em que o servidor escuta (localhost padrão).'
+    )
+
+    ap.add_argument(
+        '--porta',
+        type=int,
+        required=False,
+        default=8000,
+        help='Porta em que o servidor escuta (8000 padrão).'
+    )
+
+    ap.add_argument(
+        '--por-pagina',
+        type=int,
+        required=False,
+        default=20,
+        help='Quantidade de livros por página de listagem (20 padrão).'
+    )
+
+    ap.add_argument(
+        '--sem-validadores',
+        action='store_true',
+        help='Não manda ETag nem Last-Modified e nunca responde 304.'
+    )
+
+    return ap.parse_args()
+
+
+def main(args):
+    servidor = ThreadingHTTPServer((args.endereco, args.porta), Requisicoes)
+    servidor.catalogo = Catalogo(args.catalogo, args.por_pagina)
+    servidor.validadores = not args.sem_validadores
+    print(f'> Servindo {args.catalogo} em http://{args.endereco}:{args.porta}/')
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+class Catalogo:
+    '''Livros do arquivo .jl, relidos quando o arquivo muda, e as páginas com eles'''
+
+    def __init__(self, caminho, por_pagina=20):
+        self.caminho = caminho
+        self.por_pagina = por_pagina
+        self.livros = []
+        self.modificacao_arquivo = None
+        # caminho da página -> (etag, momento da última alteração)
+        self.versoes = {}
+        self.trava = threading.Lock()
+
+    def pagina(self, caminho):
+        '''(corpo, etag, last-modified) da página, ou None se ela não existir'''
+        with self.trava:
+            self._recarregar()
+            corpo = self._montar(caminho)
+            if corpo is None:
+                return None
+            etag = '"' + hashlib.sha1(corpo).hexdigest()[:16] + '"'
+            (etag_anterior, modificado) = self.versoes.get(caminho, (None, None))
+            if etag != etag_anterior:
+                modificado = int(time.time())
+                self.versoes[caminho] = (etag, modificado)
+        return (corpo, etag, formatdate(modificado, usegmt=True))
+
+    def _recarregar(self):
+        modificacao = os.stat(self.caminho).st_mtime_ns
+        if modificacao == self.modificacao_arquivo:
+            return
+        with open(self.caminho, 'r', encoding='utf-8') as arquivo:
+            self.livros = [json.loads(linha) for linha in arquivo if linha.strip()]
+        self.modificacao_arquivo = modificacao
+
+    def _montar(self, caminho):
+        encontrado = LIVRO.fullmatch(caminho)
+        if encontrado:
+            i = int(encontrado.group(1))
+            return self._montar_livro(self.livros[i]) if i < len(self.livros) else None
+
+        encontrado = LISTAGEM.fullmatch(caminho)
+        if encontrado:
+            n = int(encontrado.group(1) or 1)
+            return self._montar_listagem(n)
+        return None
+
+    def _montar_listagem(self, n):
+        inicio = (n - 1) * self.por_pagina
+        if n < 1 or (n > 1 and inicio >= len(self.livros)):
+            return None
+        livros = [
+            f'<article class="product_pod"><h3>'
+            f'<a href="/catalogue/livro-{i}/index.html">{escape(self.livros[i].get("titulo") or "")}</a>'
+            f'</h3></article>'
+            for i in range(inicio, min(inicio + self.por_pagina, len(self.livros)))
+        ]
+        proxima = ''
+        if inicio + self.por_pagina < len(self.livros):
+            proxima = f'<ul class="pager"><li class="next"><a href="/catalogue/page-{n + 1}.html">next</a></li></ul>'
+        return _html(f'Página {n}', '\n'.join(livros) + proxima)
+
+    def _montar_livro(self, livro):
+        titulo = escape(livro.get('titulo') or '')
+        descricao = ''
+        if livro.get('descricao') is not None:
+            descricao = (
+                '<div id="product_description"><h2>Product Description</h2></div>'
+                f'<p>{escape(livro["descricao"])}</p>'
+            )
+        return _html(titulo, f'<div class="product_main"><h1>{titulo}</h1></div>{descricao}')
+
+
+def _html(titulo, corpo):
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{titulo}</title></head>'
+        f'<body>{corpo}</body></html>'
+    ).encode('utf-8')
+
+
+def nao_modificada(cabecalhos, etag, modificado):
+    '''
+    Se a requisição condicional deve receber 304. If-None-Match tem
+    precedência sobre If-Modified-Since (RFC 7232, seção 6).
+    '''
+    etags = cabecalhos.get('If-None-Match')
+    if etags is not None:
+        return etags.strip() == '*' or etag in [e.strip() for e in etags.split(',')]
+
+    desde = cabecalhos.get('If-Modified-Since')
+    if desde is None:
+        return False
+    try:
+        return parsedate_to_datetime(modificado) <= parsedate_to_datetime(desde)
+    except (TypeError, ValueError):
+        return False
+
+
+class Requisicoes(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        pagina = self.server.catalogo.pagina(urlsplit(self.path).path)
+        if pagina is None:
+            self.send_error(404)
+            return
+
+        (corpo, etag, modificado) = pagina
+        validadores = self.server.validadores
+        if validadores and nao_modificada(self.headers, etag, modificado):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', modificado)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        if validadores:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', modificado)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,55 @@
+from array import array
+import json
+import mmap
+
+
+class ArmazemDocumentos:
+    '''
+    Acesso aos documentos (com descrição) de um arquivo .jl sem mantê-los
+    em memória. Guarda apenas a posição em bytes de cada documento; o
+    documento só é lido e decodificado quando acessado por documentos[i].
+
+    A tabela de posições pode ser informada (vinda do índice em disco ou da
+    indexação paralela) ou é registrada na primeira vez em que os documentos
+    são percorridos, de forma que o arquivo é lido uma única vez para montar
+    o índice.
+    '''
+
+    def __init__(self, caminho, posicoes=None):
+        self.caminho = caminho
+        self.posicoes = posicoes
+        self.mm = None
+
+    def __iter__(self):
+        posicoes = array('q') if self.posicoes is None else None
+        with open(self.caminho, 'rb') as f:
+            posicao = 0
+            for linha in f:
+                documento = json.loads(linha)
+                if documento['descricao']:
+                    if posicoes is not None:
+                        posicoes.append(posicao)
+                    yield documento
+                posicao += len(linha)
+
+        if posicoes is not None:
+            self.posicoes = posicoes
+
+    def __len__(self):
+        if self.posicoes is None:
+            for _ in self:
+                pass
+        return len(self.posicoes)
+
+    def __getitem__(self, i):
+        if self.posicoes is None:
+            len(self)
+        if self.mm is None:
+            with open(self.caminho, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        inicio = self.posicoes[i]
+        fim = self.mm.find(b'\n', inicio)
+        if fim < 0:
+            fim = len(self.mm)
+        return json.loads(self.mm[inicio:fim])
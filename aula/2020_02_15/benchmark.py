@@ -0,0 +1,444 @@
+'''
+Benchmark de desempenho e qualidade dos sistemas de busca.
+
+Gera (ou lê) um corpus no formato de books.jl (titulo, url, descricao) e mede:
+- o tempo de construção dos índices de busca_boolean e busca_ordenada;
+- a latência (p50/p95/p99) e a vazão (consultas por segundo) da correção
+  ortográfica, da busca boolean (consultar) e da busca ordenada (consultar
+  e consultar_wand);
+- se consultar_lote retorna os mesmos rankings que consultar, inclusive na
+  ordem dos documentos empatados;
+- o pico de memória (RSS) do processo;
+- a qualidade da busca ordenada (precisão@k, MAP e nDCG@k), dados os
+  julgamentos de relevância (qrels).
+
+O corpus sintético é gerado a partir de tópicos: cada documento pertence a
+um tópico e usa as palavras dele com mais frequência. Para cada tópico são
+gravadas uma consulta e os qrels (os documentos do tópico são relevantes),
+então a qualidade também pode ser medida sem julgamentos manuais.
+
+Formatos:
+    consultas: id<TAB>consulta, uma por linha
+    qrels: id 0 url relevância, uma por linha (formato do TREC)
+
+As buscas recebem doc ids no lugar dos documentos, para que as latências
+medidas sejam as dos algoritmos e não as da leitura do arquivo .jl.
+'''
+from argparse import ArgumentParser
+import json
+import math
+import os
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+import busca_boolean
+import busca_ordenada
+from armazem_documentos import ArmazemDocumentos
+from pontuacao import PONTUACOES
+
+
+SILABAS = [c + v for c in 'bcdfglmnprstv' for v in 'aeiou']
+
+
+def parse_args():
+    ap = ArgumentParser()
+
+    ap.add_argument(
+        '--corpus',
+        type=str,
+        required=False,
+        help='Arquivo .jl com os documentos; se omitido, um corpus sintético é gerado'
+    )
+
+    ap.add_argument(
+        '--n-documentos',
+        type=int,
+        required=False,
+        default=10000,
+        help='Quantidade de documentos do corpus sintético (10000 padrão).'
+    )
+
+    ap.add_argument(
+        '--diretorio',
+        type=str,
+        required=False,
+        default='.',
+        help='Diretório em que o corpus sintético, as consultas e os qrels são gravados.'
+    )
+
+    ap.add_argument(
+        '--consultas',
+        type=str,
+        required=False,
+        help='Arquivo de consultas (id<TAB>consulta); padrão: o gerado com o corpus sintético'
+    )
+
+    ap.add_argument(
+        '--qrels',
+        type=str,
+        required=False,
+        help='Julgamentos de relevância (id 0 url relevância); padrão: os gerados com o corpus sintético'
+    )
+
+    ap.add_argument(
+        '--n-consultas',
+        type=int,
+        required=False,
+        default=1000,
+        help='Quantidade de consultas medidas em cada etapa (1000 padrão).'
+    )
+
+    ap.add_argument(
+        '--k',
+        type=int,
+        required=False,
+        default=10,
+        help='Quantidade de resultados das buscas ordenadas e de precisão@k/nDCG@k (10 padrão).'
+    )
+
+    ap.add_argument(
+        '--pontuacao',
+        type=str,
+        required=False,
+        default='tfidf',
+        choices=PONTUACOES,
+        help='Função de pontuação da busca ordenada (tfidf padrão; ver pontuacao.py).'
+    )
+
+    ap.add_argument(
+        '--semente',
+        type=int,
+        required=False,
+        default=42,
+        help='Semente dos geradores aleatórios (42 padrão).'
+    )
+
+    ap.add_argument(
+        '--saida',
+        type=str,
+        required=False,
+        help='Arquivo JSON em que o relatório é gravado'
+    )
+
+    return ap.parse_args()
+
+
+def main(args):
+    if args.corpus:
+        corpus = args.corpus
+    else:
+        corpus = os.path.join(args.diretorio, f'corpus_{args.n_documentos}.jl')
+        if not os.path.exists(corpus):
+            print(f'> Gerando {corpus}', file=sys.stderr)
+            gerar_corpus(corpus, args.n_documentos, semente=args.semente)
+    base = os.path.splitext(corpus)[0]
+    caminho_consultas = args.consultas or base + '.consultas.tsv'
+    caminho_qrels = args.qrels or base + '.qrels'
+
+    relatorio = {'corpus': corpus, 'pontuacao': args.pontuacao}
+    rng = random.Random(args.semente)
+
+    print('> Construindo os índices', file=sys.stderr)
+    documentos = ArmazemDocumentos(corpus)
+    (indice_boolean, tempo) = cronometrar(busca_boolean.construir_indice_invertido, documentos)
+    relatorio['construcao_boolean_s'] = tempo
+    (ranqueamento, tempo) = cronometrar(construir_ordenado, documentos, args.pontuacao)
+    relatorio['construcao_ordenado_s'] = tempo
+    (indice_ordenado, k_grams, M, ids_termos, normas, blocos) = ranqueamento
+    relatorio['n_documentos'] = len(documentos)
+    relatorio['n_termos'] = len(ids_termos)
+    doc_ids = range(len(documentos))
+
+    # consultas de 1 a 3 termos, sorteados com a frequência dos termos no corpus
+    termos = list(indice_boolean)
+    pesos = [len(indice_boolean[t]) for t in termos]
+    consultas = [
+        rng.choices(termos, pesos, k=rng.randint(1, 3))
+        for _ in range(args.n_consultas)
+    ]
+    erros = [errar(rng.choice(termos), rng) for _ in range(args.n_consultas)]
+
+    print('> Medindo as consultas', file=sys.stderr)
+    relatorio['correcao_levenshtein'] = resumir(medir(
+        lambda t: busca_boolean.obter_termo_corrigido(t, k_grams), erros
+    ))
+    relatorio['correcao_jaccard'] = resumir(medir(
+        lambda t: busca_ordenada.obter_termo_corrigido(t, k_grams), erros
+    ))
+    relatorio['boolean'] = resumir(medir(
+        lambda c: list(busca_boolean.consultar(c, indice_boolean, doc_ids)), consultas
+    ))
+    relatorio['ordenado'] = resumir(medir(
+        lambda c: list(busca_ordenada.consultar(c, M, ids_termos, normas, doc_ids, k=args.k)),
+        consultas
+    ))
+    relatorio['ordenado_wand'] = resumir(medir(
+        lambda c: list(busca_ordenada.consultar_wand(
+            c, M, ids_termos, normas, blocos, doc_ids, k=args.k
+        )),
+        consultas
+    ))
+
+    relatorio['lote'] = comparar_lote(consultas, M, ids_termos, normas, args.k)
+
+    if os.path.exists(caminho_consultas) and os.path.exists(caminho_qrels):
+        print('> Medindo a qualidade', file=sys.stderr)
+        julgamentos = ler_qrels(caminho_qrels)
+        urls = [documentos[i]['url'] for i in doc_ids]
+        relatorio['qualidade'] = avaliar_qualidade(
+            ler_consultas(caminho_consultas), julgamentos, urls,
+            lambda c: busca_ordenada.consultar(
+                busca_ordenada.normalizar_tokens(c.split()), M, ids_termos, normas, doc_ids
+            ),
+            args.k
+        )
+
+    relatorio['rss_pico_mb'] = rss_pico_mb()
+    imprimir_relatorio(relatorio)
+    if args.saida:
+        with open(args.saida, 'w') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+
+
+def gerar_corpus(caminho, n_documentos, tamanho_vocabulario=20000, n_topicos=100,
+                 palavras_por_topico=5, semente=42):
+    '''
+    Grava um corpus sintético no formato de books.jl, com as consultas e os
+    qrels de cada tópico ao lado (mesmo nome, extensões .consultas.tsv e .qrels).
+    A frequência das palavras segue a lei de Zipf.
+    '''
+    rng = np.random.default_rng(semente)
+    vocabulario = gerar_vocabulario(tamanho_vocabulario, rng)
+    zipf = 1 / np.arange(1, tamanho_vocabulario + 1)
+    zipf /= zipf.sum()
+    # as palavras dos tópicos não são nem muito raras nem muito frequentes
+    palavras_topicos = rng.choice(
+        np.arange(100, min(5000, tamanho_vocabulario)),
+        size=(n_topicos, palavras_por_topico), replace=False
+    )
+
+    base = os.path.splitext(caminho)[0]
+    with open(caminho, 'w') as f, open(base + '.qrels', 'w') as qrels:
+        bloco = 10000
+        for inicio in range(0, n_documentos, bloco):
+            n = min(bloco, n_documentos - inicio)
+            topicos = rng.integers(n_topicos, size=n)
+            tamanhos = rng.integers(20, 60, size=n)
+            fundo = rng.choice(tamanho_vocabulario, size=(n, 60), p=zipf)
+            do_topico = rng.integers(palavras_por_topico, size=(n, 60))
+            usar_topico = rng.random((n, 60)) < 0.25
+            for i in range(n):
+                palavras = np.where(
+                    usar_topico[i], palavras_topicos[topicos[i]][do_topico[i]], fundo[i]
+                )[:tamanhos[i]]
+                descricao = ' '.join(vocabulario[p] for p in palavras)
+                doc_id = inicio + i
+                url = f'http://books.toscrape.com/sintetico/{doc_id}'
+                documento = {
+                    'url': url,
+                    'titulo': ' '.join(vocabulario[p] for p in palavras[:3]).title(),
+                    'descricao': descricao,
+                }
+                f.write(json.dumps(documento) + '\n')
+                qrels.write(f'{topicos[i]} 0 {url} 1\n')
+
+    with open(base + '.consultas.tsv', 'w') as f:
+        for (topico, palavras) in enumerate(palavras_topicos):
+            f.write(f'{topico}\t{vocabulario[palavras[0]]} {vocabulario[palavras[1]]}\n')
+
+
+def gerar_vocabulario(tamanho, rng):
+    '''Retorna tamanho pseudo-palavras distintas, de 2 a 4 sílabas'''
+    vocabulario = []
+    vistas = set()
+    while len(vocabulario) < tamanho:
+        palavra = ''.join(rng.choice(SILABAS, size=rng.integers(2, 5)))
+        if palavra not in vistas:
+            vistas.add(palavra)
+            vocabulario.append(palavra)
+    return vocabulario
+
+
+def errar(termo, rng):
+    '''Aplica um erro de digitação (inserção, remoção ou troca) ao termo'''
+    i = rng.randrange(len(termo))
+    letra = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    operacao = rng.randrange(3)
+    if operacao == 0:
+        return termo[:i] + letra + termo[i:]
+    if operacao == 1 and len(termo) > 1:
+        return termo[:i] + termo[i + 1:]
+    return termo[:i] + letra + termo[i + 1:]
+
+
+def construir_ordenado(documentos, pontuacao='tfidf'):
+    '''Constrói todas as estruturas usadas por busca_ordenada'''
+    indice_invertido = busca_ordenada.construir_indice_invertido(documentos)
+    k_grams = busca_ordenada.construir_indice_k_grams(indice_invertido, k=3)
+    (M, ids_termos, cosseno) = busca_ordenada.construir_matriz_pesos(
+        indice_invertido, documentos, pontuacao
+    )
+    normas = busca_ordenada.calcular_normas(M) if cosseno else None
+    blocos = busca_ordenada.calcular_maximos_blocos(M, normas)
+    return (indice_invertido, k_grams, M, ids_termos, normas, blocos)
+
+
+def cronometrar(funcao, *args):
+    '''Retorna (resultado, segundos) de funcao(*args)'''
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    return (resultado, time.perf_counter() - inicio)
+
+
+def medir(funcao, entradas):
+    '''Retorna a latência, em segundos, de funcao para cada entrada'''
+    latencias = []
+    for entrada in entradas:
+        inicio = time.perf_counter()
+        funcao(entrada)
+        latencias.append(time.perf_counter() - inicio)
+    return latencias
+
+
+def resumir(latencias):
+    '''Percentis de latência (em milissegundos) e vazão (consultas por segundo)'''
+    (p50, p95, p99) = np.percentile(latencias, [50, 95, 99]) * 1000
+    total = sum(latencias)
+    return {
+        'n': len(latencias),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'qps': len(latencias) / total if total else float('inf'),
+    }
+
+
+def comparar_lote(consultas, M, ids_termos, normas, k):
+    '''
+    Quantidade de consultas cujo ranking de consultar_lote difere do de
+    consultar (deve ser zero) e quantidade de consultas com empates nos k
+    primeiros, em que a ordem depende de as similaridades serem idênticas.
+    '''
+    (divergencias, empates) = (0, 0)
+    resultados = busca_ordenada.consultar_lote(consultas, M, ids_termos, normas, k=k)
+    doc_ids = range(M.shape[1])
+    for (consulta, (ids_lote, similaridades)) in zip(consultas, resultados):
+        ids_consulta = list(busca_ordenada.consultar(
+            consulta, M, ids_termos, normas, doc_ids, k=k
+        ))
+        if list(ids_lote) != ids_consulta:
+            divergencias += 1
+        if len(np.unique(similaridades)) < len(similaridades):
+            empates += 1
+    return {'divergencias': divergencias, 'consultas_com_empates': empates}
+
+
+def rss_pico_mb():
+    '''Pico de memória residente do processo, em MB'''
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é em KB no Linux e em bytes no macOS
+    if sys.platform == 'darwin':
+        return pico / (1 << 20)
+    return pico / (1 << 10)
+
+
+def ler_consultas(caminho):
+    '''Retorna um dicionário de id para o texto da consulta'''
+    consultas = {}
+    with open(caminho, 'r') as f:
+        for linha in f:
+            if linha.strip():
+                (id_consulta, texto) = linha.rstrip('\n').split('\t', 1)
+                consultas[id_consulta] = texto
+    return consultas
+
+
+def ler_qrels(caminho):
+    '''Retorna um dicionário de id da consulta para {url: relevância}'''
+    julgamentos = {}
+    with open(caminho, 'r') as f:
+        for linha in f:
+            if linha.strip():
+                (id_consulta, _, url, relevancia) = linha.split()
+                julgamentos.setdefault(id_consulta, {})[url] = int(relevancia)
+    return julgamentos
+
+
+def avaliar_qualidade(consultas, julgamentos, urls, buscar, k=10):
+    '''
+    Médias de precisão@k, MAP e nDCG@k das consultas que têm julgamentos.
+    buscar recebe o texto da consulta e retorna os doc ids em ordem.
+    '''
+    (precisoes, medias, ndcgs) = ([], [], [])
+    for (id_consulta, texto) in consultas.items():
+        relevancias = julgamentos.get(id_consulta)
+        if not relevancias:
+            continue
+        ranking = [urls[d] for d in buscar(texto)]
+        precisoes.append(precisao_em_k(ranking, relevancias, k))
+        medias.append(precisao_media(ranking, relevancias))
+        ndcgs.append(ndcg_em_k(ranking, relevancias, k))
+
+    n = len(precisoes)
+    return {
+        'n_consultas': n,
+        f'precisao@{k}': sum(precisoes) / n if n else 0.0,
+        'map': sum(medias) / n if n else 0.0,
+        f'ndcg@{k}': sum(ndcgs) / n if n else 0.0,
+    }
+
+
+def precisao_em_k(ranking, relevancias, k):
+    '''Fração dos k primeiros resultados que são relevantes'''
+    return sum(1 for d in ranking[:k] if relevancias.get(d, 0) > 0) / k
+
+
+def precisao_media(ranking, relevancias):
+    '''Average precision: média da precisão nas posições dos documentos relevantes'''
+    n_relevantes = sum(1 for r in relevancias.values() if r > 0)
+    if not n_relevantes:
+        return 0.0
+    (acertos, soma) = (0, 0.0)
+    for (i, d) in enumerate(ranking):
+        if relevancias.get(d, 0) > 0:
+            acertos += 1
+            soma += acertos / (i + 1)
+    return soma / n_relevantes
+
+
+def ndcg_em_k(ranking, relevancias, k):
+    '''DCG dos k primeiros resultados dividido pelo DCG da ordenação ideal'''
+    def dcg(ganhos):
+        return sum((2 ** g - 1) / math.log2(i + 2) for (i, g) in enumerate(ganhos))
+
+    ideal = dcg(sorted(relevancias.values(), reverse=True)[:k])
+    if not ideal:
+        return 0.0
+    return dcg([relevancias.get(d, 0) for d in ranking[:k]]) / ideal
+
+
+def imprimir_relatorio(relatorio):
+    print(f'Corpus: {relatorio["corpus"]} ({relatorio["n_documentos"]} documentos, '
+          f'{relatorio["n_termos"]} termos), pontuação {relatorio["pontuacao"]}')
+    print(f'Construção: boolean {relatorio["construcao_boolean_s"]:.2f}s, '
+          f'ordenado {relatorio["construcao_ordenado_s"]:.2f}s')
+    print(f'{"etapa":<22}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"qps":>12}')
+    for etapa in ['correcao_levenshtein', 'correcao_jaccard', 'boolean', 'ordenado', 'ordenado_wand']:
+        r = relatorio[etapa]
+        print(f'{etapa:<22}{r["p50_ms"]:>10.3f}{r["p95_ms"]:>10.3f}{r["p99_ms"]:>10.3f}{r["qps"]:>12.1f}')
+    print(f'consultar_lote: {relatorio["lote"]["divergencias"]} rankings diferentes de consultar '
+          f'({relatorio["lote"]["consultas_com_empates"]} consultas com empates)')
+    if 'qualidade' in relatorio:
+        print('Qualidade:', ', '.join(
+            f'{m} {v:.4f}' if isinstance(v, float) else f'{m} {v}'
+            for (m, v) in relatorio['qualidade'].items()
+        ))
+    print(f'Pico de memória: {relatorio["rss_pico_mb"]:.1f} MB')
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -1,8 +1,35 @@
 from argparse import ArgumentParser
+from bisect import bisect_left
+from collections import Counter
+import heapq
+from itertools import islice
 import json
-import re
+import math
 
-import numpy as np
+from armazem_documentos import ArmazemDocumentos
+from cache_consultas import CAPACIDADE, CacheConsultas
+from curingas import expandir_curingas, tem_curinga
+from correcao_symspell import DISTANCIA_MAXIMA, TAMANHO_PREFIXO, IndiceSymSpell
+from distancia_edicao import levenshtein_myers, preparar_myers
+from expressao_booleana import analisar, formatar, mapear_termos, obter_termos, tem_proximidade
+from indexacao_paralela import construir_indice_invertido_paralelo
+from indice_disco import carregar_indice
+from indice_posicional import IndicePosicional, filtrar_frase, filtrar_proximidade
+import instrumentacao
+from instrumentacao import ativa, contar, etapa, rastrear
+from postings import PostingsComprimida, comprimir_indice
+import vocabulario
+from vocabulario import IndiceInvertido
+
+
+# a partir dessa razão entre os tamanhos das listas, intersect usa busca
+# exponencial na lista maior ao invés de percorrê-la inteira
+RAZAO_GALOPE = 8
+
+# coeficiente de Jaccard mínimo para um termo ser sugerido como correção
+JACCARD_MINIMO = 0.2
+
+ERRO_POSICIONAL = 'Frases e NEAR/k precisam do índice posicional (--posicional)'
 
 
 def parse_args():
@@ -23,41 +50,217 @@ def parse_args():
         help='Quantidade máxima de resultados (10 padrão) para retornar na busca.'
     )
 
-    return ap.parse_args()
+    ap.add_argument(
+        '--comprimir',
+        action='store_true',
+        help='Mantém as listas de postings comprimidas (gaps + variable byte) em memória.'
+    )
+
+    ap.add_argument(
+        '--posicional',
+        action='store_true',
+        help='Monta o índice posicional, que permite consultas por frase ("harry potter") e NEAR/k.'
+    )
+
+    ap.add_argument(
+        '--sem-acentos',
+        action='store_true',
+        help='Remove os acentos dos documentos e das consultas ("ação" vira "acao"); com --indice, vale o do índice.'
+    )
+
+    ap.add_argument(
+        '--indice',
+        type=str,
+        required=False,
+        help='Arquivo de índice gravado por construir_indice.py; se informado, o índice não é montado'
+    )
+
+    ap.add_argument(
+        '--processos',
+        type=int,
+        required=False,
+        default=1,
+        help='Quantidade de processos usados para montar o índice (1 padrão).'
+    )
+
+    ap.add_argument(
+        '--corretor',
+        type=str,
+        required=False,
+        default='levenshtein',
+        choices=['levenshtein', 'jaccard', 'symspell'],
+        help='Algoritmo de correção ortográfica (levenshtein padrão).'
+    )
+
+    ap.add_argument(
+        '--symspell-distancia',
+        type=int,
+        required=False,
+        default=DISTANCIA_MAXIMA,
+        help='Distância máxima corrigida pelo symspell (2 padrão).'
+    )
+
+    ap.add_argument(
+        '--symspell-prefixo',
+        type=int,
+        required=False,
+        default=TAMANHO_PREFIXO,
+        help='Tamanho do prefixo indexado pelo symspell (7 padrão); menor usa menos memória.'
+    )
+
+    ap.add_argument(
+        '--cache',
+        type=int,
+        required=False,
+        default=CAPACIDADE,
+        help=f'Quantidade de consultas guardadas no cache ({CAPACIDADE} padrão); 0 desativa.'
+    )
+
+    ap.add_argument(
+        '--cache-ttl',
+        type=float,
+        required=False,
+        default=None,
+        help='Validade em segundos das entradas do cache (sem expiração por padrão).'
+    )
+
+    ap.add_argument(
+        '--instrumentar',
+        action='store_true',
+        help='Mede o tempo de cada etapa e os contadores de cada consulta e mostra o rastro.'
+    )
+
+    ap.add_argument(
+        '--metricas',
+        type=str,
+        required=False,
+        help='Grava os totais da instrumentação ao sair (Prometheus se terminar em .prom, senão JSON).'
+    )
+
+    ap.add_argument(
+        '--perfil',
+        action='store_true',
+        help='Executa o profiler por amostragem e mostra as funções mais custosas ao sair.'
+    )
+
+    args = ap.parse_args()
+    # o índice posicional é montado em memória, sem compressão e em um único processo
+    if args.posicional and (args.comprimir or args.processos > 1 or args.indice):
+        ap.error('--posicional não pode ser usado com --comprimir, --processos ou --indice')
+    return args
 
 
 def main(args):
     print('Bem-vindo ao sistema de busca de livros.')
-    print('> Para pesquisar, digite palavras separadas por um "AND"')
+    print('> Para pesquisar, combine palavras com AND, OR, NOT e parênteses')
+    print('> Exemplo: (magic OR wizard) AND NOT vampire')
+    print('> Curingas: harr*, *otter, h*ry')
+    if args.posicional:
+        print('> Frases entre aspas e proximidade: "harry potter" OR magic NEAR/3 school')
     print('> Pressione ENTER sem nenhuma palavras para sair')
-    print('> Montando o índice para acelerar as consultas')
-    documentos = list(ler_documentos(args.documentos))
-    indice_invertido = construir_indice_invertido(documentos)
-    indice_k_grams = construir_indice_k_grams(indice_invertido, k=3)
+    if args.indice:
+        print(f'> Abrindo o índice {args.indice}')
+        indice = carregar_indice(args.indice)
+        documentos = indice.abrir_documentos(args.documentos)
+        (indice_invertido, indice_k_grams) = (indice.postings, indice.k_grams)
+        k = indice.k
+        frequencias = indice.frequencias
+        sem_acentos = indice.sem_acentos
+    else:
+        print('> Montando o índice para acelerar as consultas')
+        sem_acentos = args.sem_acentos
+        if args.posicional:
+            documentos = ArmazemDocumentos(args.documentos)
+            indice_invertido = construir_indice_posicional(documentos, sem_acentos)
+        elif args.processos > 1:
+            (indice_invertido, posicoes) = construir_indice_invertido_paralelo(
+                args.documentos, args.processos, sem_acentos=sem_acentos
+            )
+            documentos = ArmazemDocumentos(args.documentos, posicoes)
+        else:
+            documentos = ArmazemDocumentos(args.documentos)
+            indice_invertido = construir_indice_invertido(documentos, sem_acentos)
+        k = 3
+        indice_k_grams = construir_indice_k_grams(indice_invertido, k=k)
+        if args.comprimir:
+            indice_invertido = comprimir_indice(indice_invertido)
+        frequencias = lambda: {t: len(p) for (t, p) in indice_invertido.items()}
+    corretor = None
+    if args.corretor == 'jaccard':
+        corretor = lambda termo: obter_termo_corrigido_jaccard(termo, indice_k_grams, k=k)
+    elif args.corretor == 'symspell':
+        print('> Montando o índice de deleções do symspell')
+        corretor = IndiceSymSpell(
+            frequencias(), args.symspell_distancia, args.symspell_prefixo
+        ).corrigir
+    cache = CacheConsultas(args.cache, args.cache_ttl)
+    corrigir = corretor or (lambda termo: obter_termo_corrigido(termo, indice_k_grams, k=k))
+    corretor = lambda termo: cache.obter(('correcao', termo), lambda: corrigir(termo))
+    instrumentacao.ativar(args.instrumentar or bool(args.metricas))
+    amostrador = instrumentacao.Amostrador() if args.perfil else None
+    if amostrador:
+        amostrador.iniciar()
     while True:
         print('=' * 80)
         print('=' * 80)
         consulta = input('Qual é a sua consulta? ')
         consulta = consulta.strip()
         if not consulta:
+            print(f'> Cache: {cache.estatisticas()}')
+            if args.metricas:
+                instrumentacao.gravar_metricas(args.metricas)
+            if amostrador:
+                amostrador.finalizar()
+                print(amostrador.relatorio())
             print('Saindo...')
             break
 
-        termos = normalizar_tokens(consulta.split('AND'))
-        termos_ = aplicar_correcao_ortografica(termos, indice_invertido, indice_k_grams)
-        if termos_ != termos:
-            termos = termos_
-            print(f'Você quis dizer "{" AND ".join(termos)}"?')
-        else:
-            print(f'Resultados para {consulta}')
+        with rastrear(consulta) as rastro:
+            try:
+                with etapa('tokens'):
+                    arvore = analisar(consulta)
+                    arvore = mapear_termos(arvore, lambda t: normalizar_tokens([t], sem_acentos)[0])
+                with etapa('curingas'):
+                    arvore = expandir_curingas(arvore, indice_invertido, indice_k_grams, k=k)
+                if tem_proximidade(arvore) and not isinstance(indice_invertido, IndicePosicional):
+                    raise ValueError(ERRO_POSICIONAL)
+            except ValueError as e:
+                print(e)
+                continue
+            # padrões que não foram expandidos não são corrigidos
+            termos = [t for t in obter_termos(arvore) if not tem_curinga(t)]
+
+            with etapa('correcao'):
+                termos_ = aplicar_correcao_ortografica(
+                    termos, indice_invertido, indice_k_grams, corretor
+                )
+            correcoes = dict(zip(termos, termos_))
+            arvore_ = mapear_termos(arvore, lambda t: correcoes.get(t, t))
+            if arvore_ != arvore:
+                arvore = arvore_
+                print(f'Você quis dizer "{formatar(arvore)}"?')
+            else:
+                print(f'Resultados para {consulta}')
 
-        print()
-        resultados = consultar(termos, indice_invertido, documentos)
-        for (documento, i) in zip(resultados, range(args.n_resultados)):
+            print()
+            with etapa('intersecao'):
+                try:
+                    resultados = cache.obter(
+                        ('resultados', formatar(arvore), args.n_resultados),
+                        lambda: list(islice(
+                            consultar_expressao(arvore, indice_invertido, documentos), args.n_resultados
+                        ))
+                    )
+                except ValueError as e:
+                    print(e)
+                    continue
+        for (i, documento) in enumerate(resultados):
             print(f'{i + 1}. {documento["titulo"]}')
             print(documento["url"])
             print('>', documento['descricao'][:100], '...')
             print()
+        if rastro:
+            print(f'> Rastro: {rastro}')
 
 
 def ler_documentos(caminho_documentos):
@@ -68,39 +271,47 @@ def ler_documentos(caminho_documentos):
                 yield documento
 
 
-def construir_indice_invertido(documentos):
+def construir_indice_invertido(documentos, sem_acentos=False):
     '''
     Essa função constrói e retorna um índice invertido.
     Entrada: Lista de documentos (strings)
-    Saída: Dicionário de termos para lista de documentos
+    Saída: IndiceInvertido (vocabulario.py), que funciona como um dicionário
+    de termos para lista de documentos
     '''
     # Exercício 1
-    indice_invertido = {}
-    documentos_tokens = [
-        obter_tokens(d['descricao'])
-        for d in documentos
-    ]
-    for (doc_id, doc_tokens) in enumerate(documentos_tokens):
-        for token in doc_tokens:
-            if token not in indice_invertido:
-                indice_invertido[token] = [doc_id]
-            elif doc_id != indice_invertido[token][-1]:
-                indice_invertido[token].append(doc_id)
+    indice_invertido = IndiceInvertido()
+    for (doc_id, documento) in enumerate(documentos):
+        indice_invertido.adicionar(doc_id, obter_tokens(documento['descricao'], sem_acentos))
 
     return indice_invertido
 
 
+def construir_indice_posicional(documentos, sem_acentos=False):
+    '''
+    Constrói o índice invertido posicional (ver indice_posicional).
+    Entrada: Lista de documentos (strings)
+    Saída: IndicePosicional, que também funciona como o índice invertido
+    '''
+    indice = IndicePosicional()
+    for (doc_id, documento) in enumerate(documentos):
+        indice.adicionar(doc_id, obter_tokens(documento['descricao'], sem_acentos))
+    return indice
+
+
 def construir_indice_k_grams(indice_invertido, k=3):
     '''
-    Constrói um índice que mapeia de k-grams para termos
+    Constrói um índice que mapeia de k-grams para termos.
+    Cada k-gram aponta para um dicionário de termo para a quantidade de
+    k-grams do termo, usada no cálculo do coeficiente de Jaccard.
     '''
     indice_k_grams = {}
     for termo in indice_invertido:
-        for k_gram in obter_k_grams(termo, k):
+        k_grams = obter_k_grams(termo, k)
+        for k_gram in k_grams:
             if k_gram not in indice_k_grams:
-                indice_k_grams[k_gram] = {termo}
+                indice_k_grams[k_gram] = {termo: len(k_grams)}
             else:
-                indice_k_grams[k_gram].add(termo)
+                indice_k_grams[k_gram][termo] = len(k_grams)
     
     return indice_k_grams
 
@@ -114,21 +325,21 @@ def obter_k_grams(termo, k=3):
     return {termo_pad[i:i + k] for i in range(len(termo_pad) - pad)}
 
 
-def obter_tokens(documento):
+def obter_tokens(documento, sem_acentos=False):
     '''Quebra um texto em sequências de palavras normalizadas em lower case'''
-    tokens = re.findall(r'(?:\b(\w+)\b)', documento)
-    return normalizar_tokens(tokens)
+    return vocabulario.obter_tokens(documento, sem_acentos)
 
 
-def normalizar_tokens(tokens):
+def normalizar_tokens(tokens, sem_acentos=False):
     '''Coloca os tokens em lower case e remove espaços no começo/final'''
-    return [t.strip().lower() for t in tokens]
+    return vocabulario.normalizar_tokens(tokens, sem_acentos)
 
 
-def aplicar_correcao_ortografica(termos, indice_invertido, indice_k_grams):
+def aplicar_correcao_ortografica(termos, indice_invertido, indice_k_grams, corretor=None):
     '''Retorna termos com correção ortográfica.
     Se o termo existe no índice inverto, mantém.
-    Se não existe, encontra a melhor correção ortográfica.
+    Se não existe, encontra a melhor correção ortográfica com corretor
+    (função de termo para termo corrigido; padrão: obter_termo_corrigido).
     '''
     termos_corrigidos = []
     # termos = ['harry', 'potter']
@@ -137,99 +348,349 @@ def aplicar_correcao_ortografica(termos, indice_invertido, indice_k_grams):
             termos_corrigidos.append(termo)
         else:
             # termo = 'hary'
-            correcao = obter_termo_corrigido(termo, indice_k_grams)
+            if corretor:
+                correcao = corretor(termo)
+            else:
+                correcao = obter_termo_corrigido(termo, indice_k_grams)
             termos_corrigidos.append(correcao)
 
     return termos_corrigidos
 
 
-def obter_termo_corrigido(termo, indice_k_grams):
-    candidatos = set()
-    k_grams = obter_k_grams(termo, k=3)
+def obter_termo_corrigido(termo, indice_k_grams, k=None):
+    '''
+    Encontra o termo do índice k-grams com a menor distância de Levenshtein.
+    Os candidatos são avaliados em ordem decrescente de k-grams em comum com
+    o termo. Como cada edição altera no máximo k k-grams, a quantidade de
+    k-grams em comum dá um limite inferior para a distância; a busca para
+    quando esse limite passa da melhor distância encontrada. Candidatos cuja
+    diferença de tamanho já é maior que a melhor distância são descartados
+    sem calcular a distância, e o cálculo da distância para assim que ela
+    passa da melhor.
+    Nos empates, prefere o candidato com mais k-grams em comum.
+    Se k não for informado, é o tamanho dos k-grams do índice.
+    '''
+    if k is None:
+        k = len(next(iter(indice_k_grams.keys())))
+    k_grams = obter_k_grams(termo, k=k)
+    comuns = Counter()
     for k_gram in k_grams:
-        c = indice_k_grams.get(k_gram, set())
-        candidatos = candidatos.union(c)
-
-    min_lev = (9999, '')
-    for tc in candidatos:
-        l = levenshtein(termo, tc)
-        if l < min_lev[0]:
-            min_lev = (l, tc)
-
-    return min_lev[1]
-
-
-def levenshtein(t1, t2):
-    D = np.zeros(shape=(len(t1) + 1, len(t2) + 1))
-    for i in range(D.shape[0]):
-        for j in range(D.shape[1]):
-            if i == 0 and j > 0:
-                D[i, j] = j
-            elif j == 0 and i > 0:
-                D[i, j] = i
-            else:
-                a = D[i - 1, j] + 1
-                d = D[i, j - 1] + 1
-                c = int(t1[i - 1] != t2[j - 1])
-                r = D[i - 1, j - 1] + c
-                D[i, j] = min(a, d, r)
-    return D[-1, -1]
+        comuns.update(indice_k_grams.get(k_gram, {}).keys())
+
+    peq = preparar_myers(termo)
+    melhor = (math.inf, 0, '')
+    avaliados = 0
+    for (tc, n_comuns) in sorted(comuns.items(), key=lambda x: (-x[1], x[0])):
+        if math.ceil((len(k_grams) - n_comuns) / k) > melhor[0]:
+            break
+        if abs(len(tc) - len(termo)) > melhor[0]:
+            continue
+        avaliados += 1
+        d = levenshtein_myers(termo, tc, peq, limite=melhor[0])
+        if d < melhor[0]:
+            melhor = (d, n_comuns, tc)
 
-def obter_termo_corrigido_jaccard(termo, indice_k_grams):
+    contar('candidatos_correcao', avaliados)
+    return melhor[2]
+
+
+def obter_termo_corrigido_jaccard(termo, indice_k_grams, k=None, limiar=JACCARD_MINIMO):
     '''
     Encontra a melhor correção ortográfica de um determinado termo utilizando
-    o índice k-grams.
+    o índice k-grams (maior coeficiente de Jaccard, de pelo menos limiar).
+    Se k não for informado, é o tamanho dos k-grams do índice.
     '''
-    candidatos = set()
-    k_grams = obter_k_grams(termo, k=3)
-    for k_gram in k_grams:
-        c = indice_k_grams.get(k_gram, set())
-        candidatos = candidatos.union(c)
+    if k is None:
+        k = len(next(iter(indice_k_grams.keys())))
+    k_grams = obter_k_grams(termo, k=k)
+    return max(jaccard(k_grams, indice_k_grams, limiar), default=(0, ''))[1]
 
-    max_jaccard = (0, '')
-    for tc in candidatos:
-        c_k_grams = obter_k_grams(tc, 3)
-        i = len(c_k_grams & k_grams)
-        u = len(c_k_grams | k_grams)
-        jaccard = i / u
-        if jaccard > max_jaccard[0]:
-            max_jaccard = (jaccard, tc)
-    return max_jaccard[1]
 
+def jaccard(k_grams, indice_k_grams, limiar=JACCARD_MINIMO):
+    '''
+    Retorna (coeficiente de Jaccard, candidato) para os termos do índice
+    k-grams cujo Jaccard com k_grams é pelo menos limiar.
+    O índice k-grams guarda a quantidade de k-grams de cada termo, então o
+    Jaccard sai da contagem de k-grams em comum, feita em uma única passada.
+    Como J = c / (n + n_c - c) <= c / n, um candidato precisa ter pelo menos
+    ceil(limiar * n) k-grams em comum com o termo; logo, ele aparece em algum
+    dos n - ceil(limiar * n) + 1 k-grams menos frequentes do termo. Só esses
+    k-grams geram candidatos; os demais apenas completam a contagem.
+    '''
+    n = len(k_grams)
+    minimo = max(1, math.ceil(limiar * n))
+    postings = sorted((indice_k_grams.get(k_gram, {}) for k_gram in k_grams), key=len)
+    prefixo = n - minimo + 1
+
+    comuns = Counter()
+    tamanhos = {}
+    for p in postings[:prefixo]:
+        comuns.update(p.keys())
+        tamanhos.update(p)
+
+    # J <= min(n, n_c) / max(n, n_c): descarta candidatos de tamanho incompatível
+    candidatos = [
+        c for c in comuns
+        if limiar * n <= tamanhos[c] and limiar * tamanhos[c] <= n
+    ]
+    for p in postings[prefixo:]:
+        for candidato in candidatos:
+            if candidato in p:
+                comuns[candidato] += 1
+
+    for candidato in candidatos:
+        c = comuns[candidato]
+        j = c / (n + tamanhos[candidato] - c)
+        if j >= limiar:
+            yield (j, candidato)
 
 
 def consultar(termos_consulta, indice_invertido, documentos):
     '''
     Retorna todos os documentos que contém todos os termos de consulta.
-    Como seria essa rotina se usássemos set() do python como estrutura de dados ao invés de list()?
-    Como seriam as operações OR e NOT?
-    '''
-    p1 = termos_consulta.pop(0)
-    resultados = indice_invertido.get(p1, [])
-    while termos_consulta:
-        p2 = termos_consulta.pop(0)
-        resultados = intersect(indice_invertido.get(p2, []), resultados)
-    
+    As listas de postings são intersectadas em ordem crescente de tamanho
+    (frequência de documento), assim os resultados intermediários são sempre
+    os menores possíveis.
+    '''
+    postings = sorted(
+        (indice_invertido.get(t, []) for t in termos_consulta),
+        key=len
+    )
+    if not postings:
+        return
+    if ativa():
+        contar('postings_lidas', sum(len(p) for p in postings))
+
+    resultados = postings[0]
+    for p in postings[1:]:
+        if not resultados:
+            break
+        resultados = intersect(resultados, p)
+
     for i in resultados:
         yield documentos[i]
 
 
+def consultar_expressao(arvore, indice_invertido, documentos):
+    '''
+    Retorna os documentos que satisfazem a expressão booleana (árvore gerada
+    por expressao_booleana.analisar), com AND, OR e NOT.
+    '''
+    arvore = planejar(arvore, indice_invertido)
+    for i in avaliar(arvore, indice_invertido, len(documentos)):
+        yield documentos[i]
+
+
+def planejar(arvore, indice_invertido):
+    '''
+    Reescreve a árvore da consulta para avaliá-la com o menor custo:
+    - junta operadores iguais aninhados ((a AND b) AND c vira a AND b AND c);
+    - elimina negações duplas;
+    - ordena os operandos de cada AND pelo tamanho estimado do resultado,
+      deixando as negações por último para serem aplicadas como diferença.
+    '''
+    tipo = arvore[0]
+    if tipo in ('TERMO', 'FRASE', 'NEAR'):
+        return arvore
+
+    if tipo == 'NOT':
+        filho = planejar(arvore[1], indice_invertido)
+        if filho[0] == 'NOT':
+            return filho[1]
+        return ('NOT', filho)
+
+    filhos = []
+    for filho in arvore[1]:
+        filho = planejar(filho, indice_invertido)
+        if filho[0] == tipo:
+            filhos.extend(filho[1])
+        else:
+            filhos.append(filho)
+
+    if tipo == 'AND':
+        filhos.sort(key=lambda f: (f[0] == 'NOT', estimar_tamanho(f, indice_invertido)))
+    return (tipo, filhos)
+
+
+def estimar_tamanho(arvore, indice_invertido):
+    '''
+    Limite superior da quantidade de documentos do resultado de uma subárvore,
+    calculado apenas com o tamanho das listas de postings.
+    '''
+    tipo = arvore[0]
+    if tipo == 'TERMO':
+        return len(indice_invertido.get(arvore[1], []))
+    if tipo == 'NOT':
+        return math.inf
+    if tipo in ('FRASE', 'NEAR'):
+        return estimar_tamanho(('AND', arvore[1]), indice_invertido)
+    tamanhos = [estimar_tamanho(f, indice_invertido) for f in arvore[1]]
+    if tipo == 'AND':
+        return min(tamanhos)
+    return sum(tamanhos)
+
+
+def avaliar(arvore, indice_invertido, n_documentos):
+    '''
+    Avalia a árvore (já planejada) e retorna a lista ordenada de doc ids.
+    O complemento de uma negação só é materializado quando ela não faz parte
+    de um AND com algum operando positivo; nesse caso é aplicada como diferença.
+    '''
+    tipo = arvore[0]
+    if tipo == 'TERMO':
+        postings = indice_invertido.get(arvore[1], [])
+        contar('postings_lidas', len(postings))
+        return postings
+
+    if tipo == 'NOT':
+        return diferenca(range(n_documentos), avaliar(arvore[1], indice_invertido, n_documentos))
+
+    if tipo in ('FRASE', 'NEAR'):
+        if not isinstance(indice_invertido, IndicePosicional):
+            raise ValueError(ERRO_POSICIONAL)
+        # as posições só são lidas para os documentos que têm todos os termos
+        candidatos = avaliar(planejar(('AND', arvore[1]), indice_invertido), indice_invertido, n_documentos)
+        termos = [f[1] for f in arvore[1]]
+        if tipo == 'FRASE':
+            return filtrar_frase(indice_invertido, termos, candidatos)
+        return filtrar_proximidade(indice_invertido, termos[0], termos[1], arvore[2], candidatos)
+
+    if tipo == 'OR':
+        return uniao([avaliar(f, indice_invertido, n_documentos) for f in arvore[1]])
+
+    positivos = [f for f in arvore[1] if f[0] != 'NOT']
+    negativos = [f[1] for f in arvore[1] if f[0] == 'NOT']
+    if positivos:
+        resultado = avaliar(positivos[0], indice_invertido, n_documentos)
+        for f in positivos[1:]:
+            if not resultado:
+                return []
+            resultado = intersect(resultado, avaliar(f, indice_invertido, n_documentos))
+    else:
+        resultado = range(n_documentos)
+
+    for f in negativos:
+        if not resultado:
+            break
+        resultado = diferenca(resultado, avaliar(f, indice_invertido, n_documentos))
+    return list(resultado)
+
+
+def uniao(listas):
+    '''União (OR) de listas de postings por intercalação de k vias com heap'''
+    resultado = []
+    for doc_id in heapq.merge(*listas):
+        if not resultado or resultado[-1] != doc_id:
+            resultado.append(doc_id)
+    return resultado
+
+
+def diferenca(p1, p2):
+    '''
+    Documentos de p1 que não estão em p2 (p1 AND NOT p2), por intercalação.
+    Se p2 for muito maior que p1, a posição em p2 é encontrada por busca binária.
+    '''
+    if isinstance(p2, PostingsComprimida):
+        cursor = p2.cursor()
+        return [d for d in p1 if cursor.avancar(d) != d]
+
+    galopar = len(p1) * RAZAO_GALOPE < len(p2)
+    resultado = []
+    j = 0
+    for doc_id in p1:
+        if galopar:
+            j = bisect_left(p2, doc_id, j)
+        else:
+            while j < len(p2) and p2[j] < doc_id:
+                j += 1
+        if j == len(p2) or p2[j] != doc_id:
+            resultado.append(doc_id)
+    return resultado
+
+
 def intersect(p1, p2):
     '''
-    Implementar o algoritmo INTERSECT do Livro Introduction to Information Retrieval
+    Algoritmo INTERSECT do livro Introduction to Information Retrieval.
+    Se uma das listas é muito menor que a outra (RAZAO_GALOPE), usa busca
+    exponencial na maior; senão, percorre as duas com ponteiros e saltos.
+    '''
+    if len(p1) > len(p2):
+        (p1, p2) = (p2, p1)
+    if isinstance(p1, PostingsComprimida) or isinstance(p2, PostingsComprimida):
+        return intersect_comprimido(p1, p2)
+    if len(p1) * RAZAO_GALOPE < len(p2):
+        return intersect_galopante(p1, p2)
+    return intersect_com_saltos(p1, p2)
+
+
+def intersect_comprimido(menor, maior):
+    '''
+    Intersecção em que alguma das listas é uma PostingsComprimida.
+    A menor é decodificada em fluxo; na maior, os blocos que não podem conter
+    os doc ids procurados são pulados sem serem decodificados.
     '''
-    p1 = p1 + []  # copia p1
-    p2 = p2 + []  # copia p2
+    if not isinstance(maior, PostingsComprimida):
+        return intersect_galopante(menor, maior)
+
+    cursor = maior.cursor()
     resultado = []
-    while p1 and p2:
-        if p1[0] == p2[0]:
-            resultado.append(p1[0])
-            p1.pop(0)
-            p2.pop(0)
-        elif p1[0] < p2[0]:
-            p1.pop(0)
+    for doc_id in menor:
+        encontrado = cursor.avancar(doc_id)
+        if encontrado is None:
+            break
+        if encontrado == doc_id:
+            resultado.append(doc_id)
+    return resultado
+
+
+def intersect_com_saltos(p1, p2):
+    '''
+    INTERSECT WITH SKIPS (Introduction to Information Retrieval, seção 2.3).
+    Cada lista tem ponteiros de salto implícitos a cada sqrt(n) posições;
+    o custo é O(|p1| + |p2|) no pior caso.
+    '''
+    salto1 = max(1, int(math.sqrt(len(p1))))
+    salto2 = max(1, int(math.sqrt(len(p2))))
+    resultado = []
+    (i, j) = (0, 0)
+    while i < len(p1) and j < len(p2):
+        if p1[i] == p2[j]:
+            resultado.append(p1[i])
+            i += 1
+            j += 1
+        elif p1[i] < p2[j]:
+            if i % salto1 == 0 and i + salto1 < len(p1) and p1[i + salto1] <= p2[j]:
+                while i + salto1 < len(p1) and p1[i + salto1] <= p2[j]:
+                    i += salto1
+            else:
+                i += 1
         else:
-            p2.pop(0)
+            if j % salto2 == 0 and j + salto2 < len(p2) and p2[j + salto2] <= p1[i]:
+                while j + salto2 < len(p2) and p2[j + salto2] <= p1[i]:
+                    j += salto2
+            else:
+                j += 1
+    return resultado
+
+
+def intersect_galopante(menor, maior):
+    '''
+    Intersecção por busca exponencial (galloping): para cada doc id da lista
+    menor, dobra o passo na lista maior até ultrapassá-lo e então faz uma
+    busca binária. O custo é O(|menor| * log(|maior| / |menor|)).
+    '''
+    resultado = []
+    j = 0
+    for doc_id in menor:
+        passo = 1
+        while j + passo < len(maior) and maior[j + passo] < doc_id:
+            passo *= 2
+        j = bisect_left(maior, doc_id, j, min(j + passo + 1, len(maior)))
+        if j == len(maior):
+            break
+        if maior[j] == doc_id:
+            resultado.append(doc_id)
+            j += 1
     return resultado
 
 
@@ -0,0 +1,266 @@
+'''
+Execução de consultas em lote, para avaliação offline e cargas em massa.
+
+Lê uma consulta por linha de um arquivo (ou da entrada padrão) e grava um
+JSON por linha com a consulta corrigida e os resultados. No modo ordenado,
+as consultas são processadas em blocos de tamanho_bloco: as similaridades de
+todas as consultas do bloco saem de um único produto de matrizes esparsas
+(consultar_lote), e o tamanho do bloco limita a memória usada.
+'''
+from argparse import ArgumentParser
+from functools import partial
+from itertools import islice
+import json
+import sys
+
+import busca_boolean
+import busca_ordenada
+from armazem_documentos import ArmazemDocumentos
+from cache_consultas import CacheConsultas
+from curingas import expandir_curingas, tem_curinga
+from expressao_booleana import analisar, formatar, mapear_termos, obter_termos
+from indexacao_paralela import construir_indice_invertido_paralelo
+from indice_disco import carregar_indice
+from pontuacao import PONTUACOES
+
+
+TAMANHO_BLOCO = 256
+
+
+def parse_args():
+    ap = ArgumentParser()
+
+    ap.add_argument(
+        '--documentos',
+        type=str,
+        required=True,
+        help='Caminho para o arquivo .jl com os documentos para efetuar a busca'
+    )
+
+    ap.add_argument(
+        '--consultas',
+        type=str,
+        required=False,
+        default='-',
+        help='Arquivo com uma consulta por linha (entrada padrão se omitido ou "-")'
+    )
+
+    ap.add_argument(
+        '--saida',
+        type=str,
+        required=False,
+        default='-',
+        help='Arquivo .jl em que os resultados são gravados (saída padrão se omitido ou "-")'
+    )
+
+    ap.add_argument(
+        '--modo',
+        type=str,
+        required=False,
+        default='ordenado',
+        choices=['boolean', 'ordenado'],
+        help='Tipo de busca: boolean ou ordenado (padrão).'
+    )
+
+    ap.add_argument(
+        '--n-resultados',
+        type=int,
+        required=False,
+        default=10,
+        help='Quantidade máxima de resultados (10 padrão) por consulta.'
+    )
+
+    ap.add_argument(
+        '--tamanho-bloco',
+        type=int,
+        required=False,
+        default=TAMANHO_BLOCO,
+        help=f'Quantidade de consultas ranqueadas juntas ({TAMANHO_BLOCO} padrão).'
+    )
+
+    ap.add_argument(
+        '--sem-correcao',
+        action='store_true',
+        help='Não aplica a correção ortográfica nas consultas.'
+    )
+
+    ap.add_argument(
+        '--pontuacao',
+        type=str,
+        required=False,
+        default='tfidf',
+        choices=PONTUACOES,
+        help='Função de pontuação: tfidf (padrão), logtf, bm25 ou bm25f; com --indice, vale a do índice.'
+    )
+
+    ap.add_argument(
+        '--sem-acentos',
+        action='store_true',
+        help='Remove os acentos dos documentos e das consultas ("ação" vira "acao"); com --indice, vale o do índice.'
+    )
+
+    ap.add_argument(
+        '--indice',
+        type=str,
+        required=False,
+        help='Arquivo de índice gravado por construir_indice.py; se informado, o índice não é montado'
+    )
+
+    ap.add_argument(
+        '--processos',
+        type=int,
+        required=False,
+        default=1,
+        help='Quantidade de processos usados para montar o índice (1 padrão).'
+    )
+
+    return ap.parse_args()
+
+
+def main(args):
+    if args.indice:
+        print(f'> Abrindo o índice {args.indice}', file=sys.stderr)
+    else:
+        print('> Montando o índice', file=sys.stderr)
+    if args.modo == 'boolean':
+        buscar = preparar_boolean(args)
+    else:
+        buscar = preparar_ordenado(args)
+
+    entrada = sys.stdin if args.consultas == '-' else open(args.consultas, 'r')
+    saida = sys.stdout if args.saida == '-' else open(args.saida, 'w')
+    n = 0
+    with entrada, saida:
+        consultas = (linha.strip() for linha in entrada)
+        consultas = (c for c in consultas if c)
+        while True:
+            bloco = list(islice(consultas, args.tamanho_bloco))
+            if not bloco:
+                break
+            for (consulta, registro) in zip(bloco, buscar(bloco)):
+                registro = {'id': n, 'consulta': consulta, **registro}
+                saida.write(json.dumps(registro, ensure_ascii=False) + '\n')
+                n += 1
+    print(f'> {n} consultas executadas', file=sys.stderr)
+
+
+def preparar_ordenado(args):
+    '''
+    Retorna a função que executa um bloco de consultas ordenadas.
+    Saída da função: um dicionário com consulta_corrigida e resultados por consulta
+    '''
+    if args.indice:
+        indice = carregar_indice(args.indice)
+        documentos = indice.abrir_documentos(args.documentos)
+        (M, ids_termos, k_grams, normas) = (indice.M, indice.termos, indice.k_grams, indice.normas)
+        sem_acentos = indice.sem_acentos
+    else:
+        (indice_invertido, documentos) = montar_indice(args, com_repeticao=True)
+        k_grams = busca_ordenada.construir_indice_k_grams(indice_invertido, k=3)
+        (M, ids_termos, cosseno) = busca_ordenada.construir_matriz_pesos(
+            indice_invertido, documentos, args.pontuacao, args.sem_acentos
+        )
+        sem_acentos = args.sem_acentos
+        normas = busca_ordenada.calcular_normas(M) if cosseno else None
+    corretor = criar_corretor(busca_ordenada.obter_termo_corrigido, k_grams)
+
+    def buscar(bloco):
+        consultas = [busca_ordenada.normalizar_tokens(c.split(), sem_acentos) for c in bloco]
+        if not args.sem_correcao:
+            consultas = [
+                busca_ordenada.aplicar_correcao_ortografica(termos, ids_termos, k_grams, corretor)
+                for termos in consultas
+            ]
+        resultados = busca_ordenada.consultar_lote(
+            consultas, M, ids_termos, normas, k=args.n_resultados
+        )
+        return [
+            {
+                'consulta_corrigida': ' '.join(termos),
+                'resultados': [
+                    resultado(documentos, doc_id, similaridade=float(similaridade))
+                    for (doc_id, similaridade) in zip(doc_ids, similaridades)
+                ],
+            }
+            for (termos, (doc_ids, similaridades)) in zip(consultas, resultados)
+        ]
+
+    return buscar
+
+
+def preparar_boolean(args):
+    '''
+    Retorna a função que executa um bloco de consultas boolean, uma a uma.
+    Consultas inválidas retornam apenas a mensagem de erro.
+    '''
+    if args.indice:
+        indice = carregar_indice(args.indice)
+        documentos = indice.abrir_documentos(args.documentos)
+        (indice_invertido, k_grams, k) = (indice.postings, indice.k_grams, indice.k)
+        sem_acentos = indice.sem_acentos
+    else:
+        (indice_invertido, documentos) = montar_indice(args, com_repeticao=False)
+        k = 3
+        k_grams = busca_boolean.construir_indice_k_grams(indice_invertido, k=k)
+        sem_acentos = args.sem_acentos
+    corretor = criar_corretor(partial(busca_boolean.obter_termo_corrigido, k=k), k_grams)
+
+    def buscar_uma(consulta):
+        try:
+            arvore = analisar(consulta)
+            arvore = mapear_termos(
+                arvore, lambda t: busca_boolean.normalizar_tokens([t], sem_acentos)[0]
+            )
+            arvore = expandir_curingas(arvore, indice_invertido, k_grams, k=k)
+            if not args.sem_correcao:
+                termos = [t for t in obter_termos(arvore) if not tem_curinga(t)]
+                termos_ = busca_boolean.aplicar_correcao_ortografica(
+                    termos, indice_invertido, k_grams, corretor
+                )
+                correcoes = dict(zip(termos, termos_))
+                arvore = mapear_termos(arvore, lambda t: correcoes.get(t, t))
+            doc_ids = busca_boolean.avaliar(
+                busca_boolean.planejar(arvore, indice_invertido), indice_invertido, len(documentos)
+            )
+        except ValueError as e:
+            return {'erro': str(e)}
+        return {
+            'consulta_corrigida': formatar(arvore),
+            'resultados': [
+                resultado(documentos, doc_id) for doc_id in islice(doc_ids, args.n_resultados)
+            ],
+        }
+
+    return lambda bloco: [buscar_uma(c) for c in bloco]
+
+
+def montar_indice(args, com_repeticao):
+    '''Monta o índice invertido em memória, como em busca_boolean/busca_ordenada'''
+    if args.processos > 1:
+        (indice_invertido, posicoes) = construir_indice_invertido_paralelo(
+            args.documentos, args.processos, com_repeticao=com_repeticao,
+            sem_acentos=args.sem_acentos
+        )
+        return (indice_invertido, ArmazemDocumentos(args.documentos, posicoes))
+
+    documentos = ArmazemDocumentos(args.documentos)
+    if com_repeticao:
+        indice_invertido = busca_ordenada.construir_indice_invertido(documentos, args.sem_acentos)
+    else:
+        indice_invertido = busca_boolean.construir_indice_invertido(documentos, args.sem_acentos)
+    return (indice_invertido, documentos)
+
+
+def criar_corretor(obter_termo_corrigido, k_grams):
+    '''Correção ortográfica por termo, com cache (termos se repetem muito nos logs)'''
+    cache = CacheConsultas()
+    return lambda termo: cache.obter(termo, lambda: obter_termo_corrigido(termo, k_grams))
+
+
+def resultado(documentos, doc_id, **campos):
+    documento = documentos[int(doc_id)]
+    return {'doc_id': int(doc_id), 'url': documento['url'], 'titulo': documento['titulo'], **campos}
+
+
+if __name__ == '__main__':
+    main(parse_args())
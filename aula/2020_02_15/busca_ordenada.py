@@ -1,8 +1,38 @@
 from argparse import ArgumentParser
+from collections import Counter
+from itertools import chain
 import json
-import re
+import math
 
 import numpy as np
+from scipy import sparse
+
+from armazem_documentos import ArmazemDocumentos
+from cache_consultas import CAPACIDADE, CacheConsultas
+from correcao_symspell import DISTANCIA_MAXIMA, TAMANHO_PREFIXO, IndiceSymSpell
+from indexacao_paralela import construir_indice_invertido_paralelo
+from indice_disco import carregar_indice
+import instrumentacao
+from instrumentacao import ativa, contar, etapa, rastrear
+from pontuacao import PONTUACOES, Estatisticas, calcular_pesos, construir_matriz_titulos
+import vocabulario
+from vocabulario import IndiceInvertido
+
+
+# margem relativa usada pelo WAND ao comparar limites superiores com o
+# limiar, para que erros de arredondamento nunca descartem um documento
+TOLERANCIA_WAND = 1e-9
+
+# quantidade de postings por bloco nos máximos por bloco do WAND
+TAMANHO_BLOCO_WAND = 64
+
+# se os intervalos que sobram depois da poda ainda têm mais que essa fração
+# das postings da consulta mais a quantidade de documentos (o custo de
+# consultar), o WAND pontua todos os documentos como consultar
+FRACAO_EXAUSTIVA_WAND = 0.2
+
+# coeficiente de Jaccard mínimo para um termo ser sugerido como correção
+JACCARD_MINIMO = 0.2
 
 
 def parse_args():
@@ -23,6 +53,105 @@ def parse_args():
         help='Quantidade máxima de resultados (10 padrão) para retornar na busca.'
     )
 
+    ap.add_argument(
+        '--motor',
+        type=str,
+        required=False,
+        default='exaustivo',
+        choices=['exaustivo', 'wand'],
+        help='Algoritmo de ranqueamento: exaustivo (padrão) ou wand (poda pelos máximos por bloco).'
+    )
+
+    ap.add_argument(
+        '--sem-acentos',
+        action='store_true',
+        help='Remove os acentos dos documentos e das consultas ("ação" vira "acao"); com --indice, vale o do índice.'
+    )
+
+    ap.add_argument(
+        '--indice',
+        type=str,
+        required=False,
+        help='Arquivo de índice gravado por construir_indice.py; se informado, o índice não é montado'
+    )
+
+    ap.add_argument(
+        '--pontuacao',
+        type=str,
+        required=False,
+        default='tfidf',
+        choices=PONTUACOES,
+        help='Função de pontuação: tfidf (padrão), logtf, bm25 ou bm25f; com --indice, vale a do índice.'
+    )
+
+    ap.add_argument(
+        '--processos',
+        type=int,
+        required=False,
+        default=1,
+        help='Quantidade de processos usados para montar o índice (1 padrão).'
+    )
+
+    ap.add_argument(
+        '--corretor',
+        type=str,
+        required=False,
+        default='jaccard',
+        choices=['jaccard', 'symspell'],
+        help='Algoritmo de correção ortográfica (jaccard padrão).'
+    )
+
+    ap.add_argument(
+        '--symspell-distancia',
+        type=int,
+        required=False,
+        default=DISTANCIA_MAXIMA,
+        help='Distância máxima corrigida pelo symspell (2 padrão).'
+    )
+
+    ap.add_argument(
+        '--symspell-prefixo',
+        type=int,
+        required=False,
+        default=TAMANHO_PREFIXO,
+        help='Tamanho do prefixo indexado pelo symspell (7 padrão); menor usa menos memória.'
+    )
+
+    ap.add_argument(
+        '--cache',
+        type=int,
+        required=False,
+        default=CAPACIDADE,
+        help=f'Quantidade de consultas guardadas no cache ({CAPACIDADE} padrão); 0 desativa.'
+    )
+
+    ap.add_argument(
+        '--cache-ttl',
+        type=float,
+        required=False,
+        default=None,
+        help='Validade em segundos das entradas do cache (sem expiração por padrão).'
+    )
+
+    ap.add_argument(
+        '--instrumentar',
+        action='store_true',
+        help='Mede o tempo de cada etapa e os contadores de cada consulta e mostra o rastro.'
+    )
+
+    ap.add_argument(
+        '--metricas',
+        type=str,
+        required=False,
+        help='Grava os totais da instrumentação ao sair (Prometheus se terminar em .prom, senão JSON).'
+    )
+
+    ap.add_argument(
+        '--perfil',
+        action='store_true',
+        help='Executa o profiler por amostragem e mostra as funções mais custosas ao sair.'
+    )
+
     return ap.parse_args()
 
 
@@ -30,35 +159,99 @@ def main(args):
     print('Bem-vindo ao sistema de busca de livros.')
     print('> Para pesquisar, digite palavras separadas por um "AND"')
     print('> Pressione ENTER sem nenhuma palavras para sair')
-    print('> Montando o índice para acelerar as consultas')
-    documentos = list(ler_documentos(args.documentos))
-    indice_invertido = construir_indice_invertido(documentos)
-    indice_k_grams = construir_indice_k_grams(indice_invertido, k=3)
-    (M, ids_termos) = construir_matriz_tf_idf(indice_invertido, documentos)
+    if args.indice:
+        print(f'> Abrindo o índice {args.indice}')
+        indice = carregar_indice(args.indice)
+        documentos = indice.abrir_documentos(args.documentos)
+        (indice_invertido, indice_k_grams) = (indice.termos, indice.k_grams)
+        (M, ids_termos) = (indice.M, indice.termos)
+        (normas, blocos) = (indice.normas, indice.blocos)
+        sem_acentos = indice.sem_acentos
+    else:
+        print('> Montando o índice para acelerar as consultas')
+        sem_acentos = args.sem_acentos
+        if args.processos > 1:
+            (indice_invertido, posicoes) = construir_indice_invertido_paralelo(
+                args.documentos, args.processos, com_repeticao=True, sem_acentos=sem_acentos
+            )
+            documentos = ArmazemDocumentos(args.documentos, posicoes)
+        else:
+            documentos = ArmazemDocumentos(args.documentos)
+            indice_invertido = construir_indice_invertido(documentos, sem_acentos)
+        indice_k_grams = construir_indice_k_grams(indice_invertido, k=3)
+        (estatisticas, ids_termos) = construir_estatisticas(
+            indice_invertido, documentos, args.pontuacao, sem_acentos
+        )
+        (M, cosseno) = calcular_pesos(estatisticas, args.pontuacao)
+        normas = calcular_normas(M) if cosseno else None
+        blocos = calcular_maximos_blocos(M, normas) if args.motor == 'wand' else None
+    corretor = None
+    if args.corretor == 'symspell':
+        print('> Montando o índice de deleções do symspell')
+        # df das descrições: no bm25f, a linha de M também tem os títulos
+        if args.indice:
+            frequencias = indice.frequencias()
+        else:
+            frequencias = {t: int(estatisticas.df[i]) for (t, i) in ids_termos.items()}
+        corretor = IndiceSymSpell(
+            frequencias, args.symspell_distancia, args.symspell_prefixo
+        ).corrigir
+    cache = CacheConsultas(args.cache, args.cache_ttl)
+    corrigir = corretor or (lambda termo: obter_termo_corrigido(termo, indice_k_grams))
+    corretor = lambda termo: cache.obter(('correcao', termo), lambda: corrigir(termo))
+    instrumentacao.ativar(args.instrumentar or bool(args.metricas))
+    amostrador = instrumentacao.Amostrador() if args.perfil else None
+    if amostrador:
+        amostrador.iniciar()
     while True:
         print('=' * 80)
         print('=' * 80)
         consulta = input('Qual é a sua consulta? ')
         consulta = consulta.strip()
         if not consulta:
+            print(f'> Cache: {cache.estatisticas()}')
+            if args.metricas:
+                instrumentacao.gravar_metricas(args.metricas)
+            if amostrador:
+                amostrador.finalizar()
+                print(amostrador.relatorio())
             print('Saindo...')
             break
 
-        termos = normalizar_tokens(consulta.split())
-        termos_ = aplicar_correcao_ortografica(termos, indice_invertido, indice_k_grams)
-        if termos_ != termos:
-            termos = termos_
-            print(f'Você quis dizer "{" ".join(termos)}"?')
-        else:
-            print(f'Resultados para {consulta}')
+        with rastrear(consulta) as rastro:
+            with etapa('tokens'):
+                termos = normalizar_tokens(consulta.split(), sem_acentos)
+            with etapa('correcao'):
+                termos_ = aplicar_correcao_ortografica(
+                    termos, indice_invertido, indice_k_grams, corretor
+                )
+            if termos_ != termos:
+                termos = termos_
+                print(f'Você quis dizer "{" ".join(termos)}"?')
+            else:
+                print(f'Resultados para {consulta}')
 
-        print()
-        resultados = consultar(termos, M, ids_termos, documentos)
-        for (documento, i) in zip(resultados, range(args.n_resultados)):
+            print()
+            if args.motor == 'wand':
+                calcular = lambda: consultar_wand(
+                    termos, M, ids_termos, normas, blocos, documentos, k=args.n_resultados
+                )
+            else:
+                calcular = lambda: consultar(
+                    termos, M, ids_termos, normas, documentos, k=args.n_resultados
+                )
+            with etapa('ranqueamento'):
+                resultados = cache.obter(
+                    ('resultados', tuple(sorted(termos)), args.n_resultados),
+                    lambda: list(calcular())
+                )
+        for (i, documento) in enumerate(resultados):
             print(f'{i + 1}. {documento["titulo"]}')
             print(documento["url"])
             print('>', documento['descricao'][:100], '...')
             print()
+        if rastro:
+            print(f'> Rastro: {rastro}')
 
 
 def ler_documentos(caminho_documentos):
@@ -69,57 +262,113 @@ def ler_documentos(caminho_documentos):
                 yield documento
 
 
-def construir_indice_invertido(documentos):
+def construir_indice_invertido(documentos, sem_acentos=False):
     '''
     Essa função constrói e retorna um índice invertido.
     Entrada: Lista de documentos (strings)
-    Saída: Dicionário de termos para lista de documentos
+    Saída: IndiceInvertido (vocabulario.py), que funciona como um dicionário
+    de termos para lista de documentos
     '''
     # Exercício 1
-    indice_invertido = {}
-    documentos_tokens = [obter_tokens(d['descricao']) for d in documentos]
-    for (i, tokens) in enumerate(documentos_tokens):
-        for token in tokens:
-            if token not in indice_invertido:
-                indice_invertido[token] = [i]
-            else:
-                # note a diferença do índice invertido do exercício anterior
-                indice_invertido[token].append(i)
+    indice_invertido = IndiceInvertido()
+    for (i, documento) in enumerate(documentos):
+        # note a diferença do índice invertido do exercício anterior
+        indice_invertido.adicionar(i, obter_tokens(documento['descricao'], sem_acentos), com_repeticao=True)
 
     return indice_invertido
 
 
 def construir_indice_k_grams(indice_invertido, k=3):
     '''
-    Constrói um índice que mapeia de k-grams para termos
+    Constrói um índice que mapeia de k-grams para termos.
+    Cada k-gram aponta para um dicionário de termo para a quantidade de
+    k-grams do termo, usada no cálculo do coeficiente de Jaccard.
     '''
     indice_k_grams = {}
-    for termo in indice_invertido.keys():
-        for k_gram in obter_k_grams(termo, k=k):
+    for termo in indice_invertido:
+        k_grams = obter_k_grams(termo, k=k)
+        for k_gram in k_grams:
             if k_gram not in indice_k_grams:
-                indice_k_grams[k_gram] = {termo}
+                indice_k_grams[k_gram] = {termo: len(k_grams)}
             else:
-                indice_k_grams[k_gram].add(termo)
+                indice_k_grams[k_gram][termo] = len(k_grams)
 
     return indice_k_grams
 
 
 def construir_matriz_tf_idf(indice_invertido, documentos):
-    ids_termos = {}
-    M = np.zeros((len(indice_invertido), len(documentos)))
-    for (i, termo) in enumerate(indice_invertido):
-        ids_termos[termo] = i
-        for j in indice_invertido[termo]:
-            M[i, j] += 1
-
-    df = np.sum(M > 0, axis=1)
-    N = M.shape[1]
-    idf = np.log(N / df)
-    # idf = idf.reshape(-1, 1)
-    # M = idf * M
-    for i in range(M.shape[0]):
-        M[i, :] = M[i, :] * idf[i]
+    '''
+    Constrói a matriz termo-documento TF-IDF esparsa (CSR).
+    Entrada: índice invertido (com uma entrada por ocorrência) e documentos
+    Saída: (M, ids_termos), onde M tem um termo por linha e um documento por coluna
+    '''
+    (TF, ids_termos) = construir_matriz_tf(indice_invertido, documentos)
+    (M, _) = calcular_pesos(Estatisticas(TF), 'tfidf')
+    return (M, ids_termos)
+
+
+def construir_matriz_pesos(indice_invertido, documentos, pontuacao='tfidf', sem_acentos=False):
+    '''
+    Constrói a matriz de pesos da função de pontuação (ver pontuacao.py).
+    Saída: (M, ids_termos, cosseno); se cosseno, a similaridade é a de
+    cosenos e as consultas precisam das normas dos documentos
+    '''
+    (estatisticas, ids_termos) = construir_estatisticas(
+        indice_invertido, documentos, pontuacao, sem_acentos
+    )
+    (M, cosseno) = calcular_pesos(estatisticas, pontuacao)
+    return (M, ids_termos, cosseno)
 
+
+def construir_estatisticas(indice_invertido, documentos, pontuacao='tfidf', sem_acentos=False):
+    '''
+    Constrói as estatísticas da coleção usadas pela função de pontuação
+    (a matriz de tf dos títulos só no bm25f).
+    Saída: (Estatisticas, ids_termos)
+    '''
+    (TF, ids_termos) = construir_matriz_tf(indice_invertido, documentos)
+    TF_titulo = None
+    if pontuacao == 'bm25f':
+        TF_titulo = construir_matriz_titulos(
+            documentos, ids_termos, lambda texto: obter_tokens(texto, sem_acentos)
+        )
+    return (Estatisticas(TF, TF_titulo), ids_termos)
+
+
+def construir_matriz_tf(indice_invertido, documentos):
+    '''
+    Constrói a matriz termo-documento esparsa (CSR) com o tf de cada termo.
+    Saída: (TF, ids_termos)
+    '''
+    if isinstance(indice_invertido, IndiceInvertido):
+        # a linha de cada termo é o seu id no vocabulário
+        (ids_termos, postings) = (indice_invertido.vocabulario, indice_invertido.postings)
+    else:
+        ids_termos = {}
+        postings = []
+        for (i, termo) in enumerate(indice_invertido):
+            ids_termos[termo] = i
+            postings.append(indice_invertido[termo])
+
+    # cada ocorrência vira uma entrada (termo, documento) = 1;
+    # entradas repetidas são somadas na conversão para CSR, resultando no tf
+    tamanhos = np.fromiter(map(len, postings), dtype=np.int64, count=len(postings))
+    linhas = np.repeat(np.arange(len(postings), dtype=np.int32), tamanhos)
+    if isinstance(indice_invertido, IndiceInvertido):
+        # os arrays são concatenados sem criar um objeto int por posting
+        colunas = np.frombuffer(b''.join(postings), dtype=np.intc)
+    else:
+        colunas = np.fromiter(
+            chain.from_iterable(postings),
+            dtype=np.int32,
+            count=int(tamanhos.sum())
+        )
+    dados = np.ones(len(colunas), dtype=np.float64)
+    M = sparse.coo_matrix(
+        (dados, (linhas, colunas)),
+        shape=(len(indice_invertido), len(documentos))
+    ).tocsr()
+    M.sum_duplicates()
     return (M, ids_termos)
 
 
@@ -132,75 +381,356 @@ def obter_k_grams(termo, k=3):
     return {termo_pad[i:i + k] for i in range(len(termo_pad) - pad)}
 
 
-def obter_tokens(documento):
+def obter_tokens(documento, sem_acentos=False):
     '''Quebra um texto em sequências de palavras normalizadas em lower case'''
-    tokens = re.findall(r'(?:\b(\w+)\b)', documento)
-    return normalizar_tokens(tokens)
+    return vocabulario.obter_tokens(documento, sem_acentos)
 
 
-def normalizar_tokens(tokens):
+def normalizar_tokens(tokens, sem_acentos=False):
     '''Coloca os tokens em lower case e remove espaços no começo/final'''
-    return [t.strip().lower() for t in tokens]
+    return vocabulario.normalizar_tokens(tokens, sem_acentos)
 
 
-def aplicar_correcao_ortografica(termos, indice_invertido, indice_k_grams):
+def aplicar_correcao_ortografica(termos, indice_invertido, indice_k_grams, corretor=None):
     '''Retorna termos com correção ortográfica.
     Se o termo existe no índice inverto, mantém.
-    Se não existe, encontra a melhor correção ortográfica.
+    Se não existe, encontra a melhor correção ortográfica com corretor
+    (função de termo para termo corrigido; padrão: obter_termo_corrigido).
+    Se nenhum termo do índice for próximo o bastante, mantém o termo.
     '''
     termos_corrigidos = []
     for termo in termos:
         if termo in indice_invertido:
             termos_corrigidos.append(termo)
         else:
-            correcao = obter_termo_corrigido(termo, indice_k_grams)
-            termos_corrigidos.append(correcao)
+            if corretor:
+                correcao = corretor(termo)
+            else:
+                correcao = obter_termo_corrigido(termo, indice_k_grams)
+            termos_corrigidos.append(correcao or termo)
 
     return termos_corrigidos
 
 
-def obter_termo_corrigido(termo, indice_k_grams):
+def obter_termo_corrigido(termo, indice_k_grams, limiar=JACCARD_MINIMO):
     '''
     Encontra a melhor correção ortográfica de um determinado termo utilizando
-    o índice k-grams.
+    o índice k-grams (maior coeficiente de Jaccard, de pelo menos limiar).
+    Retorna '' se nenhum termo atingir o limiar.
     '''
-    termos_candidados = set()
     k = len(next(iter(indice_k_grams.keys())))
     k_grams = obter_k_grams(termo, k=k)
-    for k_gram in k_grams:
-        termos_candidados = termos_candidados | indice_k_grams.get(k_gram, {})
+    return max(jaccard(k_grams, indice_k_grams, limiar), default=(0, ''))[1]
 
-    return max(jaccard(k_grams, termos_candidados, k), key=lambda x: x[0])[1]
 
+def jaccard(k_grams, indice_k_grams, limiar=JACCARD_MINIMO):
+    '''
+    Retorna (coeficiente de Jaccard, candidato) para os termos do índice
+    k-grams cujo Jaccard com k_grams é pelo menos limiar.
+    O índice k-grams guarda a quantidade de k-grams de cada termo, então o
+    Jaccard sai da contagem de k-grams em comum, feita em uma única passada.
+    Como J = c / (n + n_c - c) <= c / n, um candidato precisa ter pelo menos
+    ceil(limiar * n) k-grams em comum com o termo; logo, ele aparece em algum
+    dos n - ceil(limiar * n) + 1 k-grams menos frequentes do termo. Só esses
+    k-grams geram candidatos; os demais apenas completam a contagem.
+    '''
+    n = len(k_grams)
+    minimo = max(1, math.ceil(limiar * n))
+    postings = sorted((indice_k_grams.get(k_gram, {}) for k_gram in k_grams), key=len)
+    prefixo = n - minimo + 1
+
+    comuns = Counter()
+    tamanhos = {}
+    for p in postings[:prefixo]:
+        comuns.update(p.keys())
+        tamanhos.update(p)
+
+    # J <= min(n, n_c) / max(n, n_c): descarta candidatos de tamanho incompatível
+    candidatos = [
+        c for c in comuns
+        if limiar * n <= tamanhos[c] and limiar * tamanhos[c] <= n
+    ]
+    contar('candidatos_correcao', len(candidatos))
+    for p in postings[prefixo:]:
+        for candidato in candidatos:
+            if candidato in p:
+                comuns[candidato] += 1
+
+    for candidato in candidatos:
+        c = comuns[candidato]
+        j = c / (n + tamanhos[candidato] - c)
+        if j >= limiar:
+            yield (j, candidato)
+
+
+def calcular_normas(M):
+    '''Retorna a norma euclidiana de cada documento (coluna) de M'''
+    return np.sqrt(np.asarray(M.multiply(M).sum(axis=0)).ravel())
+
+
+def _inversos(normas):
+    inversos = np.zeros(len(normas))
+    np.divide(1, normas, out=inversos, where=normas > 0)
+    return inversos
+
+
+def consultar(termos_consulta, M, ids_termos, normas, documentos, k=None):
+    '''
+    Retorna os documentos ordenados pela similaridade de cosenos com a consulta.
+    As normas dos documentos são pré-calculadas (calcular_normas) e o produto
+    escalar usa apenas as linhas de M dos termos da consulta.
+    Se normas for None, a pontuação é a soma das linhas de M (BM25).
+    Se k for informado, retorna apenas os k documentos mais similares.
+    Documentos com similaridade zero nunca são retornados.
+    '''
+    # similaridade de cosenos
+    # q é binário (q = [0, 0, 0, 1, 1, 1, 0, 0]), logo q.T * M é a soma
+    # das linhas de M dos termos da consulta
+    tids = sorted({ids_termos[t] for t in termos_consulta if t in ids_termos})
+    if not tids:
+        return
+    produtos = np.asarray(M[tids].sum(axis=0)).ravel()
+    if normas is None:
+        similaridades = produtos.astype(np.float64)
+    else:
+        q_norm = np.sqrt(len(tids))
+        similaridades = np.zeros(len(produtos))
+        np.divide(produtos, q_norm * normas, out=similaridades, where=normas > 0)
+    if ativa():
+        contar('postings_percorridas', int(sum(M.indptr[t + 1] - M.indptr[t] for t in tids)))
+        contar('documentos_pontuados', int(np.count_nonzero(produtos)))
+
+    for doc_id in selecionar_top_k(similaridades, k):
+        yield documentos[doc_id]
 
-def jaccard(k_grams, termos_candidados, k):
-    for candidato in termos_candidados:
-        candidato_k_grams = obter_k_grams(candidato, k)
-        j = len(candidato_k_grams & k_grams) / len(candidato_k_grams | k_grams)
-        yield (j, candidato)
 
+def consultar_lote(consultas, M, ids_termos, normas, k=10):
+    '''
+    Versão vetorizada de consultar para várias consultas de uma vez.
+    consultas: lista de listas de termos
+    Monta a matriz esparsa binária Q (consultas x termos) e calcula todos os
+    produtos escalares com um único produto Q * M. Os produtos são divididos
+    por |q| * |d| com as mesmas operações de consultar, para que as
+    similaridades sejam idênticas bit a bit e os empates saiam na mesma ordem.
+    Saída: para cada consulta, (doc ids, similaridades) dos k documentos
+    mais similares, na mesma ordem de consultar(..., k=k)
+    '''
+    (linhas, colunas, n_termos) = ([], [], np.zeros(len(consultas)))
+    for (i, termos) in enumerate(consultas):
+        tids = sorted({ids_termos[t] for t in termos if t in ids_termos})
+        linhas.extend([i] * len(tids))
+        colunas.extend(tids)
+        n_termos[i] = len(tids)
+    # mesmo tipo da soma de consultar; pesos quantizados (inteiros) somam
+    # sem estourar em float64
+    tipo = M.dtype if M.dtype.kind == 'f' else np.float64
+    Q = sparse.csr_matrix(
+        (np.ones(len(linhas), dtype=tipo), (linhas, colunas)),
+        shape=(len(consultas), M.shape[0])
+    )
 
-def consultar(termos_consulta, M, ids_termos, documentos):
+    S = (Q @ M).tocsr()
+    S.sort_indices()
+    if normas is not None:
+        q_norms = np.repeat(np.sqrt(n_termos), np.diff(S.indptr))
+        normas_docs = normas[S.indices]
+        similaridades = np.zeros(len(S.data))
+        np.divide(S.data, q_norms * normas_docs, out=similaridades, where=normas_docs > 0)
+        S.data = similaridades
+    contar('documentos_pontuados', int(S.nnz))
+
+    resultados = []
+    for i in range(len(consultas)):
+        (inicio, fim) = (S.indptr[i], S.indptr[i + 1])
+        candidatos = S.indices[inicio:fim]
+        similaridades = S.data[inicio:fim]
+        positivos = similaridades > 0
+        resultados.append(ordenar_top_k(candidatos[positivos], similaridades[positivos], k))
+    return resultados
+
+
+def calcular_maximos_blocos(M, normas, tamanho_bloco=TAMANHO_BLOCO_WAND):
     '''
-    Retorna todos os documentos que contém todos os termos de consulta.
-    Como seria essa rotina se usássemos set() do python como estrutura de dados ao invés de list()?
-    Como seriam as operações OR e NOT?
+    Divide a linha de cada termo de M em blocos de tamanho_bloco postings e
+    retorna (inicios, ultimos, maximos): os blocos do termo t são
+    inicios[t]:inicios[t + 1], ultimos é o maior doc id de cada bloco e
+    maximos é o maior valor de M[t, d] / |d| no bloco, o limite superior da
+    contribuição do termo para a similaridade de cosenos dos documentos do
+    bloco. Se normas for None (pontuações que somam os pesos, como o BM25),
+    é o maior valor de M[t, d].
     '''
-    # similaridade de cosenos
-    q = np.zeros((M.shape[0], 1))
-    tids = [ids_termos[t] for t in termos_consulta]
-    q[tids] = 1
-    # q = [0, 0, 0, 1, 1, 1, 0, 0]
-    q_norm = np.sqrt(np.square(q).sum())
-    similaridades = []
-    for j in range(M.shape[1]):
-        p = np.dot(q.T, M[:, j])[0]
-        m_norm = np.sqrt(np.square(M[:, j]).sum())
-        cs = p / (q_norm * m_norm)
-        similaridades.append(cs)
-
-    for doc_id in np.argsort(similaridades)[::-1]:
+    M.sort_indices()
+    tamanhos = np.diff(M.indptr)
+    n_blocos = (tamanhos + tamanho_bloco - 1) // tamanho_bloco
+    inicios = np.zeros(len(tamanhos) + 1, dtype=np.int64)
+    np.cumsum(n_blocos, out=inicios[1:])
+    if not inicios[-1]:
+        return (inicios, np.zeros(0, dtype=M.indices.dtype), np.zeros(0))
+
+    termos = np.repeat(np.arange(len(tamanhos)), n_blocos)
+    comecos = M.indptr[termos] + (np.arange(inicios[-1]) - inicios[termos]) * tamanho_bloco
+    fins = np.minimum(comecos + tamanho_bloco, M.indptr[termos + 1])
+    W = M.data.astype(np.float64)
+    if normas is not None:
+        W *= _inversos(normas)[M.indices]
+    # os blocos cobrem as postings em sequência, então cada bloco termina
+    # onde o próximo começa
+    return (inicios, M.indices[fins - 1], np.maximum.reduceat(W, comecos))
+
+
+def consultar_wand(termos_consulta, M, ids_termos, normas, blocos, documentos, k=10):
+    '''
+    Versão de consultar que pula as partes das listas de postings (linhas de
+    M) que não podem ter nenhum dos k melhores documentos, usando os máximos
+    por bloco de calcular_maximos_blocos (block-max WAND, Ding e Suel, 2011).
+    Os limites dos blocos dos termos da consulta dividem os doc ids em
+    intervalos; o limite superior de um intervalo é a soma dos máximos dos
+    blocos que o cobrem. Os intervalos são pontuados do maior limite para o
+    menor, em lotes vetorizados (np.searchsorted nas fatias de M.indices), e
+    os que têm limite menor que a k-ésima melhor similaridade são pulados.
+    Se depois da poda ainda sobrarem muitas postings, os documentos são
+    pontuados como em consultar.
+    Retorna os mesmos documentos, na mesma ordem, que consultar(..., k=k).
+    '''
+    tids = sorted({ids_termos[t] for t in termos_consulta if t in ids_termos})
+    if not tids or k <= 0:
+        return
+    M.sort_indices()
+    (inicios, ultimos, maximos) = blocos
+    q_norm = np.sqrt(len(tids)) if normas is not None else 1.0
+
+    # fins dos intervalos: os maiores doc ids dos blocos de todos os termos
+    fins = np.unique(np.concatenate([ultimos[inicios[t]:inicios[t + 1]] for t in tids]))
+    if not len(fins):
+        return
+    comecos = np.empty_like(fins)
+    comecos[0] = 0
+    comecos[1:] = fins[:-1] + 1
+    # postings de cada termo em cada intervalo: [inicio, fim) da fatia da linha;
+    # um termo só soma o máximo do seu bloco aos intervalos em que ocorre
+    faixas = []
+    limites = np.zeros(len(fins))
+    for t in tids:
+        indices = M.indices[M.indptr[t]:M.indptr[t + 1]]
+        # o fim de um intervalo é o começo do seguinte
+        fronteiras = np.searchsorted(indices, comecos)
+        faixa = (fronteiras, np.append(fronteiras[1:], len(indices)))
+        faixas.append(faixa)
+        ocorre = faixa[1] > faixa[0]
+        j = np.searchsorted(ultimos[inicios[t]:inicios[t + 1]], fins[ocorre])
+        limites[ocorre] += maximos[inicios[t]:inicios[t + 1]][j]
+    limites /= q_norm
+    postings_intervalos = sum(ultimas - primeiras for (primeiras, ultimas) in faixas)
+    maximo_postings = FRACAO_EXAUSTIVA_WAND * (postings_intervalos.sum() + M.shape[1])
+
+    restantes = np.argsort(-limites, kind='stable')
+    (candidatos, similaridades) = (np.zeros(0, dtype=np.int64), np.zeros(0))
+    limiar = 0.0
+    (tamanho_lote, avaliados, percorridas) = (8, 0, 0)
+    while len(restantes):
+        if len(candidatos) == k:
+            # nenhum documento de um intervalo com limite abaixo do limiar
+            # pode entrar nos k melhores
+            restantes = restantes[limites[restantes] * (1 + TOLERANCIA_WAND) > limiar]
+            if postings_intervalos[restantes].sum() > maximo_postings:
+                # a poda não compensa: somar as linhas inteiras, como consultar,
+                # é mais barato que juntar as postings intervalo por intervalo
+                contar('wand_exaustivo')
+                yield from consultar(termos_consulta, M, ids_termos, normas, documentos, k)
+                return
+        lote = np.sort(restantes[:tamanho_lote])
+        restantes = restantes[tamanho_lote:]
+        tamanho_lote *= 4
+        if not len(lote):
+            break
+
+        (docs, pesos) = ([], [])
+        for (t, (primeiras, ultimas)) in zip(tids, faixas):
+            (inicio, fim) = (M.indptr[t], M.indptr[t + 1])
+            posicoes = _posicoes_intervalos(primeiras[lote], ultimas[lote])
+            docs.append(M.indices[inicio:fim][posicoes])
+            pesos.append(M.data[inicio:fim][posicoes])
+        n_postings = sum(len(d) for d in docs)
+        # soma dos pesos na ordem dos termos, como em consultar; lotes grandes
+        # acumulam em um vetor do tamanho do corpus em vez de ordenar os doc ids
+        if n_postings > M.shape[1] // 16:
+            acumulados = np.zeros(M.shape[1])
+            presentes = np.zeros(M.shape[1], dtype=bool)
+            for (d, p) in zip(docs, pesos):
+                acumulados[d] += p
+                presentes[d] = True
+            novos = np.flatnonzero(presentes)
+            produtos = acumulados[novos]
+        else:
+            (novos, inversos) = np.unique(np.concatenate(docs), return_inverse=True)
+            produtos = np.zeros(len(novos))
+            deslocamento = 0
+            for (d, p) in zip(docs, pesos):
+                produtos[inversos[deslocamento:deslocamento + len(d)]] += p
+                deslocamento += len(d)
+        if normas is None:
+            valores = produtos
+        else:
+            valores = np.zeros(len(novos))
+            np.divide(produtos, q_norm * normas[novos], out=valores, where=normas[novos] > 0)
+        avaliados += len(novos)
+        percorridas += n_postings
+
+        positivos = valores > 0
+        (candidatos, similaridades) = ordenar_top_k(
+            np.concatenate([candidatos, novos[positivos]]),
+            np.concatenate([similaridades, valores[positivos]]),
+            k
+        )
+        if len(candidatos) == k:
+            limiar = similaridades[-1]
+
+    contar('postings_percorridas', percorridas)
+    contar('documentos_pontuados', avaliados)
+    for doc_id in candidatos:
         yield documentos[doc_id]
 
+
+def _posicoes_intervalos(inicios, fins):
+    '''Concatenação de range(inicio, fim) para cada par (inicio, fim)'''
+    tamanhos = fins - inicios
+    total = int(tamanhos.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    # cada posição é o seu índice no resultado mais o deslocamento do intervalo
+    deslocamentos = inicios - (np.cumsum(tamanhos) - tamanhos)
+    return np.arange(total) + np.repeat(deslocamentos, tamanhos)
+
+
+def selecionar_top_k(similaridades, k=None):
+    '''
+    Retorna os ids dos k documentos com maior similaridade (> 0), em ordem
+    decrescente de similaridade e, nos empates, crescente de id.
+    Usa ordenação parcial (np.partition) ao invés de ordenar todo o corpus.
+    '''
+    candidatos = np.flatnonzero(similaridades > 0)
+    (candidatos, _) = ordenar_top_k(candidatos, similaridades[candidatos], k)
+    return candidatos
+
+
+def ordenar_top_k(candidatos, valores, k=None):
+    '''
+    Retorna (ids, valores) dos k candidatos de maior valor, em ordem
+    decrescente de valor e, nos empates, crescente de id.
+    '''
+    if k is not None and k < len(candidatos):
+        if k <= 0:
+            return (candidatos[:0], valores[:0])
+        # k-ésimo maior valor; os empates nesse valor são mantidos para que
+        # o desempate por id seja determinístico
+        limite = np.partition(valores, len(valores) - k)[len(valores) - k]
+        selecionados = valores >= limite
+        candidatos = candidatos[selecionados]
+        valores = valores[selecionados]
+
+    ordem = np.lexsort((candidatos, -valores))[:k]
+    return (candidatos[ordem], valores[ordem])
+
+
 if __name__ == '__main__':
     main(parse_args())
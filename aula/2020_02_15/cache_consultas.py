@@ -0,0 +1,97 @@
+'''
+Cache das consultas frequentes (correções ortográficas e listas de resultados).
+
+As entradas são descartadas pela política LRU quando o cache atinge a
+capacidade e, opcionalmente, quando ficam mais velhas que ttl segundos.
+Se uma função geracao for informada (por exemplo, lambda: indice.geracao no
+IndiceIncremental), o cache inteiro é invalidado sempre que o valor retornado
+por ela mudar, ou seja, quando o índice for alterado ou reconstruído.
+'''
+from collections import OrderedDict
+import threading
+import time
+
+
+CAPACIDADE = 1024
+
+
+class CacheConsultas:
+    '''
+    Cache LRU com TTL opcional e contadores de acertos e falhas.
+    capacidade: quantidade máxima de entradas (0 desativa o cache)
+    ttl: validade de cada entrada em segundos (None: sem expiração)
+    geracao: função sem argumentos que identifica a versão atual do índice
+    '''
+
+    def __init__(self, capacidade=CAPACIDADE, ttl=None, geracao=None):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.geracao = geracao
+        self.geracao_atual = geracao() if geracao else None
+        self.entradas = OrderedDict()
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidacoes = 0
+        self.trava = threading.Lock()
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def obter(self, chave, calcular):
+        '''
+        Retorna o valor de chave no cache; se não estiver presente (ou tiver
+        expirado), chama calcular() e guarda o resultado.
+        '''
+        agora = time.monotonic()
+        with self.trava:
+            self._verificar_geracao()
+            if chave in self.entradas:
+                (valor, instante) = self.entradas[chave]
+                if self.ttl is None or agora - instante < self.ttl:
+                    self.entradas.move_to_end(chave)
+                    self.acertos += 1
+                    return valor
+                del self.entradas[chave]
+            self.falhas += 1
+            geracao = self.geracao_atual
+
+        # calculado fora da trava para não serializar as consultas
+        valor = calcular()
+        if self.capacidade <= 0:
+            return valor
+
+        with self.trava:
+            # o índice pode ter mudado enquanto o valor era calculado
+            self._verificar_geracao()
+            if geracao == self.geracao_atual:
+                self.entradas[chave] = (valor, agora)
+                self.entradas.move_to_end(chave)
+                while len(self.entradas) > self.capacidade:
+                    self.entradas.popitem(last=False)
+        return valor
+
+    def invalidar(self):
+        '''Descarta todas as entradas'''
+        with self.trava:
+            self.entradas.clear()
+            self.invalidacoes += 1
+
+    def _verificar_geracao(self):
+        if self.geracao is None:
+            return
+        geracao = self.geracao()
+        if geracao != self.geracao_atual:
+            self.geracao_atual = geracao
+            self.entradas.clear()
+            self.invalidacoes += 1
+
+    def estatisticas(self):
+        '''Retorna um dicionário com os contadores do cache'''
+        total = self.acertos + self.falhas
+        return {
+            'entradas': len(self.entradas),
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acertos': self.acertos / total if total else 0.0,
+            'invalidacoes': self.invalidacoes,
+        }
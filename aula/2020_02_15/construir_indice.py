@@ -0,0 +1,129 @@
+from argparse import ArgumentParser
+import os
+
+import numpy as np
+
+from busca_ordenada import (
+    calcular_maximos_blocos,
+    calcular_normas,
+    construir_indice_invertido,
+    construir_estatisticas,
+    construir_indice_k_grams,
+)
+from armazem_documentos import ArmazemDocumentos
+from indexacao_paralela import construir_indice_invertido_paralelo
+from indice_disco import salvar_indice
+from pontuacao import PONTUACOES, calcular_pesos, quantizar as quantizar_pesos
+
+
+def parse_args():
+    ap = ArgumentParser()
+
+    ap.add_argument(
+        '--documentos',
+        type=str,
+        required=True,
+        help='Caminho para o arquivo .jl com os documentos que serão indexados'
+    )
+
+    ap.add_argument(
+        '--saida',
+        type=str,
+        required=True,
+        help='Caminho do arquivo de índice que será gravado'
+    )
+
+    ap.add_argument(
+        '--k',
+        type=int,
+        required=False,
+        default=3,
+        help='Tamanho dos k-grams usados na correção ortográfica (3 padrão).'
+    )
+
+    ap.add_argument(
+        '--processos',
+        type=int,
+        required=False,
+        default=1,
+        help='Quantidade de processos usados para montar o índice (1 padrão).'
+    )
+
+    ap.add_argument(
+        '--pontuacao',
+        type=str,
+        required=False,
+        default='tfidf',
+        choices=PONTUACOES,
+        help='Função de pontuação gravada no índice (tfidf padrão; ver pontuacao.py).'
+    )
+
+    ap.add_argument(
+        '--sem-acentos',
+        action='store_true',
+        help='Remove os acentos dos documentos ("ação" vira "acao"); as buscas fazem o mesmo nas consultas.'
+    )
+
+    ap.add_argument(
+        '--quantizar',
+        action='store_true',
+        help='Grava os pesos como impactos quantizados de 1 byte.'
+    )
+
+    return ap.parse_args()
+
+
+def main(args):
+    print('> Montando o índice')
+    if args.processos > 1:
+        (indice_invertido, posicoes) = construir_indice_invertido_paralelo(
+            args.documentos, args.processos, com_repeticao=True, sem_acentos=args.sem_acentos
+        )
+        documentos = ArmazemDocumentos(args.documentos, posicoes)
+    else:
+        documentos = ArmazemDocumentos(args.documentos)
+        indice_invertido = construir_indice_invertido(documentos, args.sem_acentos)
+    indice_k_grams = construir_indice_k_grams(indice_invertido, k=args.k)
+    (estatisticas, ids_termos) = construir_estatisticas(
+        indice_invertido, documentos, args.pontuacao, args.sem_acentos
+    )
+    (M, cosseno) = calcular_pesos(estatisticas, args.pontuacao)
+
+    print(f'> Gravando {args.saida}')
+    n_termos = gravar_indice(
+        args.saida, M, estatisticas.TF, ids_termos, cosseno, indice_k_grams, documentos.posicoes,
+        os.path.getsize(args.documentos), k=args.k, pontuacao=args.pontuacao,
+        quantizar=args.quantizar, sem_acentos=args.sem_acentos
+    )
+    print(f'> {len(documentos)} documentos e {n_termos} termos indexados')
+
+
+def gravar_indice(caminho, M, TF, ids_termos, cosseno, indice_k_grams, posicoes_documentos,
+                  tamanho_documentos, k=3, pontuacao='tfidf', quantizar=False, sem_acentos=False):
+    '''
+    Ordena os termos, quantiza os pesos (se quantizar), calcula normas e
+    máximos por bloco e grava o índice com salvar_indice. TF é a matriz de
+    tf das descrições, com as mesmas linhas de M (ver salvar_indice).
+    Retorna a quantidade de termos gravados.
+    '''
+    # no arquivo, os termos ficam ordenados para permitir a busca binária
+    termos = sorted(ids_termos)
+    linhas = [ids_termos[t] for t in termos]
+    (M, TF) = (M[linhas], TF[linhas])
+    escala = 1.0
+    if quantizar:
+        (M, escala) = quantizar_pesos(M)
+    # normas e máximos por bloco dos pesos que são de fato gravados
+    pesos = M.astype(np.float64)
+    normas = calcular_normas(pesos) if cosseno else None
+    blocos = calcular_maximos_blocos(pesos, normas)
+
+    salvar_indice(
+        caminho, termos, M, TF, normas, blocos, indice_k_grams,
+        posicoes_documentos, tamanho_documentos, k=k,
+        pontuacao=pontuacao, escala=escala, sem_acentos=sem_acentos
+    )
+    return len(termos)
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,79 @@
+'''
+Correção ortográfica por deleção simétrica (SymSpell, Wolf Garbe).
+
+Para cada termo do vocabulário são pré-calculadas todas as strings obtidas
+removendo até distancia_maxima caracteres dos seus primeiros `prefixo`
+caracteres. Na consulta, são geradas as deleções do termo digitado e cada
+deleção encontrada no índice leva diretamente aos termos candidatos, que são
+confirmados com a distância de Levenshtein bit-paralela (levenshtein_myers).
+Não há varredura do vocabulário.
+
+distancia_maxima e prefixo controlam a troca entre memória e latência:
+a quantidade de deleções por termo cresce com C(prefixo, distancia_maxima).
+'''
+from distancia_edicao import levenshtein_myers, preparar_myers
+
+
+DISTANCIA_MAXIMA = 2
+TAMANHO_PREFIXO = 7
+
+
+def obter_delecoes(termo, distancia_maxima=DISTANCIA_MAXIMA, prefixo=TAMANHO_PREFIXO):
+    '''
+    Retorna as strings obtidas removendo até distancia_maxima caracteres de
+    termo[:prefixo], incluindo o próprio termo[:prefixo].
+    '''
+    atual = {termo[:prefixo]}
+    delecoes = set(atual)
+    for _ in range(distancia_maxima):
+        atual = {t[:i] + t[i + 1:] for t in atual for i in range(len(t))}
+        delecoes |= atual
+    return delecoes
+
+
+class IndiceSymSpell:
+    '''
+    Índice de deleções do vocabulário.
+    frequencias: dicionário de termo para frequência de documento (df),
+    usada para desempatar candidatos à mesma distância.
+    '''
+
+    def __init__(self, frequencias, distancia_maxima=DISTANCIA_MAXIMA, prefixo=TAMANHO_PREFIXO):
+        self.frequencias = frequencias
+        self.distancia_maxima = distancia_maxima
+        self.prefixo = prefixo
+        self.delecoes = {}
+        for termo in frequencias:
+            for delecao in obter_delecoes(termo, distancia_maxima, prefixo):
+                if delecao not in self.delecoes:
+                    self.delecoes[delecao] = [termo]
+                else:
+                    self.delecoes[delecao].append(termo)
+
+    def corrigir(self, termo):
+        '''
+        Retorna o termo do vocabulário mais próximo (distância de Levenshtein
+        até distancia_maxima); nos empates, o de maior df.
+        Retorna '' se não houver nenhum termo a essa distância.
+        '''
+        if termo in self.frequencias:
+            return termo
+
+        melhor = None
+        vistos = set()
+        peq = preparar_myers(termo)
+        for delecao in obter_delecoes(termo, self.distancia_maxima, self.prefixo):
+            for candidato in self.delecoes.get(delecao, ()):
+                if candidato in vistos:
+                    continue
+                vistos.add(candidato)
+                if abs(len(candidato) - len(termo)) > self.distancia_maxima:
+                    continue
+                d = levenshtein_myers(termo, candidato, peq, limite=self.distancia_maxima)
+                if d > self.distancia_maxima:
+                    continue
+                chave = (d, -self.frequencias[candidato], candidato)
+                if melhor is None or chave < melhor:
+                    melhor = chave
+
+        return melhor[2] if melhor else ''
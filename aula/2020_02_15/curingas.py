@@ -0,0 +1,90 @@
+'''
+Expansão de termos com curingas: harr*, *otter, h*ry.
+
+O padrão é completado com k - 1 sinais $ no início e no fim, como os termos
+do índice de k-grams (construir_indice_k_grams), e quebrado nos curingas.
+Os k-grams dos pedaços são buscados no índice de k-grams e os termos que têm
+todos eles são os candidatos (Introduction to Information Retrieval, seção
+3.2.2). Ter os k-grams não basta (retired tem os k-grams $re e red de red*),
+então os candidatos ainda são conferidos com o padrão.
+
+Limites de custo:
+- o padrão precisa ter pelo menos um k-gram (* e *a* não são aceitos);
+- se até a menor lista de termos de um k-gram tiver mais que limite_candidatos
+  termos, o padrão é recusado (ValueError) antes de qualquer conferência;
+- cada padrão é expandido em no máximo limite_termos termos, os de maior
+  frequência de documento.
+'''
+import heapq
+import re
+
+from instrumentacao import contar
+
+
+CURINGA = '*'
+LIMITE_TERMOS = 50
+LIMITE_CANDIDATOS = 20000
+
+
+def tem_curinga(termo):
+    return CURINGA in termo
+
+
+def expandir_padrao(padrao, indice_invertido, indice_k_grams, k=None,
+                    limite_termos=LIMITE_TERMOS, limite_candidatos=LIMITE_CANDIDATOS):
+    '''
+    Retorna a lista ordenada dos termos do índice que casam com o padrão.
+    Se k não for informado, é o tamanho dos k-grams do índice.
+    Lança ValueError se o padrão for amplo demais.
+    '''
+    if k is None:
+        k = len(next(iter(indice_k_grams.keys())))
+    pad = '$' * (k - 1)
+    pedacos = (pad + padrao + pad).split(CURINGA)
+    k_grams = {p[i:i + k] for p in pedacos for i in range(len(p) - k + 1)}
+    if not k_grams:
+        raise ValueError(f'O padrão {padrao} é muito amplo: use mais letras')
+
+    listas = sorted((indice_k_grams.get(k_gram, {}) for k_gram in k_grams), key=len)
+    if len(listas[0]) > limite_candidatos:
+        raise ValueError(f'O padrão {padrao} é muito amplo: use mais letras')
+
+    expressao = re.compile('.*'.join(re.escape(p) for p in padrao.split(CURINGA)))
+    termos = [
+        t for t in listas[0]
+        if all(t in lista for lista in listas[1:]) and expressao.fullmatch(t)
+    ]
+    contar('candidatos_curinga', len(listas[0]))
+    if len(termos) > limite_termos:
+        termos = heapq.nlargest(limite_termos, termos, key=lambda t: len(indice_invertido[t]))
+    return sorted(termos)
+
+
+def expandir_curingas(arvore, indice_invertido, indice_k_grams, **limites):
+    '''
+    Retorna uma cópia da árvore da consulta (expressao_booleana) em que cada
+    termo com curinga vira o OR dos termos em que foi expandido. Um padrão
+    sem nenhum termo é mantido como termo (e não encontra nenhum documento).
+    Lança ValueError se um padrão for amplo demais ou estiver em uma frase.
+    limites: k e os limites de expandir_padrao.
+    '''
+    tipo = arvore[0]
+    if tipo == 'TERMO':
+        if not tem_curinga(arvore[1]):
+            return arvore
+        termos = expandir_padrao(arvore[1], indice_invertido, indice_k_grams, **limites)
+        contar('termos_expandidos', len(termos))
+        if not termos:
+            return arvore
+        if len(termos) == 1:
+            return ('TERMO', termos[0])
+        return ('OR', [('TERMO', t) for t in termos])
+
+    if tipo in ('FRASE', 'NEAR'):
+        if any(tem_curinga(f[1]) for f in arvore[1]):
+            raise ValueError('Curingas não são aceitos em frases e NEAR/k')
+        return arvore
+
+    if tipo == 'NOT':
+        return ('NOT', expandir_curingas(arvore[1], indice_invertido, indice_k_grams, **limites))
+    return (tipo, [expandir_curingas(f, indice_invertido, indice_k_grams, **limites) for f in arvore[1]])
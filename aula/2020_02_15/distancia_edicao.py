@@ -0,0 +1,53 @@
+'''Distâncias de edição entre termos, usadas na correção ortográfica'''
+
+
+def preparar_myers(padrao):
+    '''
+    Retorna as máscaras de bits de cada caractere do padrão (bit i ligado se
+    padrao[i] == caractere), usadas por levenshtein_myers. Podem ser
+    reaproveitadas para comparar o mesmo padrão com vários termos.
+    '''
+    peq = {}
+    for (i, c) in enumerate(padrao):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+def levenshtein_myers(padrao, texto, peq=None, limite=None):
+    '''
+    Distância de Levenshtein bit-paralela (Myers, 1999; versão de Hyyrö para a
+    distância entre duas strings). Cada coluna da matriz de programação
+    dinâmica é processada de uma vez como um inteiro de len(padrao) bits.
+    Se limite for informado, retorna limite + 1 assim que a distância com
+    certeza passar do limite: cada caractere restante do texto diminui a
+    distância em no máximo 1.
+    '''
+    m = len(padrao)
+    if m == 0:
+        return len(texto) if limite is None or len(texto) <= limite else limite + 1
+    if peq is None:
+        peq = preparar_myers(padrao)
+
+    mascara = (1 << m) - 1
+    ultimo = 1 << (m - 1)
+    (pv, mv) = (mascara, 0)
+    distancia = m
+    restantes = len(texto)
+    for c in texto:
+        restantes -= 1
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mascara
+        mh = pv & xh
+        if ph & ultimo:
+            distancia += 1
+        elif mh & ultimo:
+            distancia -= 1
+        ph = ((ph << 1) | 1) & mascara
+        mh = (mh << 1) & mascara
+        pv = (mh | ~(xv | ph)) & mascara
+        mv = ph & xv
+        if limite is not None and distancia - restantes > limite:
+            return limite + 1
+    return distancia if limite is None or distancia <= limite else limite + 1
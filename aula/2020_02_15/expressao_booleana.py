@@ -0,0 +1,171 @@
+'''
+Analisador da linguagem de consulta booleana.
+
+Gramática (NOT tem maior precedência, depois AND e por último OR):
+
+    expressao := conjuncao ('OR' conjuncao)*
+    conjuncao := negacao (['AND'] negacao)*
+    negacao   := 'NOT' negacao | proximidade
+    proximidade := atomo ['NEAR/k' atomo]
+    atomo     := '(' expressao ')' | '"' termo+ '"' | termo
+
+Termos adjacentes sem operador são ligados por AND.
+Os operadores devem ser escritos em letras maiúsculas.
+Termos entre aspas formam uma frase exata; a NEAR/k b exige que os termos
+a e b apareçam a no máximo k posições um do outro, em qualquer ordem.
+
+A consulta é representada por uma árvore de tuplas:
+    ('TERMO', termo)
+    ('FRASE', [termos])
+    ('NEAR', [termo, termo], k)
+    ('AND', [filhos])
+    ('OR', [filhos])
+    ('NOT', filho)
+em que os termos de FRASE e NEAR também são nós ('TERMO', termo).
+'''
+import re
+
+
+OPERADORES = {'AND', 'OR', 'NOT'}
+PROXIMIDADE = re.compile(r'NEAR/(\d+)')
+
+
+def analisar(consulta):
+    '''
+    Converte o texto da consulta em uma árvore.
+    Lança ValueError se a consulta for inválida.
+    '''
+    tokens = re.findall(r'"[^"]*"?|\(|\)|[^\s()"]+', consulta)
+    if not tokens:
+        raise ValueError('Consulta vazia')
+
+    (arvore, i) = _analisar_expressao(tokens, 0)
+    if i < len(tokens):
+        raise ValueError(f'Consulta inválida: "{tokens[i]}" inesperado')
+    return arvore
+
+
+def _analisar_expressao(tokens, i):
+    filhos = []
+    (filho, i) = _analisar_conjuncao(tokens, i)
+    filhos.append(filho)
+    while i < len(tokens) and tokens[i] == 'OR':
+        (filho, i) = _analisar_conjuncao(tokens, i + 1)
+        filhos.append(filho)
+
+    if len(filhos) == 1:
+        return (filhos[0], i)
+    return (('OR', filhos), i)
+
+
+def _analisar_conjuncao(tokens, i):
+    filhos = []
+    (filho, i) = _analisar_negacao(tokens, i)
+    filhos.append(filho)
+    while i < len(tokens) and tokens[i] not in ('OR', ')'):
+        if tokens[i] == 'AND':
+            i += 1
+        (filho, i) = _analisar_negacao(tokens, i)
+        filhos.append(filho)
+
+    if len(filhos) == 1:
+        return (filhos[0], i)
+    return (('AND', filhos), i)
+
+
+def _analisar_negacao(tokens, i):
+    if i < len(tokens) and tokens[i] == 'NOT':
+        (filho, i) = _analisar_negacao(tokens, i + 1)
+        return (('NOT', filho), i)
+    return _analisar_proximidade(tokens, i)
+
+
+def _analisar_proximidade(tokens, i):
+    (esquerda, i) = _analisar_atomo(tokens, i)
+    operador = PROXIMIDADE.fullmatch(tokens[i]) if i < len(tokens) else None
+    if not operador:
+        return (esquerda, i)
+
+    (direita, i) = _analisar_atomo(tokens, i + 1)
+    if esquerda[0] != 'TERMO' or direita[0] != 'TERMO':
+        raise ValueError(f'Consulta inválida: {operador.group()} liga apenas dois termos')
+    if i < len(tokens) and PROXIMIDADE.fullmatch(tokens[i]):
+        raise ValueError(f'Consulta inválida: {tokens[i]} liga apenas dois termos')
+    return (('NEAR', [esquerda, direita], int(operador.group(1))), i)
+
+
+def _analisar_atomo(tokens, i):
+    if i >= len(tokens):
+        raise ValueError('Consulta inválida: termina com um operador')
+
+    token = tokens[i]
+    if token == '(':
+        (arvore, i) = _analisar_expressao(tokens, i + 1)
+        if i >= len(tokens) or tokens[i] != ')':
+            raise ValueError('Consulta inválida: falta fechar parênteses')
+        return (arvore, i + 1)
+
+    if token == ')' or token in OPERADORES or PROXIMIDADE.fullmatch(token):
+        raise ValueError(f'Consulta inválida: "{token}" inesperado')
+
+    if token.startswith('"'):
+        if len(token) < 2 or not token.endswith('"'):
+            raise ValueError('Consulta inválida: falta fechar aspas')
+        termos = token[1:-1].split()
+        if not termos:
+            raise ValueError('Consulta inválida: frase vazia')
+        if len(termos) == 1:
+            return (('TERMO', termos[0]), i + 1)
+        return (('FRASE', [('TERMO', t) for t in termos]), i + 1)
+
+    return (('TERMO', token), i + 1)
+
+
+def obter_termos(arvore):
+    '''Retorna a lista de termos da árvore, na ordem em que aparecem'''
+    if arvore[0] == 'TERMO':
+        return [arvore[1]]
+    if arvore[0] == 'NOT':
+        return obter_termos(arvore[1])
+    return [t for filho in arvore[1] for t in obter_termos(filho)]
+
+
+def tem_proximidade(arvore):
+    '''Se a árvore tem alguma frase ou NEAR/k'''
+    if arvore[0] in ('FRASE', 'NEAR'):
+        return True
+    if arvore[0] == 'TERMO':
+        return False
+    if arvore[0] == 'NOT':
+        return tem_proximidade(arvore[1])
+    return any(tem_proximidade(filho) for filho in arvore[1])
+
+
+def mapear_termos(arvore, funcao):
+    '''Retorna uma cópia da árvore com funcao aplicada a cada termo'''
+    if arvore[0] == 'TERMO':
+        return ('TERMO', funcao(arvore[1]))
+    if arvore[0] == 'NOT':
+        return ('NOT', mapear_termos(arvore[1], funcao))
+    return (arvore[0], [mapear_termos(filho, funcao) for filho in arvore[1]]) + arvore[2:]
+
+
+def formatar(arvore):
+    '''Converte a árvore de volta para o texto da consulta'''
+    if arvore[0] == 'TERMO':
+        return arvore[1]
+    if arvore[0] == 'NOT':
+        return 'NOT ' + _formatar_operando(arvore[1])
+    if arvore[0] == 'FRASE':
+        return '"' + ' '.join(formatar(filho) for filho in arvore[1]) + '"'
+    if arvore[0] == 'NEAR':
+        (esquerda, direita) = arvore[1]
+        return f'{formatar(esquerda)} NEAR/{arvore[2]} {formatar(direita)}'
+    separador = f' {arvore[0]} '
+    return separador.join(_formatar_operando(filho) for filho in arvore[1])
+
+
+def _formatar_operando(arvore):
+    if arvore[0] in ('AND', 'OR'):
+        return f'({formatar(arvore)})'
+    return formatar(arvore)
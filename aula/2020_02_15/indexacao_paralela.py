@@ -0,0 +1,96 @@
+'''
+Construção do índice invertido em paralelo.
+
+O arquivo .jl é dividido em intervalos de bytes alinhados ao início das
+linhas; cada processo lê o seu intervalo, tokeniza os documentos e monta um
+índice parcial com doc ids locais. Os índices parciais são então juntados em
+ordem, deslocando os doc ids de cada parte pela quantidade de documentos das
+partes anteriores, o que resulta exatamente no índice da construção serial.
+Cada parte também devolve a posição em bytes dos seus documentos, usada
+pelo ArmazemDocumentos sem precisar ler o arquivo outra vez.
+'''
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+
+from vocabulario import IndiceInvertido, obter_tokens
+
+
+def dividir_arquivo(caminho, n_partes):
+    '''
+    Divide o arquivo em até n_partes intervalos [início, fim) de bytes,
+    cada um começando no início de uma linha.
+    '''
+    tamanho = os.path.getsize(caminho)
+    cortes = [0]
+    with open(caminho, 'rb') as f:
+        for i in range(1, n_partes):
+            f.seek(max(tamanho * i // n_partes - 1, 0))
+            f.readline()
+            corte = f.tell()
+            if corte > cortes[-1] and corte < tamanho:
+                cortes.append(corte)
+    cortes.append(tamanho)
+    return list(zip(cortes[:-1], cortes[1:]))
+
+
+def indexar_parte(caminho, inicio, fim, com_repeticao=False, sem_acentos=False):
+    '''
+    Indexa os documentos das linhas em [inicio, fim) do arquivo.
+    Se com_repeticao, o doc id aparece uma vez por ocorrência do termo
+    (como em busca_ordenada); senão, uma vez por documento (busca_boolean).
+    Saída: (posições dos documentos no arquivo, índice invertido com doc ids locais)
+    '''
+    indice_invertido = IndiceInvertido()
+    posicoes = array('q')
+    doc_id = 0
+    with open(caminho, 'rb') as f:
+        f.seek(inicio)
+        while f.tell() < fim:
+            posicao = f.tell()
+            linha = f.readline()
+            if not linha:
+                break
+            documento = json.loads(linha)
+            if not documento['descricao']:
+                continue
+            posicoes.append(posicao)
+            indice_invertido.adicionar(
+                doc_id, obter_tokens(documento['descricao'], sem_acentos), com_repeticao
+            )
+            doc_id += 1
+
+    return (posicoes, indice_invertido)
+
+
+def construir_indice_invertido_paralelo(caminho, n_processos=None, com_repeticao=False,
+                                        sem_acentos=False):
+    '''
+    Constrói o índice invertido do arquivo .jl usando n_processos processos
+    (padrão: um por CPU).
+    Saída: (índice invertido, posições em bytes dos documentos indexados)
+    '''
+    n_processos = n_processos or os.cpu_count()
+    partes = dividir_arquivo(caminho, n_processos)
+    with ProcessPoolExecutor(n_processos) as executor:
+        parciais = list(executor.map(
+            indexar_parte,
+            [caminho] * len(partes),
+            [inicio for (inicio, _) in partes],
+            [fim for (_, fim) in partes],
+            [com_repeticao] * len(partes),
+            [sem_acentos] * len(partes)
+        ))
+
+    indice_invertido = IndiceInvertido()
+    posicoes = array('q')
+    for (posicoes_parte, parcial) in parciais:
+        deslocamento = len(posicoes)
+        for (termo, postings) in parcial.items():
+            if deslocamento:
+                postings = [d + deslocamento for d in postings]
+            indice_invertido.estender(termo, postings)
+        posicoes.extend(posicoes_parte)
+
+    return (indice_invertido, posicoes)
@@ -0,0 +1,319 @@
+'''
+Índice persistente em disco, carregado com mmap.
+
+O arquivo começa com um cabeçalho (MAGICA, VERSAO e quantidade de seções)
+seguido de uma tabela de seções (nome, dtype, início, tamanho em bytes).
+Cada seção é um array contíguo, alinhado em 8 bytes, lido sem cópia com
+np.frombuffer sobre o mmap. Assim, vários processos que abrem o mesmo
+arquivo compartilham as páginas do índice no cache do sistema operacional.
+
+Seções:
+    meta              JSON com k (k-grams), n_documentos, tamanho_documentos,
+                      pontuacao (pontuacao.py), escala dos impactos quantizados
+                      e sem_acentos (se os acentos foram removidos dos termos)
+    termos            termos ordenados, concatenados em UTF-8
+    termos_pos        início de cada termo em "termos" (n_termos + 1)
+    postings          postings comprimidas (postings.py) de todos os termos
+    postings_pos      início das postings de cada termo (n_termos + 1)
+    blocos_pos        primeiro bloco de cada termo (n_termos + 1)
+    blocos_ultimos    último doc id de cada bloco
+    blocos_posicoes   início de cada bloco dentro das postings do termo
+    df                quantidade de documentos de cada termo
+    M_indptr          matriz de pesos em CSR, linha i = termo i
+    M_indices
+    M_data            pesos (float64) ou impactos quantizados (uint8)
+    normas            norma de cada documento (coluna de M); ausente nas
+                      pontuações sem similaridade de cosenos (BM25)
+    wand_inicios      primeiro bloco do WAND de cada termo (n_termos + 1)
+    wand_ultimos      último doc id de cada bloco do WAND
+    wand_maximos      limite superior de cada bloco do WAND
+    k_grams           k-grams ordenados, concatenados em UTF-8
+    k_grams_pos       início de cada k-gram em "k_grams" (n_k_grams + 1)
+    k_grams_termos    ids dos termos de cada k-gram, concatenados
+    k_grams_termos_pos  início dos termos de cada k-gram (n_k_grams + 1)
+    k_grams_tamanhos  quantidade de k-grams de cada termo
+    documentos_pos    posição em bytes de cada documento no arquivo .jl
+'''
+from collections.abc import Mapping
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from scipy import sparse
+
+from armazem_documentos import ArmazemDocumentos
+from postings import ListasComprimidas, comprimir_listas
+
+
+MAGICA = b'RIINDICE'
+VERSAO = 5
+
+_CABECALHO = struct.Struct('<8sII')  # mágica, versão, quantidade de seções
+_SECAO = struct.Struct('<24s8sQQ')  # nome, dtype, início, tamanho
+_ALINHAMENTO = 8
+
+
+def salvar_indice(caminho, termos, M, TF, normas, blocos, indice_k_grams,
+                  posicoes_documentos, tamanho_documentos, k=3, pontuacao='tfidf', escala=1.0,
+                  sem_acentos=False):
+    '''
+    Grava o índice no arquivo caminho.
+    Entrada:
+        termos: lista ordenada de termos; a linha i de M é o termo termos[i]
+        M, normas, blocos: matriz de pesos (CSR), normas dos documentos (ou
+            None) e máximos por bloco (busca_ordenada.calcular_maximos_blocos)
+        TF: matriz de tf das descrições, com as mesmas linhas de M; as
+            postings e o df da busca boolean saem dela, já que no bm25f M
+            também tem os termos dos títulos
+        pontuacao, escala: função de pontuação de M e, se M tiver impactos
+            quantizados, o valor de cada unidade (ver pontuacao.quantizar)
+        sem_acentos: se os termos foram gerados sem acentos (as consultas
+            devem ser normalizadas do mesmo jeito)
+        indice_k_grams: dicionário de k-gram para {termo: quantidade de k-grams}
+        posicoes_documentos, tamanho_documentos: posição em bytes de cada
+            documento e tamanho do arquivo .jl (ver ArmazemDocumentos)
+    '''
+    M = sparse.csr_matrix(M)
+    M.sort_indices()
+    tipo_indice = np.int32 if M.nnz < 2 ** 31 else np.int64
+
+    TF = sparse.csr_matrix(TF)
+    TF.sort_indices()
+    (postings, postings_pos, blocos_pos, blocos_ultimos, blocos_posicoes, df) = comprimir_listas(
+        TF.indices[TF.indptr[i]:TF.indptr[i + 1]].tolist() for i in range(len(termos))
+    )
+
+    ids_termos = {t: i for (i, t) in enumerate(termos)}
+    k_grams = sorted(indice_k_grams)
+    k_grams_termos = []
+    k_grams_termos_pos = [0]
+    k_grams_tamanhos = np.zeros(len(termos), dtype=np.uint16)
+    for k_gram in k_grams:
+        for (t, n) in indice_k_grams[k_gram].items():
+            k_grams_tamanhos[ids_termos[t]] = n
+        k_grams_termos.extend(sorted(ids_termos[t] for t in indice_k_grams[k_gram]))
+        k_grams_termos_pos.append(len(k_grams_termos))
+
+    meta = {
+        'k': k,
+        'n_documentos': M.shape[1],
+        'tamanho_documentos': tamanho_documentos,
+        'pontuacao': pontuacao,
+        'escala': escala,
+        'sem_acentos': sem_acentos,
+    }
+    (termos_dados, termos_pos) = _concatenar(termos)
+    (k_grams_dados, k_grams_pos) = _concatenar(k_grams)
+    secoes = [
+        ('meta', np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)),
+        ('termos', termos_dados),
+        ('termos_pos', termos_pos),
+        ('postings', np.frombuffer(postings, dtype=np.uint8)),
+        ('postings_pos', np.frombuffer(postings_pos, dtype=np.int64)),
+        ('blocos_pos', np.frombuffer(blocos_pos, dtype=np.int64)),
+        ('blocos_ultimos', np.frombuffer(blocos_ultimos, dtype=np.intc)),
+        ('blocos_posicoes', np.frombuffer(blocos_posicoes, dtype=np.intc)),
+        ('df', np.array(df, dtype=np.int64)),
+        ('M_indptr', M.indptr.astype(tipo_indice)),
+        ('M_indices', M.indices.astype(tipo_indice)),
+        ('M_data', M.data if M.data.dtype == np.uint8 else M.data.astype(np.float64)),
+        ('wand_inicios', np.asarray(blocos[0], dtype=np.int64)),
+        ('wand_ultimos', np.asarray(blocos[1], dtype=tipo_indice)),
+        ('wand_maximos', np.asarray(blocos[2], dtype=np.float64)),
+        ('k_grams', k_grams_dados),
+        ('k_grams_pos', k_grams_pos),
+        ('k_grams_termos', np.array(k_grams_termos, dtype=np.int32)),
+        ('k_grams_termos_pos', np.array(k_grams_termos_pos, dtype=np.int64)),
+        ('k_grams_tamanhos', k_grams_tamanhos),
+        ('documentos_pos', np.asarray(posicoes_documentos, dtype=np.int64)),
+    ]
+    if normas is not None:
+        secoes.append(('normas', np.asarray(normas, dtype=np.float64)))
+
+    inicio = _alinhar(_CABECALHO.size + _SECAO.size * len(secoes))
+    tabela = []
+    for (nome, dados) in secoes:
+        tabela.append(_SECAO.pack(
+            nome.encode('ascii'), dados.dtype.str.encode('ascii'), inicio, dados.nbytes
+        ))
+        inicio = _alinhar(inicio + dados.nbytes)
+
+    # o índice é gravado em um arquivo temporário que depois substitui o
+    # anterior: quem estiver com o índice antigo aberto (mmap) continua lendo
+    # o arquivo antigo, e uma falha no meio da gravação não deixa um índice
+    # corrompido no lugar
+    temporario = caminho + '.tmp'
+    try:
+        with open(temporario, 'wb') as f:
+            f.write(_CABECALHO.pack(MAGICA, VERSAO, len(secoes)))
+            f.write(b''.join(tabela))
+            for (_, dados) in secoes:
+                f.write(b'\0' * (_alinhar(f.tell()) - f.tell()))
+                f.write(dados.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def _concatenar(textos):
+    '''Retorna (bytes concatenados, posições de início) de uma lista de strings'''
+    codificados = [t.encode('utf-8') for t in textos]
+    posicoes = np.zeros(len(codificados) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in codificados], out=posicoes[1:])
+    return (np.frombuffer(b''.join(codificados), dtype=np.uint8), posicoes)
+
+
+def _alinhar(n):
+    return (n + _ALINHAMENTO - 1) // _ALINHAMENTO * _ALINHAMENTO
+
+
+class IndiceDisco:
+    '''
+    Índice gravado por salvar_indice, aberto com mmap (somente leitura).
+    Atributos usados pelas buscas:
+        termos: DicionarioTermos (termo -> id da linha de M)
+        postings: ListasComprimidas (termo -> PostingsComprimida)
+        k_grams: IndiceKGrams (k-gram -> {termo: quantidade de k-grams})
+        M, normas, blocos: matriz de pesos e estatísticas do ranqueamento
+            (normas é None nas pontuações sem similaridade de cosenos)
+        pontuacao, escala: função de pontuação e escala dos impactos de M
+        sem_acentos: se as consultas devem ter os acentos removidos
+    '''
+
+    def __init__(self, caminho):
+        with open(caminho, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magica, versao, n_secoes) = _CABECALHO.unpack_from(self.mm, 0)
+        if magica != MAGICA:
+            raise ValueError(f'{caminho} não é um arquivo de índice')
+        if versao != VERSAO:
+            raise ValueError(
+                f'{caminho} está na versão {versao} do formato; a versão suportada é {VERSAO}'
+            )
+
+        self.secoes = {}
+        for i in range(n_secoes):
+            (nome, dtype, inicio, tamanho) = _SECAO.unpack_from(
+                self.mm, _CABECALHO.size + i * _SECAO.size
+            )
+            dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+            self.secoes[nome.rstrip(b'\0').decode('ascii')] = np.frombuffer(
+                self.mm, dtype=dtype, count=tamanho // dtype.itemsize, offset=inicio
+            )
+
+        self.meta = json.loads(self.secoes['meta'].tobytes())
+        self.k = self.meta['k']
+        self.n_documentos = self.meta['n_documentos']
+        self.termos = DicionarioTermos(self.secoes['termos'], self.secoes['termos_pos'])
+        self.postings = ListasComprimidas(
+            self.termos, self.secoes['postings'], self.secoes['postings_pos'],
+            self.secoes['blocos_pos'], self.secoes['blocos_ultimos'],
+            self.secoes['blocos_posicoes'], self.secoes['df']
+        )
+        self.k_grams = IndiceKGrams(self)
+        self.M = sparse.csr_matrix(
+            (self.secoes['M_data'], self.secoes['M_indices'], self.secoes['M_indptr']),
+            shape=(len(self.termos), self.n_documentos),
+            copy=False
+        )
+        self.normas = self.secoes.get('normas')
+        self.pontuacao = self.meta['pontuacao']
+        self.escala = self.meta['escala']
+        self.sem_acentos = self.meta.get('sem_acentos', False)
+        self.blocos = (
+            self.secoes['wand_inicios'], self.secoes['wand_ultimos'], self.secoes['wand_maximos']
+        )
+
+    def abrir_documentos(self, caminho):
+        '''
+        Retorna o ArmazemDocumentos do arquivo .jl indexado, usando as
+        posições gravadas no índice.
+        '''
+        if os.path.getsize(caminho) != self.meta['tamanho_documentos']:
+            raise ValueError(f'{caminho} foi alterado depois da construção do índice')
+        return ArmazemDocumentos(caminho, self.secoes['documentos_pos'])
+
+    def frequencias(self):
+        '''Retorna um dicionário de termo para frequência de documento (df)'''
+        return dict(zip(self.termos, self.secoes['df'].tolist()))
+
+
+def carregar_indice(caminho):
+    '''Abre o índice gravado em caminho por salvar_indice'''
+    return IndiceDisco(caminho)
+
+
+class _TextosOrdenados:
+    '''Lista ordenada de strings guardada como bytes concatenados'''
+
+    def __init__(self, dados, posicoes):
+        self.dados = memoryview(dados)
+        self.posicoes = posicoes
+
+    def __len__(self):
+        return len(self.posicoes) - 1
+
+    def texto(self, i):
+        return bytes(self.dados[self.posicoes[i]:self.posicoes[i + 1]]).decode('utf-8')
+
+    def buscar(self, texto):
+        '''Retorna a posição de texto, ou -1 se não existir'''
+        alvo = texto.encode('utf-8')
+        (inicio, fim) = (0, len(self))
+        while inicio < fim:
+            meio = (inicio + fim) // 2
+            atual = bytes(self.dados[self.posicoes[meio]:self.posicoes[meio + 1]])
+            if atual < alvo:
+                inicio = meio + 1
+            else:
+                fim = meio
+        if inicio < len(self) and self.texto(inicio) == texto:
+            return inicio
+        return -1
+
+
+class DicionarioTermos(_TextosOrdenados, Mapping):
+    '''Dicionário de termo para id, com busca binária sobre os termos ordenados'''
+
+    def __getitem__(self, termo):
+        i = self.buscar(termo)
+        if i < 0:
+            raise KeyError(termo)
+        return i
+
+    def __iter__(self):
+        return (self.texto(i) for i in range(len(self)))
+
+
+class IndiceKGrams(Mapping):
+    '''
+    Dicionário de k-gram para os termos que o contém, cada um com a sua
+    quantidade de k-grams (como em construir_indice_k_grams)
+    '''
+
+    def __init__(self, indice):
+        self.termos = indice.termos
+        self.k_grams = _TextosOrdenados(indice.secoes['k_grams'], indice.secoes['k_grams_pos'])
+        self.ids_termos = indice.secoes['k_grams_termos']
+        self.ids_termos_pos = indice.secoes['k_grams_termos_pos']
+        self.tamanhos = indice.secoes['k_grams_tamanhos']
+
+    def __getitem__(self, k_gram):
+        i = self.k_grams.buscar(k_gram)
+        if i < 0:
+            raise KeyError(k_gram)
+        ids = self.ids_termos[self.ids_termos_pos[i]:self.ids_termos_pos[i + 1]]
+        return {self.termos.texto(j): int(self.tamanhos[j]) for j in ids}
+
+    def __iter__(self):
+        return (self.k_grams.texto(i) for i in range(len(self.k_grams)))
+
+    def __len__(self):
+        return len(self.k_grams)
@@ -0,0 +1,433 @@
+'''
+Índice invertido incremental, organizado em segmentos (log-structured).
+
+Cada lote de documentos novos vira um segmento pequeno e imutável em memória.
+Remoções e atualizações (pela URL) apenas marcam o doc id como removido;
+os documentos removidos são descartados de fato quando os segmentos são
+mesclados. A mesclagem junta segmentos vizinhos de tamanho parecido
+(FATOR_MESCLA segmentos do mesmo nível viram um segmento do nível seguinte),
+de modo que a quantidade de segmentos cresce apenas logaritmicamente.
+
+O df de cada termo e a quantidade de documentos são mantidos a cada
+inserção/remoção, então o idf é sempre o da coleção inteira,
+independentemente de como os documentos estão divididos entre segmentos.
+'''
+from argparse import ArgumentParser
+from collections import Counter
+from collections.abc import Mapping
+import heapq
+from itertools import islice
+import json
+import math
+import threading
+
+from busca_boolean import (
+    aplicar_correcao_ortografica,
+    avaliar,
+    normalizar_tokens,
+    obter_k_grams,
+    obter_termo_corrigido,
+    obter_tokens,
+    planejar,
+)
+from cache_consultas import CAPACIDADE, CacheConsultas
+from expressao_booleana import analisar, formatar, mapear_termos, obter_termos, tem_proximidade
+
+
+FATOR_MESCLA = 4
+
+
+def parse_args():
+    ap = ArgumentParser()
+
+    ap.add_argument(
+        '--documentos',
+        type=str,
+        required=True,
+        help='Arquivo .jl acompanhado: linhas novas são indexadas antes de cada consulta'
+    )
+
+    ap.add_argument(
+        '--modo',
+        type=str,
+        required=False,
+        default='ordenado',
+        choices=['boolean', 'ordenado'],
+        help='Tipo de busca: boolean ou ordenado (padrão).'
+    )
+
+    ap.add_argument(
+        '--n-resultados',
+        type=int,
+        required=False,
+        default=10,
+        help='Quantidade máxima de resultados (10 padrão) para retornar na busca.'
+    )
+
+    ap.add_argument(
+        '--cache',
+        type=int,
+        required=False,
+        default=CAPACIDADE,
+        help=f'Quantidade de consultas guardadas no cache ({CAPACIDADE} padrão); 0 desativa.'
+    )
+
+    ap.add_argument(
+        '--cache-ttl',
+        type=float,
+        required=False,
+        default=None,
+        help='Validade em segundos das entradas do cache (sem expiração por padrão).'
+    )
+
+    return ap.parse_args()
+
+
+def main(args):
+    print('Bem-vindo ao sistema de busca de livros.')
+    print('> Documentos adicionados ao arquivo são pesquisáveis na consulta seguinte')
+    print('> Pressione ENTER sem nenhuma palavras para sair')
+    indice = IndiceIncremental()
+    # invalidado sempre que documentos são adicionados, atualizados ou removidos
+    cache = CacheConsultas(args.cache, args.cache_ttl, geracao=lambda: indice.geracao)
+    corretor = lambda termo: cache.obter(
+        ('correcao', termo), lambda: obter_termo_corrigido(termo, indice.k_grams)
+    )
+    while True:
+        n = indice.acompanhar(args.documentos)
+        if n:
+            print(f'> {n} linhas novas indexadas ({len(indice.segmentos)} segmentos)')
+            indice.mesclar_em_segundo_plano()
+        print('=' * 80)
+        print('=' * 80)
+        consulta = input('Qual é a sua consulta? ')
+        consulta = consulta.strip()
+        if not consulta:
+            print(f'> Cache: {cache.estatisticas()}')
+            print('Saindo...')
+            break
+
+        try:
+            arvore = analisar(consulta)
+            if args.modo == 'boolean' and tem_proximidade(arvore):
+                raise ValueError('O índice incremental não guarda posições: frases e NEAR/k não são aceitos')
+        except ValueError as e:
+            print(e)
+            continue
+
+        arvore = mapear_termos(arvore, lambda t: normalizar_tokens([t])[0])
+        termos = obter_termos(arvore)
+        termos_ = aplicar_correcao_ortografica(termos, indice, indice.k_grams, corretor)
+        correcoes = dict(zip(termos, termos_))
+        arvore_ = mapear_termos(arvore, correcoes.get)
+        if arvore_ != arvore:
+            arvore = arvore_
+            print(f'Você quis dizer "{formatar(arvore)}"?')
+        else:
+            print(f'Resultados para {consulta}')
+
+        print()
+        if args.modo == 'boolean':
+            calcular = lambda: list(islice(indice.consultar_expressao(arvore), args.n_resultados))
+        else:
+            calcular = lambda: indice.consultar_ordenado(obter_termos(arvore), k=args.n_resultados)
+        resultados = cache.obter(
+            ('resultados', args.modo, formatar(arvore), args.n_resultados), calcular
+        )
+        for (documento, i) in zip(resultados, range(args.n_resultados)):
+            print(f'{i + 1}. {documento["titulo"]}')
+            print(documento["url"])
+            print('>', documento['descricao'][:100], '...')
+            print()
+
+
+class Segmento:
+    '''
+    Índice invertido imutável de um intervalo crescente de doc ids.
+    postings: termo -> lista ordenada de doc ids
+    tfs: termo -> lista de frequências, paralela a postings
+    '''
+
+    __slots__ = ('doc_ids', 'postings', 'tfs')
+
+    def __init__(self, doc_ids, postings, tfs):
+        self.doc_ids = doc_ids
+        self.postings = postings
+        self.tfs = tfs
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+def construir_segmento(vetores):
+    '''Constrói um segmento a partir de [(doc_id, {termo: tf})] em ordem de doc id'''
+    postings = {}
+    tfs = {}
+    for (doc_id, vetor) in vetores:
+        for (termo, tf) in vetor.items():
+            if termo not in postings:
+                postings[termo] = [doc_id]
+                tfs[termo] = [tf]
+            else:
+                postings[termo].append(doc_id)
+                tfs[termo].append(tf)
+    return Segmento([d for (d, _) in vetores], postings, tfs)
+
+
+def mesclar_segmentos(segmentos, removidos):
+    '''
+    Junta segmentos vizinhos (em ordem de doc id) em um só,
+    descartando os doc ids removidos.
+    '''
+    postings = {}
+    tfs = {}
+    for segmento in segmentos:
+        for (termo, p) in segmento.postings.items():
+            vivos = [(d, tf) for (d, tf) in zip(p, segmento.tfs[termo]) if d not in removidos]
+            if not vivos:
+                continue
+            if termo not in postings:
+                postings[termo] = []
+                tfs[termo] = []
+            postings[termo].extend(d for (d, _) in vivos)
+            tfs[termo].extend(tf for (_, tf) in vivos)
+    doc_ids = [d for s in segmentos for d in s.doc_ids if d not in removidos]
+    return Segmento(doc_ids, postings, tfs)
+
+
+def nivel(segmento):
+    '''Nível do segmento na mesclagem: log do tamanho na base FATOR_MESCLA'''
+    return int(math.log(max(len(segmento), 1), FATOR_MESCLA))
+
+
+class IndiceIncremental(Mapping):
+    '''
+    Índice invertido que aceita inserções, remoções e atualizações de
+    documentos sem reconstrução completa.
+    Funciona como um dicionário de termo para a lista de doc ids (vivos),
+    portanto pode ser usado com as funções de busca_boolean.
+    O atributo geracao é incrementado a cada alteração do conteúdo.
+    '''
+
+    def __init__(self, k=3):
+        self.k = k
+        self.segmentos = ()
+        self.removidos = set()
+        self.documentos = {}
+        self.vetores = {}
+        self.urls = {}
+        self.df = Counter()
+        self.k_grams = {}
+        self.proximo_id = 0
+        self.geracao = 0
+        self.posicoes_arquivos = {}
+        self.normas = {}
+        self.geracao_normas = 0
+        self.trava = threading.Lock()
+        self.trava_mescla = threading.Lock()
+
+    def __getitem__(self, termo):
+        if not self.df.get(termo):
+            raise KeyError(termo)
+        (segmentos, removidos) = (self.segmentos, self.removidos)
+        # os segmentos cobrem intervalos crescentes de doc ids,
+        # então a concatenação já está ordenada
+        return [
+            d
+            for s in segmentos
+            for d in s.postings.get(termo, [])
+            if d not in removidos
+        ]
+
+    def __contains__(self, termo):
+        return self.df.get(termo, 0) > 0
+
+    def __iter__(self):
+        return (t for (t, df) in list(self.df.items()) if df > 0)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def adicionar(self, documentos):
+        '''
+        Indexa os documentos como um novo segmento.
+        Um documento com a URL de outro já indexado o substitui.
+        Retorna a quantidade de documentos indexados.
+        '''
+        with self.trava:
+            vetores = []
+            alterado = False
+            for documento in documentos:
+                alterado |= self._remover(documento['url'])
+                if not documento.get('descricao'):
+                    continue
+                doc_id = self.proximo_id
+                self.proximo_id += 1
+                vetor = Counter(obter_tokens(documento['descricao']))
+                self.documentos[doc_id] = documento
+                self.vetores[doc_id] = vetor
+                self.urls[documento['url']] = doc_id
+                for termo in vetor:
+                    if not self.df[termo]:
+                        self._adicionar_k_grams(termo)
+                    self.df[termo] += 1
+                vetores.append((doc_id, vetor))
+
+            if vetores:
+                self.segmentos = self.segmentos + (construir_segmento(vetores),)
+            if vetores or alterado:
+                self.geracao += 1
+        return len(vetores)
+
+    def remover(self, url):
+        '''Remove o documento com essa URL, se existir'''
+        with self.trava:
+            if self._remover(url):
+                self.geracao += 1
+
+    def _remover(self, url):
+        '''Retorna se havia um documento com essa URL'''
+        doc_id = self.urls.pop(url, None)
+        if doc_id is None:
+            return False
+        for termo in self.vetores.pop(doc_id):
+            self.df[termo] -= 1
+            if not self.df[termo]:
+                del self.df[termo]
+                self._remover_k_grams(termo)
+        del self.documentos[doc_id]
+        self.removidos.add(doc_id)
+        return True
+
+    def _adicionar_k_grams(self, termo):
+        k_grams = obter_k_grams(termo, self.k)
+        for k_gram in k_grams:
+            self.k_grams.setdefault(k_gram, {})[termo] = len(k_grams)
+
+    def _remover_k_grams(self, termo):
+        for k_gram in obter_k_grams(termo, self.k):
+            del self.k_grams[k_gram][termo]
+            if not self.k_grams[k_gram]:
+                del self.k_grams[k_gram]
+
+    def acompanhar(self, caminho):
+        '''
+        Indexa as linhas completas adicionadas ao arquivo .jl desde a última
+        chamada. Linhas com "removido": true removem o documento da URL.
+        Retorna a quantidade de linhas lidas.
+        '''
+        novos = []
+        n = 0
+        with open(caminho, 'rb') as f:
+            f.seek(self.posicoes_arquivos.get(caminho, 0))
+            for linha in f:
+                if not linha.endswith(b'\n'):
+                    break
+                self.posicoes_arquivos[caminho] = f.tell()
+                n += 1
+                documento = json.loads(linha)
+                if documento.get('removido'):
+                    self.adicionar(novos)
+                    novos = []
+                    self.remover(documento['url'])
+                else:
+                    novos.append(documento)
+        self.adicionar(novos)
+        return n
+
+    def mesclar(self, tudo=False):
+        '''
+        Mescla os últimos FATOR_MESCLA segmentos enquanto estiverem no mesmo
+        nível (ou todos os segmentos, se tudo=True).
+        A mescla é feita sem segurar a trava: as consultas continuam usando os
+        segmentos antigos até a troca, que é atômica.
+        '''
+        with self.trava_mescla:
+            while True:
+                with self.trava:
+                    segmentos = self.segmentos
+                    removidos = frozenset(self.removidos)
+                if tudo:
+                    if len(segmentos) < 2 and not removidos:
+                        return
+                    grupo = segmentos
+                else:
+                    grupo = segmentos[-FATOR_MESCLA:]
+                    if len(grupo) < FATOR_MESCLA or len({nivel(s) for s in grupo}) > 1:
+                        return
+
+                mesclado = mesclar_segmentos(grupo, removidos)
+                descartados = {d for s in grupo for d in s.doc_ids} & removidos
+                with self.trava:
+                    # novos segmentos podem ter sido adicionados durante a mescla
+                    inicio = self.segmentos.index(grupo[0])
+                    self.segmentos = (
+                        self.segmentos[:inicio] + (mesclado,) + self.segmentos[inicio + len(grupo):]
+                    )
+                    # um conjunto novo, e não -=: as consultas em andamento
+                    # continuam com os segmentos antigos e o conjunto antigo,
+                    # em que os doc ids descartados ainda estão removidos
+                    self.removidos = self.removidos - descartados
+                if tudo:
+                    return
+
+    def mesclar_em_segundo_plano(self, tudo=False):
+        '''Executa mesclar em uma thread, sem bloquear as consultas'''
+        thread = threading.Thread(target=self.mesclar, kwargs={'tudo': tudo}, daemon=True)
+        thread.start()
+        return thread
+
+    def consultar_expressao(self, arvore):
+        '''Retorna os documentos que satisfazem a expressão booleana'''
+        removidos = self.removidos
+        doc_ids = avaliar(planejar(arvore, self), self, self.proximo_id)
+        for doc_id in doc_ids:
+            # o complemento de NOT inclui os doc ids removidos
+            if doc_id not in removidos and doc_id in self.documentos:
+                yield self.documentos[doc_id]
+
+    def consultar_ordenado(self, termos_consulta, k=10):
+        '''
+        Retorna os k documentos mais similares (cosenos, TF-IDF) à consulta.
+        O idf usa o df e o N atuais da coleção inteira; as normas dos
+        documentos são calculadas sob demanda e descartadas quando o índice muda.
+        '''
+        (segmentos, removidos) = (self.segmentos, self.removidos)
+        N = len(self.documentos)
+        termos = {t for t in termos_consulta if self.df.get(t)}
+        if not termos or not N:
+            return []
+
+        idf = {t: math.log(N / self.df[t]) for t in termos}
+        produtos = Counter()
+        for s in segmentos:
+            for t in termos:
+                for (d, tf) in zip(s.postings.get(t, []), s.tfs.get(t, [])):
+                    if d not in removidos:
+                        produtos[d] += tf * idf[t]
+
+        q_norm = math.sqrt(len(termos))
+        similaridades = []
+        for (d, produto) in produtos.items():
+            norma = self.norma(d)
+            if produto > 0 and norma > 0:
+                similaridades.append((produto / (q_norm * norma), -d))
+
+        return [self.documentos[-d] for (_, d) in heapq.nlargest(k, similaridades)]
+
+    def norma(self, doc_id):
+        '''Norma TF-IDF do documento com os idfs atuais (com cache por geração)'''
+        if self.geracao_normas != self.geracao:
+            self.normas = {}
+            self.geracao_normas = self.geracao
+        if doc_id not in self.normas:
+            N = len(self.documentos)
+            self.normas[doc_id] = math.sqrt(sum(
+                (tf * math.log(N / self.df[t])) ** 2
+                for (t, tf) in self.vetores[doc_id].items()
+            ))
+        return self.normas[doc_id]
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,149 @@
+'''
+Índice invertido posicional, para consultas por frase ("harry potter") e
+por proximidade (harry NEAR/3 potter).
+
+Para cada termo são guardadas a lista ordenada de doc ids, igual à do índice
+de busca_boolean, e as posições do termo em cada documento. As posições de
+um documento são codificadas como diferenças (gaps) em variable byte e
+concatenadas em um único buffer por termo, com o início de cada documento
+guardado à parte. Assim, as posições de um documento podem ser decodificadas
+sem decodificar as dos outros.
+
+A consulta primeiro intersecta as listas de doc ids, como um AND comum, e só
+então decodifica as posições dos documentos que sobraram (POSITIONAL
+INTERSECT, Introduction to Information Retrieval, seção 2.4.2).
+'''
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from itertools import accumulate
+
+from instrumentacao import contar
+from postings import codificar_vbyte, decodificar_vbyte
+
+
+class IndicePosicional(Mapping):
+    '''
+    Mapeia termo para a lista ordenada de doc ids, como o índice invertido
+    de busca_boolean, então serve para todas as consultas booleanas; as
+    posições são obtidas com posicoes(termo, i).
+    '''
+
+    def __init__(self):
+        self.postings = {}
+        self.dados = {}
+        self.inicios = {}
+
+    def adicionar(self, doc_id, tokens):
+        '''Indexa os tokens do documento doc_id (maior que os já indexados)'''
+        posicoes_documento = {}
+        for (posicao, token) in enumerate(tokens):
+            if token in posicoes_documento:
+                posicoes_documento[token].append(posicao)
+            else:
+                posicoes_documento[token] = [posicao]
+
+        for (termo, posicoes) in posicoes_documento.items():
+            if termo not in self.postings:
+                self.postings[termo] = []
+                self.dados[termo] = bytearray()
+                self.inicios[termo] = array('l')
+            dados = self.dados[termo]
+            self.postings[termo].append(doc_id)
+            self.inicios[termo].append(len(dados))
+            dados.extend(codificar_vbyte(
+                p - a for (p, a) in zip(posicoes, [0] + posicoes[:-1])
+            ))
+
+    def posicoes(self, termo, i):
+        '''Decodifica as posições do termo no i-ésimo documento da sua lista'''
+        inicios = self.inicios[termo]
+        dados = self.dados[termo]
+        fim = inicios[i + 1] if i + 1 < len(inicios) else len(dados)
+        # a maioria dos termos aparece uma única vez no documento: um byte
+        if fim - inicios[i] == 1:
+            return [dados[inicios[i]] & 127]
+        return list(accumulate(decodificar_vbyte(dados, inicios[i], fim)))
+
+    def __getitem__(self, termo):
+        return self.postings[termo]
+
+    def __iter__(self):
+        return iter(self.postings)
+
+    def __len__(self):
+        return len(self.postings)
+
+
+class _Cursor:
+    '''Posições de um termo em doc ids crescentes (busca binária a partir do último)'''
+
+    def __init__(self, indice, termo):
+        self.indice = indice
+        self.termo = termo
+        self.doc_ids = indice.postings[termo]
+        self.i = 0
+
+    def posicoes(self, doc_id):
+        self.i = bisect_left(self.doc_ids, doc_id, self.i)
+        return self.indice.posicoes(self.termo, self.i)
+
+
+def filtrar_frase(indice, termos, doc_ids):
+    '''
+    Retorna os documentos de doc_ids (que devem conter todos os termos) em
+    que os termos aparecem em sequência.
+    As posições são decodificadas do termo mais raro para o mais comum, e um
+    documento é descartado assim que não sobra nenhum início de frase possível.
+    '''
+    if not doc_ids:
+        return []
+    ordem = sorted(enumerate(termos), key=lambda t: len(indice.postings[t[1]]))
+    cursores = [(deslocamento, _Cursor(indice, termo)) for (deslocamento, termo) in ordem]
+    resultado = []
+    decodificadas = 0
+    for doc_id in doc_ids:
+        inicios = None
+        for (deslocamento, cursor) in cursores:
+            posicoes = cursor.posicoes(doc_id)
+            decodificadas += len(posicoes)
+            candidatos = {p - deslocamento for p in posicoes}
+            inicios = candidatos if inicios is None else inicios & candidatos
+            if not inicios:
+                break
+        if inicios:
+            resultado.append(doc_id)
+    contar('posicoes_decodificadas', decodificadas)
+    return resultado
+
+
+def filtrar_proximidade(indice, termo1, termo2, k, doc_ids):
+    '''
+    Retorna os documentos de doc_ids (que devem conter os dois termos) em
+    que os termos aparecem a no máximo k posições um do outro.
+    '''
+    if not doc_ids:
+        return []
+    (cursor1, cursor2) = (_Cursor(indice, termo1), _Cursor(indice, termo2))
+    resultado = []
+    decodificadas = 0
+    for doc_id in doc_ids:
+        (p1, p2) = (cursor1.posicoes(doc_id), cursor2.posicoes(doc_id))
+        decodificadas += len(p1) + len(p2)
+        if distancia_minima(p1, p2) <= k:
+            resultado.append(doc_id)
+    contar('posicoes_decodificadas', decodificadas)
+    return resultado
+
+
+def distancia_minima(p1, p2):
+    '''Menor distância entre uma posição de p1 e uma de p2 (listas ordenadas)'''
+    menor = float('inf')
+    (i, j) = (0, 0)
+    while i < len(p1) and j < len(p2):
+        menor = min(menor, abs(p1[i] - p2[j]))
+        if p1[i] < p2[j]:
+            i += 1
+        else:
+            j += 1
+    return menor
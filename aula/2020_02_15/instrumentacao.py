@@ -0,0 +1,248 @@
+'''
+Instrumentação da busca: tempo por etapa, contadores e profiler por amostragem.
+
+Desativada por padrão. Enquanto desativada, etapa() devolve um gerenciador
+de contexto vazio compartilhado e contar() retorna imediatamente, então o
+custo nas funções de busca é apenas o de uma chamada de função. Os laços
+internos acumulam os seus contadores em variáveis locais e chamam contar()
+uma única vez.
+
+Cada consulta executada dentro de rastrear() tem o seu Rastro, com o tempo de
+cada etapa e os contadores da consulta; ao final, o rastro é somado aos
+totais do processo, exportáveis no formato texto do Prometheus ou em JSON.
+O rastro atual é guardado em uma ContextVar, portanto consultas em threads
+diferentes não se misturam.
+'''
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import json
+import sys
+import threading
+import time
+
+
+PREFIXO = 'busca'
+
+_ativa = False
+_rastro_atual = ContextVar('rastro_atual', default=None)
+_vazio = nullcontext()
+_trava = threading.Lock()
+_etapas = {}
+_contadores = Counter()
+_n_consultas = 0
+
+
+def ativar(ativa=True):
+    '''Liga (ou desliga) a instrumentação'''
+    global _ativa
+    _ativa = ativa
+
+
+def ativa():
+    return _ativa
+
+
+def zerar():
+    '''Descarta os totais acumulados'''
+    global _n_consultas
+    with _trava:
+        _etapas.clear()
+        _contadores.clear()
+        _n_consultas = 0
+
+
+class Rastro:
+    '''
+    Tempos (em segundos) das etapas e contadores de uma consulta.
+    As etapas aparecem na ordem em que foram executadas pela primeira vez.
+    '''
+
+    def __init__(self, consulta=None):
+        self.consulta = consulta
+        self.etapas = {}
+        self.contadores = Counter()
+        self.inicio = time.perf_counter()
+        self.total = None
+
+    def como_dicionario(self):
+        return {
+            'consulta': self.consulta,
+            'total_ms': (self.total or 0) * 1000,
+            'etapas_ms': {e: s * 1000 for (e, s) in self.etapas.items()},
+            'contadores': dict(self.contadores),
+        }
+
+    def __str__(self):
+        etapas = ', '.join(f'{e} {s * 1000:.2f} ms' for (e, s) in self.etapas.items())
+        contadores = ', '.join(f'{c} {n}' for (c, n) in self.contadores.items())
+        return f'total {(self.total or 0) * 1000:.2f} ms ({etapas}) [{contadores}]'
+
+
+@contextmanager
+def _rastrear(consulta):
+    rastro = Rastro(consulta)
+    token = _rastro_atual.set(rastro)
+    try:
+        yield rastro
+    finally:
+        rastro.total = time.perf_counter() - rastro.inicio
+        _rastro_atual.reset(token)
+        _acumular(rastro.etapas, rastro.contadores, 1)
+
+
+def rastrear(consulta=None):
+    '''
+    Gerenciador de contexto que cria o Rastro de uma consulta.
+    Retorna None (no "as") se a instrumentação estiver desativada.
+    '''
+    if not _ativa:
+        return _vazio
+    return _rastrear(consulta)
+
+
+@contextmanager
+def _etapa(nome):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        rastro = _rastro_atual.get()
+        if rastro is None:
+            _acumular({nome: duracao}, (), 0)
+        else:
+            rastro.etapas[nome] = rastro.etapas.get(nome, 0.0) + duracao
+
+
+def etapa(nome):
+    '''Gerenciador de contexto que mede o tempo da etapa nome'''
+    if not _ativa:
+        return _vazio
+    return _etapa(nome)
+
+
+def contar(nome, n=1):
+    '''Soma n ao contador nome da consulta atual'''
+    if not _ativa:
+        return
+    rastro = _rastro_atual.get()
+    if rastro is None:
+        _acumular({}, {nome: n}, 0)
+    else:
+        rastro.contadores[nome] += n
+
+
+def _acumular(etapas, contadores, n_consultas):
+    global _n_consultas
+    with _trava:
+        for (nome, duracao) in etapas.items():
+            (n, total) = _etapas.get(nome, (0, 0.0))
+            _etapas[nome] = (n + 1, total + duracao)
+        _contadores.update(contadores)
+        _n_consultas += n_consultas
+
+
+def totais():
+    '''Dicionário com os totais acumulados'''
+    with _trava:
+        return {
+            'consultas': _n_consultas,
+            'etapas': {e: {'n': n, 'total_s': t} for (e, (n, t)) in _etapas.items()},
+            'contadores': dict(_contadores),
+        }
+
+
+def exportar_json():
+    '''Totais acumulados como string JSON'''
+    return json.dumps(totais(), ensure_ascii=False)
+
+
+def exportar_prometheus():
+    '''Totais acumulados no formato texto do Prometheus'''
+    with _trava:
+        linhas = [
+            f'# TYPE {PREFIXO}_consultas_total counter',
+            f'{PREFIXO}_consultas_total {_n_consultas}',
+            f'# TYPE {PREFIXO}_etapa_segundos summary',
+        ]
+        for (nome, (n, total)) in sorted(_etapas.items()):
+            linhas.append(f'{PREFIXO}_etapa_segundos_sum{{etapa="{nome}"}} {total}')
+            linhas.append(f'{PREFIXO}_etapa_segundos_count{{etapa="{nome}"}} {n}')
+        for (nome, valor) in sorted(_contadores.items()):
+            linhas.append(f'# TYPE {PREFIXO}_{nome}_total counter')
+            linhas.append(f'{PREFIXO}_{nome}_total {valor}')
+    return '\n'.join(linhas) + '\n'
+
+
+def gravar_metricas(caminho):
+    '''Grava os totais em caminho: formato Prometheus se terminar em .prom, senão JSON'''
+    with open(caminho, 'w') as f:
+        f.write(exportar_prometheus() if caminho.endswith('.prom') else exportar_json())
+
+
+class Amostrador:
+    '''
+    Profiler por amostragem: a cada intervalo segundos, registra a função
+    (arquivo:linha função) em execução na thread observada, sem instrumentar
+    o código. Com custo proporcional à frequência das amostras, pode ser
+    ligado em produção.
+    '''
+
+    def __init__(self, intervalo=0.005, thread=None):
+        self.intervalo = intervalo
+        self.id_thread = (thread or threading.current_thread()).ident
+        self.amostras = Counter()
+        self.pilhas = Counter()
+        self.n_amostras = 0
+        self.parar = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *_):
+        self.finalizar()
+
+    def iniciar(self):
+        self.parar.clear()
+        self.thread = threading.Thread(target=self._amostrar, daemon=True)
+        self.thread.start()
+
+    def finalizar(self):
+        self.parar.set()
+        if self.thread:
+            self.thread.join()
+
+    def _amostrar(self):
+        while not self.parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.id_thread)
+            if frame is None:
+                continue
+            self.n_amostras += 1
+            self.amostras[_descrever(frame)] += 1
+            # funções presentes na pilha (tempo inclusivo)
+            vistas = set()
+            while frame is not None:
+                descricao = _descrever(frame)
+                if descricao not in vistas:
+                    vistas.add(descricao)
+                    self.pilhas[descricao] += 1
+                frame = frame.f_back
+
+    def relatorio(self, n=20):
+        '''Texto com as n funções com mais amostras (próprias e inclusivas)'''
+        if not self.n_amostras:
+            return 'Nenhuma amostra coletada'
+        linhas = [f'{self.n_amostras} amostras a cada {self.intervalo * 1000:.1f} ms']
+        for (titulo, contagem) in [('próprio', self.amostras), ('inclusivo', self.pilhas)]:
+            linhas.append(f'-- tempo {titulo}')
+            for (funcao, k) in contagem.most_common(n):
+                linhas.append(f'{100 * k / self.n_amostras:6.1f}%  {funcao}')
+        return '\n'.join(linhas)
+
+
+def _descrever(frame):
+    codigo = frame.f_code
+    return f'{codigo.co_filename}:{codigo.co_firstlineno} {codigo.co_name}'
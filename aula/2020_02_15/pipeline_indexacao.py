@@ -0,0 +1,259 @@
+'''
+Item pipeline do Scrapy que indexa os livros durante o crawl.
+
+Cada item é gravado no arquivo .jl de documentos e tokenizado assim que
+chega; o tf dos seus termos fica em um segmento em memória. A cada
+tamanho_segmento documentos, o segmento é gravado em disco (um .npz com os
+termos do segmento e as triplas termo, documento, tf) e a memória é liberada,
+como na indexação por blocos (BSBI, Introduction to Information Retrieval,
+seção 4.2). No fim do crawl, os segmentos são juntados e o índice é gravado
+no mesmo formato de construir_indice.py, sem ler o arquivo .jl de novo.
+
+Em um rastreamento incremental (ver ../2020_02_01/rastreamento_incremental.py),
+só chegam os itens novos e alterados. Os documentos do arquivo .jl anterior
+que não chegaram de novo (pela url) são mantidos e indexados no fim do crawl,
+então o índice continua com o catálogo inteiro.
+
+Uso, a partir deste diretório:
+
+    PYTHONPATH=. scrapy runspider ../2020_02_01/books_spider.py \
+        -s ITEM_PIPELINES='{"pipeline_indexacao.IndexacaoPipeline": 300}' \
+        -s INDICE_DOCUMENTOS=books.jl -s INDICE_SAIDA=books.idx
+
+Configurações (-s NOME=valor):
+    INDICE_DOCUMENTOS        arquivo .jl gravado com os itens (books.jl)
+    INDICE_SAIDA             arquivo de índice (books.idx)
+    INDICE_SEGMENTOS         diretório dos segmentos (INDICE_SAIDA + '.segmentos')
+    INDICE_TAMANHO_SEGMENTO  documentos por segmento (TAMANHO_SEGMENTO)
+    INDICE_PONTUACAO         função de pontuação (tfidf; ver pontuacao.py)
+    INDICE_QUANTIZAR         grava impactos quantizados de 1 byte (False)
+    INDICE_SEM_ACENTOS       remove os acentos dos termos (False)
+    INDICE_K                 tamanho dos k-grams (3)
+'''
+from array import array
+from collections import Counter
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from busca_ordenada import construir_indice_k_grams
+from construir_indice import gravar_indice
+from pontuacao import Estatisticas, calcular_pesos
+from vocabulario import Vocabulario, obter_tokens
+
+
+TAMANHO_SEGMENTO = 1000
+
+
+class IndexadorSegmentos:
+    '''
+    Indexa documentos recebidos um a um, gravando segmentos em disco a cada
+    tamanho_segmento documentos. Não depende do Scrapy.
+    '''
+
+    def __init__(self, caminho_documentos, diretorio_segmentos,
+                 tamanho_segmento=TAMANHO_SEGMENTO, sem_acentos=False):
+        self.caminho_documentos = caminho_documentos
+        self.diretorio_segmentos = diretorio_segmentos
+        self.tamanho_segmento = tamanho_segmento
+        self.sem_acentos = sem_acentos
+        self.arquivo = open(caminho_documentos, 'wb')
+        self.posicoes = array('q')
+        self.segmentos = []
+        os.makedirs(diretorio_segmentos, exist_ok=True)
+        self._novo_segmento()
+
+    def _novo_segmento(self):
+        self.n_segmento = 0
+        self.descricoes = _Triplas()
+        self.titulos = _Triplas()
+
+    def adicionar(self, documento):
+        '''Grava o documento no .jl e indexa a sua descrição e o seu título'''
+        posicao = self.arquivo.tell()
+        self.arquivo.write(json.dumps(documento).encode('utf-8') + b'\n')
+        if not documento.get('descricao'):
+            return
+
+        doc_id = len(self.posicoes)
+        self.posicoes.append(posicao)
+        self.descricoes.adicionar(doc_id, obter_tokens(documento['descricao'], self.sem_acentos))
+        self.titulos.adicionar(doc_id, obter_tokens(documento.get('titulo') or '', self.sem_acentos))
+        self.n_segmento += 1
+        if self.n_segmento >= self.tamanho_segmento:
+            self.gravar_segmento()
+
+    def gravar_segmento(self):
+        '''Grava o segmento atual em disco, se tiver algum documento'''
+        if not self.n_segmento:
+            return
+        caminho = os.path.join(self.diretorio_segmentos, f'segmento_{len(self.segmentos):05d}.npz')
+        np.savez(caminho, **self.descricoes.como_arrays(''), **self.titulos.como_arrays('titulo_'))
+        self.segmentos.append(caminho)
+        self._novo_segmento()
+
+    def finalizar(self, caminho_indice, pontuacao='tfidf', quantizar=False, k=3):
+        '''
+        Grava o último segmento, junta todos e grava o índice em caminho_indice.
+        Os segmentos são apagados depois que o índice é gravado.
+        Retorna (quantidade de documentos, quantidade de termos).
+        '''
+        self.gravar_segmento()
+        self.arquivo.close()
+        if not self.posicoes:
+            return (0, 0)
+
+        segmentos = []
+        for caminho in self.segmentos:
+            with np.load(caminho) as segmento:
+                segmentos.append(dict(segmento))
+        # os termos de cada segmento estão na ordem da primeira ocorrência,
+        # então os ids do vocabulário são os mesmos de construir_indice_invertido
+        vocabulario = Vocabulario()
+        TF = _juntar(segmentos, '', vocabulario, len(self.posicoes))
+        TF_titulo = None
+        if pontuacao == 'bm25f':
+            # termos que só aparecem em títulos ficam de fora, como em construir_matriz_titulos
+            TF_titulo = _juntar(segmentos, 'titulo_', vocabulario, len(self.posicoes), criar=False)
+        (M, cosseno) = calcular_pesos(Estatisticas(TF, TF_titulo), pontuacao)
+
+        n_termos = gravar_indice(
+            caminho_indice, M, TF, vocabulario, cosseno, construir_indice_k_grams(vocabulario, k=k),
+            self.posicoes, os.path.getsize(self.caminho_documentos), k=k, pontuacao=pontuacao,
+            quantizar=quantizar, sem_acentos=self.sem_acentos
+        )
+        for caminho in self.segmentos:
+            os.remove(caminho)
+        if not os.listdir(self.diretorio_segmentos):
+            os.rmdir(self.diretorio_segmentos)
+        return (len(self.posicoes), n_termos)
+
+
+class _Triplas:
+    '''Triplas (termo, documento, tf) de um campo de um segmento'''
+
+    def __init__(self):
+        self.vocabulario = Vocabulario()
+        self.termos = array('i')
+        self.doc_ids = array('i')
+        self.tfs = array('i')
+
+    def adicionar(self, doc_id, tokens):
+        for (termo, tf) in Counter(self.vocabulario.ids(tokens)).items():
+            self.termos.append(termo)
+            self.doc_ids.append(doc_id)
+            self.tfs.append(tf)
+
+    def como_arrays(self, prefixo):
+        return {
+            prefixo + 'vocabulario': np.array(self.vocabulario.termos, dtype=str),
+            prefixo + 'termos': np.frombuffer(self.termos, dtype=np.intc),
+            prefixo + 'doc_ids': np.frombuffer(self.doc_ids, dtype=np.intc),
+            prefixo + 'tfs': np.frombuffer(self.tfs, dtype=np.intc),
+        }
+
+
+def _juntar(segmentos, prefixo, vocabulario, n_documentos, criar=True):
+    '''
+    Matriz de tf (CSR) de todos os segmentos, com os termos de cada segmento
+    convertidos para os ids do vocabulário. Se criar, os termos novos são
+    adicionados ao vocabulário; senão, são descartados.
+    '''
+    id_termo = vocabulario.adicionar if criar else (lambda t: vocabulario.get(t, -1))
+    (linhas, colunas, dados) = ([], [], [])
+    for segmento in segmentos:
+        ids = np.array(
+            [id_termo(t) for t in segmento[prefixo + 'vocabulario'].tolist()], dtype=np.int64
+        )
+        termos = ids[segmento[prefixo + 'termos']]
+        manter = termos >= 0
+        linhas.append(termos[manter])
+        colunas.append(segmento[prefixo + 'doc_ids'][manter])
+        dados.append(segmento[prefixo + 'tfs'][manter])
+    TF = sparse.coo_matrix(
+        (np.concatenate(dados).astype(np.float64), (np.concatenate(linhas), np.concatenate(colunas))),
+        shape=(len(vocabulario), n_documentos)
+    ).tocsr()
+    TF.sum_duplicates()
+    return TF
+
+
+def _ler_documentos(caminho):
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        return [json.loads(linha) for linha in arquivo if linha.strip()]
+
+
+class IndexacaoPipeline:
+    '''Item pipeline que indexa os itens com o IndexadorSegmentos'''
+
+    def __init__(self, caminho_documentos, caminho_indice, diretorio_segmentos=None,
+                 tamanho_segmento=TAMANHO_SEGMENTO, pontuacao='tfidf', quantizar=False,
+                 sem_acentos=False, k=3):
+        self.caminho_documentos = caminho_documentos
+        self.caminho_indice = caminho_indice
+        self.diretorio_segmentos = diretorio_segmentos or caminho_indice + '.segmentos'
+        self.tamanho_segmento = tamanho_segmento
+        self.pontuacao = pontuacao
+        self.quantizar = quantizar
+        self.sem_acentos = sem_acentos
+        self.k = k
+        self.indexador = None
+        # url -> documento do arquivo anterior (apenas no rastreamento incremental)
+        self.anteriores = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        configuracoes = crawler.settings
+        return cls(
+            configuracoes.get('INDICE_DOCUMENTOS', 'books.jl'),
+            configuracoes.get('INDICE_SAIDA', 'books.idx'),
+            configuracoes.get('INDICE_SEGMENTOS'),
+            configuracoes.getint('INDICE_TAMANHO_SEGMENTO', TAMANHO_SEGMENTO),
+            configuracoes.get('INDICE_PONTUACAO', 'tfidf'),
+            configuracoes.getbool('INDICE_QUANTIZAR', False),
+            configuracoes.getbool('INDICE_SEM_ACENTOS', False),
+            configuracoes.getint('INDICE_K', 3),
+        )
+
+    def open_spider(self, spider):
+        # o arquivo de documentos é reescrito: no rastreamento incremental,
+        # os documentos anteriores são lidos antes
+        incremental = getattr(spider, 'rastreamento', None) is not None
+        if incremental and os.path.exists(self.caminho_documentos):
+            self.anteriores = {
+                documento['url']: documento
+                for documento in _ler_documentos(self.caminho_documentos)
+            }
+        self.indexador = IndexadorSegmentos(
+            self.caminho_documentos, self.diretorio_segmentos, self.tamanho_segmento,
+            self.sem_acentos
+        )
+
+    def process_item(self, item, spider):
+        documento = dict(item)
+        documento.pop('alteracao', None)
+        self.anteriores.pop(documento.get('url'), None)
+        self.indexador.adicionar(documento)
+        return item
+
+    def close_spider(self, spider):
+        if self.anteriores:
+            spider.logger.info(
+                f'{len(self.anteriores)} documentos inalterados mantidos de {self.caminho_documentos}'
+            )
+        for documento in self.anteriores.values():
+            self.indexador.adicionar(documento)
+        (n_documentos, n_termos) = self.indexador.finalizar(
+            self.caminho_indice, self.pontuacao, self.quantizar, self.k
+        )
+        if not n_documentos:
+            spider.logger.warning(
+                f'Nenhum documento com descrição: o índice {self.caminho_indice} não foi gravado'
+            )
+            return
+        spider.logger.info(
+            f'{n_documentos} documentos e {n_termos} termos indexados em {self.caminho_indice} '
+            f'({len(self.indexador.segmentos)} segmentos)'
+        )
@@ -0,0 +1,165 @@
+'''
+Funções de pontuação da busca ordenada.
+
+As estatísticas da coleção (tf de cada termo em cada campo, df, tamanho de
+cada documento e tamanho médio) são calculadas uma única vez, na indexação.
+Cada função de pontuação transforma essas estatísticas em uma matriz de
+pesos W (termos x documentos), em que a pontuação de um documento é a soma
+das linhas de W dos termos da consulta. Assim, a função escolhida não muda
+nada no momento da consulta: consultar, consultar_wand e consultar_lote
+percorrem W do mesmo jeito.
+
+Funções disponíveis:
+    tfidf   tf * log(N / df), similaridade de cosenos (padrão)
+    logtf   (1 + log tf) * log(N / df), similaridade de cosenos
+    bm25    Okapi BM25 (Robertson et al.), soma dos pesos
+    bm25f   BM25F (Robertson, Zaragoza e Taylor, 2004) sobre titulo e
+            descricao, soma dos pesos
+
+As funções de cosenos retornam cosseno=True: os documentos são normalizados
+pelas suas normas (calcular_normas). As do BM25 já incluem a normalização
+pelo tamanho do documento e as pontuações são somadas sem outra normalização.
+
+Os pesos podem ser quantizados em impactos inteiros (quantizar), que ocupam
+1 byte por posting no índice em disco.
+'''
+import numpy as np
+from scipy import sparse
+
+
+PONTUACOES = ('tfidf', 'logtf', 'bm25', 'bm25f')
+
+K1 = 1.2
+B = 0.75
+PESOS_CAMPOS = {'titulo': 2.0, 'descricao': 1.0}
+
+
+class Estatisticas:
+    '''
+    Estatísticas da coleção usadas pelas funções de pontuação.
+    TF: matriz esparsa (CSR) com o tf de cada termo (linha) na descrição de
+        cada documento (coluna)
+    TF_titulo: idem para o título (opcional, usada apenas pelo bm25f)
+    df: quantidade de documentos (descrições) de cada termo
+    comprimentos, comprimento_medio: quantidade de tokens de cada descrição e a média
+    '''
+
+    def __init__(self, TF, TF_titulo=None):
+        self.TF = sparse.csr_matrix(TF)
+        self.N = self.TF.shape[1]
+        self.df = np.diff(self.TF.indptr)
+        self.comprimentos = np.asarray(self.TF.sum(axis=0)).ravel()
+        self.comprimento_medio = self.comprimentos.mean() if self.N else 0.0
+        self.TF_titulo = None
+        if TF_titulo is not None:
+            self.TF_titulo = sparse.csr_matrix(TF_titulo)
+            self.comprimentos_titulo = np.asarray(self.TF_titulo.sum(axis=0)).ravel()
+            self.comprimento_medio_titulo = self.comprimentos_titulo.mean() if self.N else 0.0
+
+
+def construir_matriz_titulos(documentos, ids_termos, obter_tokens):
+    '''
+    Retorna a matriz esparsa de tf dos títulos, com as mesmas linhas (termos
+    do vocabulário das descrições) e colunas (documentos) da matriz TF.
+    Termos que só aparecem nos títulos são ignorados.
+    '''
+    (linhas, colunas) = ([], [])
+    n = 0
+    for (doc_id, documento) in enumerate(documentos):
+        for token in obter_tokens(documento.get('titulo') or ''):
+            i = ids_termos.get(token)
+            if i is not None:
+                linhas.append(i)
+                colunas.append(doc_id)
+        n += 1
+    T = sparse.coo_matrix(
+        (np.ones(len(linhas)), (linhas, colunas)), shape=(len(ids_termos), n)
+    ).tocsr()
+    T.sum_duplicates()
+    return T
+
+
+def calcular_pesos(estatisticas, pontuacao='tfidf', k1=K1, b=B, pesos_campos=PESOS_CAMPOS):
+    '''
+    Retorna (W, cosseno): a matriz de pesos da função de pontuação e se a
+    similaridade é a de cosenos (W deve ser normalizada pelas normas dos
+    documentos) ou a soma simples dos pesos.
+    '''
+    e = estatisticas
+    if pontuacao == 'tfidf':
+        W = _com_dados(e.TF, e.TF.data * _por_linha(e.TF, _idf(e)))
+        return (W, True)
+
+    if pontuacao == 'logtf':
+        W = _com_dados(e.TF, (1 + np.log(e.TF.data)) * _por_linha(e.TF, _idf(e)))
+        return (W, True)
+
+    if pontuacao == 'bm25':
+        normalizacao = _normalizacao_comprimento(e.comprimentos, e.comprimento_medio, b)
+        tf = e.TF.data
+        W = _com_dados(e.TF, (
+            _por_linha(e.TF, _idf_bm25(e.df, e.N)) * tf * (k1 + 1)
+            / (tf + k1 * normalizacao[e.TF.indices])
+        ))
+        return (W, False)
+
+    if pontuacao == 'bm25f':
+        if e.TF_titulo is None:
+            raise ValueError('bm25f precisa da matriz de tf dos títulos')
+        # tf combinado: soma dos tf de cada campo, normalizados pelo tamanho
+        # do campo e multiplicados pelo peso do campo
+        descricao = e.TF.multiply(
+            pesos_campos['descricao']
+            / _normalizacao_comprimento(e.comprimentos, e.comprimento_medio, b)
+        )
+        titulo = e.TF_titulo.multiply(
+            pesos_campos['titulo']
+            / _normalizacao_comprimento(e.comprimentos_titulo, e.comprimento_medio_titulo, b)
+        )
+        tf = sparse.csr_matrix(descricao + titulo)
+        tf.sort_indices()
+        df = np.diff(tf.indptr)
+        W = _com_dados(tf, _por_linha(tf, _idf_bm25(df, e.N)) * tf.data * (k1 + 1) / (tf.data + k1))
+        return (W, False)
+
+    raise ValueError(f'Função de pontuação desconhecida: {pontuacao}')
+
+
+def quantizar(W, bits=8):
+    '''
+    Quantiza os pesos de W em inteiros de até 2^bits - 1 (impactos); pesos
+    positivos viram impactos de pelo menos 1, para não sumirem da busca.
+    Retorna (W quantizada, escala), com W ~ W quantizada * escala.
+    Como a escala é a mesma para todos os pesos, a ordem dos documentos
+    só muda entre documentos de pontuações muito próximas.
+    '''
+    maximo = W.data.max() if W.nnz else 1.0
+    niveis = (1 << bits) - 1
+    escala = maximo / niveis
+    tipo = np.uint8 if bits <= 8 else np.uint16
+    impactos = np.clip(np.rint(W.data / escala), W.data > 0, niveis).astype(tipo)
+    return (_com_dados(W, impactos), float(escala))
+
+
+def _idf(e):
+    return np.log(e.N / e.df)
+
+
+def _idf_bm25(df, N):
+    return np.log(1 + (N - df + 0.5) / (df + 0.5))
+
+
+def _normalizacao_comprimento(comprimentos, comprimento_medio, b):
+    if not comprimento_medio:
+        return np.ones(len(comprimentos))
+    return (1 - b) + b * comprimentos / comprimento_medio
+
+
+def _por_linha(M, valores):
+    '''Repete o valor de cada linha para cada valor não nulo da linha (CSR)'''
+    return np.repeat(valores, np.diff(M.indptr))
+
+
+def _com_dados(M, dados):
+    '''Matriz CSR com a mesma estrutura de M e os valores dados'''
+    return sparse.csr_matrix((dados, M.indices.copy(), M.indptr.copy()), shape=M.shape)
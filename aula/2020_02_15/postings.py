@@ -0,0 +1,199 @@
+'''
+Listas de postings comprimidas.
+
+Os doc ids são guardados como diferenças (gaps) entre doc ids consecutivos,
+codificadas em variable byte (Introduction to Information Retrieval, seção 5.3),
+e divididos em blocos de TAMANHO_BLOCO doc ids. Para cada bloco são guardados
+o último doc id e a posição no buffer, que funcionam como ponteiros de salto:
+um bloco só é decodificado se puder conter o doc id procurado.
+
+As listas de um índice inteiro ficam em um único buffer, com arrays de
+posições (comprimir_listas, ListasComprimidas), no mesmo formato das seções
+do índice em disco: um termo custa algumas posições nesses arrays, e não
+um objeto bytes e dois arrays próprios, que em listas curtas custariam mais
+que a economia dos gaps.
+'''
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+
+TAMANHO_BLOCO = 128
+
+
+def codificar_vbyte(numeros):
+    '''
+    Codifica inteiros não negativos em variable byte.
+    Cada byte carrega 7 bits do número; o bit mais alto marca o último byte.
+    '''
+    buffer = bytearray()
+    for n in numeros:
+        bytes_ = [n & 127]
+        n >>= 7
+        while n:
+            bytes_.append(n & 127)
+            n >>= 7
+        bytes_[0] |= 128
+        buffer.extend(reversed(bytes_))
+    return buffer
+
+
+def decodificar_vbyte(buffer, inicio=0, fim=None):
+    '''Decodifica, em fluxo, os inteiros de buffer[inicio:fim]'''
+    n = 0
+    for byte in memoryview(buffer)[inicio:fim]:
+        if byte < 128:
+            n = (n << 7) | byte
+        else:
+            yield (n << 7) | (byte & 127)
+            n = 0
+
+
+def comprimir_postings(doc_ids, tamanho_bloco=TAMANHO_BLOCO):
+    '''Comprime uma lista ordenada de doc ids (sem repetições)'''
+    (dados, _, _, ultimos, posicoes, _) = comprimir_listas([doc_ids], tamanho_bloco)
+    return PostingsComprimida(bytes(dados), ultimos, posicoes, len(doc_ids))
+
+
+def comprimir_listas(listas, tamanho_bloco=TAMANHO_BLOCO):
+    '''
+    Comprime várias listas ordenadas de doc ids em um único buffer, sem um
+    objeto por lista. Retorna (dados, postings_pos, blocos_pos, ultimos,
+    posicoes, df): as postings da lista i são dados[postings_pos[i]:
+    postings_pos[i + 1]], os seus blocos são blocos_pos[i]:blocos_pos[i + 1]
+    de ultimos e posicoes (posições relativas ao início das postings da
+    lista) e df[i] é o tamanho da lista.
+    '''
+    dados = bytearray()
+    postings_pos = array('q', [0])
+    blocos_pos = array('q', [0])
+    ultimos = array('i')
+    posicoes = array('i')
+    df = array('i')
+    for doc_ids in listas:
+        inicio = len(dados)
+        anterior = 0
+        for i in range(0, len(doc_ids), tamanho_bloco):
+            bloco = list(doc_ids[i:i + tamanho_bloco])
+            posicoes.append(len(dados) - inicio)
+            dados.extend(codificar_vbyte(
+                d - a for (d, a) in zip(bloco, [anterior] + bloco[:-1])
+            ))
+            anterior = bloco[-1]
+            ultimos.append(anterior)
+        postings_pos.append(len(dados))
+        blocos_pos.append(len(ultimos))
+        df.append(len(doc_ids))
+    return (dados, postings_pos, blocos_pos, ultimos, posicoes, df)
+
+
+def comprimir_indice(indice_invertido):
+    '''Retorna uma cópia do índice invertido com as postings comprimidas'''
+    termos = list(indice_invertido)
+    return ListasComprimidas(
+        {t: i for (i, t) in enumerate(termos)},
+        *comprimir_listas(indice_invertido[t] for t in termos)
+    )
+
+
+class ListasComprimidas(Mapping):
+    '''
+    Dicionário de termo para PostingsComprimida, com as listas de todos os
+    termos em um único buffer (ver comprimir_listas). As PostingsComprimida
+    são criadas a cada acesso, como visões do buffer, sem cópia.
+    '''
+
+    def __init__(self, ids_termos, dados, postings_pos, blocos_pos, ultimos, posicoes, df):
+        self.ids_termos = ids_termos
+        self.dados = memoryview(dados)
+        self.postings_pos = postings_pos
+        self.blocos_pos = blocos_pos
+        self.ultimos = memoryview(ultimos)
+        self.posicoes = memoryview(posicoes)
+        self.df = df
+
+    def __getitem__(self, termo):
+        i = self.ids_termos[termo]
+        (b0, b1) = (self.blocos_pos[i], self.blocos_pos[i + 1])
+        return PostingsComprimida(
+            self.dados[self.postings_pos[i]:self.postings_pos[i + 1]],
+            self.ultimos[b0:b1],
+            self.posicoes[b0:b1],
+            int(self.df[i])
+        )
+
+    def __contains__(self, termo):
+        return termo in self.ids_termos
+
+    def __iter__(self):
+        return iter(self.ids_termos)
+
+    def __len__(self):
+        return len(self.ids_termos)
+
+
+class PostingsComprimida:
+    '''
+    Lista de postings comprimida (ver comprimir_postings).
+    Pode ser percorrida como uma lista comum; para saltos, use cursor().
+    '''
+
+    __slots__ = ('buffer', 'ultimos', 'posicoes', 'tamanho')
+
+    def __init__(self, buffer, ultimos, posicoes, tamanho):
+        self.buffer = buffer
+        self.ultimos = ultimos
+        self.posicoes = posicoes
+        self.tamanho = tamanho
+
+    def __len__(self):
+        return self.tamanho
+
+    def __iter__(self):
+        for b in range(len(self.ultimos)):
+            yield from self.decodificar_bloco(b)
+
+    def __repr__(self):
+        return f'PostingsComprimida({len(self)} doc ids, {len(self.buffer)} bytes)'
+
+    def decodificar_bloco(self, b):
+        '''Retorna a lista de doc ids do bloco b'''
+        fim = self.posicoes[b + 1] if b + 1 < len(self.posicoes) else len(self.buffer)
+        doc_id = int(self.ultimos[b - 1]) if b > 0 else 0
+        bloco = []
+        for gap in decodificar_vbyte(self.buffer, self.posicoes[b], fim):
+            doc_id += gap
+            bloco.append(doc_id)
+        return bloco
+
+    def cursor(self):
+        return CursorPostings(self)
+
+
+class CursorPostings:
+    '''
+    Percorre uma PostingsComprimida em ordem crescente, decodificando apenas
+    os blocos em que os doc ids procurados podem estar.
+    '''
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.b = -1
+        self.bloco = []
+        self.i = 0
+
+    def avancar(self, alvo):
+        '''
+        Avança até o primeiro doc id >= alvo e o retorna.
+        Retorna None se a lista terminou.
+        '''
+        ultimos = self.postings.ultimos
+        if self.b < 0 or self.bloco[-1] < alvo:
+            b = bisect_left(ultimos, alvo, max(self.b, 0))
+            if b == len(ultimos):
+                return None
+            self.b = b
+            self.bloco = self.postings.decodificar_bloco(b)
+            self.i = 0
+        self.i = bisect_left(self.bloco, alvo, self.i)
+        return self.bloco[self.i]
@@ -0,0 +1,380 @@
+'''
+Servidor HTTP de busca (JSON), para muitos usuários simultâneos.
+
+O índice gravado por construir_indice.py é aberto uma única vez. As
+conexões são atendidas por um laço asyncio e o trabalho de CPU de cada
+consulta (correção ortográfica e ranqueamento) é executado em um pool de
+threads ou de processos. Como o índice é um arquivo mapeado em memória
+(mmap, somente leitura), os processos do pool compartilham as mesmas
+páginas do índice em vez de cada um ter a sua cópia.
+
+Rotas:
+    GET  /busca?q=<consulta>&modo=<boolean|ordenado>&k=<n>
+    POST /busca  com o corpo {"q": ..., "modo": ..., "k": ...}
+    GET  /saude
+    GET  /metricas?formato=<json|prometheus>  (com --instrumentar)
+'''
+from argparse import ArgumentParser
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+import json
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import busca_boolean
+import busca_ordenada
+from cache_consultas import CAPACIDADE, CacheConsultas
+from curingas import expandir_curingas, tem_curinga
+from expressao_booleana import analisar, formatar, mapear_termos, obter_termos
+from indice_disco import carregar_indice
+import instrumentacao
+from instrumentacao import etapa, rastrear
+
+
+K_MAXIMO = 100
+TAMANHO_MAXIMO_CORPO = 1 << 16
+
+MENSAGENS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+def parse_args():
+    ap = ArgumentParser()
+
+    ap.add_argument(
+        '--documentos',
+        type=str,
+        required=True,
+        help='Caminho para o arquivo .jl com os documentos indexados'
+    )
+
+    ap.add_argument(
+        '--indice',
+        type=str,
+        required=True,
+        help='Arquivo de índice gravado por construir_indice.py'
+    )
+
+    ap.add_argument(
+        '--endereco',
+        type=str,
+        required=False,
+        default='127.0.0.1',
+        help='Endereço em que o servidor escuta (127.0.0.1 padrão).'
+    )
+
+    ap.add_argument(
+        '--porta',
+        type=int,
+        required=False,
+        default=8080,
+        help='Porta em que o servidor escuta (8080 padrão).'
+    )
+
+    ap.add_argument(
+        '--trabalhadores',
+        type=int,
+        required=False,
+        default=os.cpu_count(),
+        help='Quantidade de threads ou processos que executam as consultas (um por CPU padrão).'
+    )
+
+    ap.add_argument(
+        '--pool',
+        type=str,
+        required=False,
+        default='threads',
+        choices=['threads', 'processos'],
+        help='Tipo do pool que executa as consultas (threads padrão).'
+    )
+
+    ap.add_argument(
+        '--cache',
+        type=int,
+        required=False,
+        default=CAPACIDADE,
+        help=f'Quantidade de consultas guardadas no cache ({CAPACIDADE} padrão); 0 desativa.'
+    )
+
+    ap.add_argument(
+        '--motor',
+        type=str,
+        required=False,
+        default='exaustivo',
+        choices=['exaustivo', 'wand'],
+        help='Algoritmo de ranqueamento do modo ordenado: exaustivo (padrão) ou wand.'
+    )
+
+    ap.add_argument(
+        '--instrumentar',
+        action='store_true',
+        help='Inclui o rastro de cada consulta na resposta e habilita /metricas (apenas com threads).'
+    )
+
+    return ap.parse_args()
+
+
+def main(args):
+    instrumentacao.ativar(args.instrumentar)
+    if args.pool == 'processos':
+        executor = ProcessPoolExecutor(
+            args.trabalhadores,
+            initializer=_iniciar_processo,
+            initargs=(args.indice, args.documentos, args.cache, args.motor, args.instrumentar)
+        )
+        buscar = _buscar_no_processo
+    else:
+        motor = MotorBusca(args.indice, args.documentos, args.cache, args.motor)
+        executor = ThreadPoolExecutor(args.trabalhadores)
+        buscar = motor.buscar
+
+    print(f'> Servindo em http://{args.endereco}:{args.porta}/busca ({args.trabalhadores} {args.pool})')
+    try:
+        asyncio.run(servir(args.endereco, args.porta, executor, buscar))
+    except KeyboardInterrupt:
+        print('Saindo...')
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+class MotorBusca:
+    '''
+    Executa consultas boolean e ordenadas sobre o índice em disco.
+    Pode ser usado por várias threads ao mesmo tempo: o índice é somente
+    leitura e o cache tem a sua própria trava.
+    '''
+
+    def __init__(self, caminho_indice, caminho_documentos, capacidade_cache=CAPACIDADE,
+                 motor='exaustivo'):
+        self.indice = carregar_indice(caminho_indice)
+        self.documentos = self.indice.abrir_documentos(caminho_documentos)
+        self.cache = CacheConsultas(capacidade_cache)
+        self.motor = motor
+
+    def buscar(self, consulta, modo='ordenado', k=10):
+        '''
+        Retorna um dicionário com a consulta efetivamente executada (após a
+        correção ortográfica) e os k primeiros documentos encontrados.
+        Levanta ValueError se a consulta ou o modo forem inválidos.
+        Com a instrumentação ativa, inclui o rastro da consulta.
+        '''
+        if modo not in ('boolean', 'ordenado'):
+            raise ValueError(f'Modo desconhecido: {modo}')
+        with rastrear(consulta) as rastro:
+            if modo == 'boolean':
+                resposta = self.buscar_boolean(consulta, k)
+            else:
+                resposta = self.buscar_ordenado(consulta, k)
+        if rastro:
+            resposta['rastro'] = rastro.como_dicionario()
+        return resposta
+
+    def buscar_boolean(self, consulta, k):
+        indice = self.indice
+        with etapa('tokens'):
+            arvore = analisar(consulta)
+            arvore = mapear_termos(
+                arvore, lambda t: busca_boolean.normalizar_tokens([t], indice.sem_acentos)[0]
+            )
+        with etapa('curingas'):
+            arvore = self.cache.obter(
+                ('curingas', formatar(arvore)),
+                lambda: expandir_curingas(arvore, indice.postings, indice.k_grams, k=indice.k)
+            )
+            termos = [t for t in obter_termos(arvore) if not tem_curinga(t)]
+        with etapa('correcao'):
+            termos_ = busca_boolean.aplicar_correcao_ortografica(
+                termos, indice.postings, indice.k_grams, self.corretor('boolean')
+            )
+        correcoes = dict(zip(termos, termos_))
+        arvore = mapear_termos(arvore, lambda t: correcoes.get(t, t))
+        consulta_ = formatar(arvore)
+        with etapa('intersecao'):
+            resultados = self.cache.obter(
+                ('resultados', 'boolean', consulta_, k),
+                lambda: list(islice(
+                    busca_boolean.consultar_expressao(arvore, indice.postings, self.documentos), k
+                ))
+            )
+        return {'consulta': consulta_, 'resultados': resultados}
+
+    def buscar_ordenado(self, consulta, k):
+        indice = self.indice
+        with etapa('tokens'):
+            termos = busca_ordenada.normalizar_tokens(consulta.split(), indice.sem_acentos)
+        with etapa('correcao'):
+            termos = busca_ordenada.aplicar_correcao_ortografica(
+                termos, indice.termos, indice.k_grams, self.corretor('ordenado')
+            )
+        if self.motor == 'wand':
+            calcular = lambda: list(busca_ordenada.consultar_wand(
+                termos, indice.M, indice.termos, indice.normas, indice.blocos,
+                self.documentos, k=k
+            ))
+        else:
+            calcular = lambda: list(busca_ordenada.consultar(
+                termos, indice.M, indice.termos, indice.normas, self.documentos, k=k
+            ))
+        with etapa('ranqueamento'):
+            resultados = self.cache.obter(
+                ('resultados', 'ordenado', tuple(sorted(termos)), k), calcular
+            )
+        return {'consulta': ' '.join(termos), 'resultados': resultados}
+
+    def corretor(self, modo):
+        '''Correção ortográfica do modo, com cache por termo'''
+        if modo == 'boolean':
+            corrigir = partial(busca_boolean.obter_termo_corrigido, k=self.indice.k)
+        else:
+            corrigir = busca_ordenada.obter_termo_corrigido
+        return lambda termo: self.cache.obter(
+            ('correcao', modo, termo), lambda: corrigir(termo, self.indice.k_grams)
+        )
+
+
+# no pool de processos, cada processo abre o índice uma vez (mmap compartilhado)
+_motor = None
+
+
+def _iniciar_processo(caminho_indice, caminho_documentos, capacidade_cache, motor='exaustivo',
+                      instrumentar=False):
+    global _motor
+    instrumentacao.ativar(instrumentar)
+    _motor = MotorBusca(caminho_indice, caminho_documentos, capacidade_cache, motor)
+
+
+def _buscar_no_processo(consulta, modo, k):
+    return _motor.buscar(consulta, modo, k)
+
+
+async def servir(endereco, porta, executor, buscar):
+    '''Atende as conexões até o processo ser interrompido'''
+    servidor = await asyncio.start_server(
+        partial(atender_conexao, executor=executor, buscar=buscar),
+        endereco, porta, backlog=1024
+    )
+    async with servidor:
+        await servidor.serve_forever()
+
+
+async def atender_conexao(leitor, escritor, executor, buscar):
+    '''Atende as requisições HTTP/1.1 (keep-alive) de uma conexão'''
+    try:
+        while True:
+            requisicao = await ler_requisicao(leitor)
+            if requisicao is None:
+                break
+            (metodo, alvo, cabecalhos, corpo) = requisicao
+            (status, resposta) = await responder(metodo, alvo, corpo, executor, buscar)
+            manter = cabecalhos.get('connection', '').lower() != 'close'
+            escrever_resposta(escritor, status, resposta, manter)
+            await escritor.drain()
+            if not manter:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except ValueError as e:
+        escrever_resposta(escritor, 400, {'erro': str(e)}, False)
+    finally:
+        escritor.close()
+
+
+async def ler_requisicao(leitor):
+    '''
+    Lê uma requisição HTTP.
+    Saída: (método, alvo, cabeçalhos, corpo) ou None se a conexão foi fechada
+    '''
+    linha = await leitor.readline()
+    if not linha.strip():
+        return None
+    partes = linha.decode('latin-1').split()
+    if len(partes) != 3:
+        raise ValueError('Requisição HTTP inválida')
+    (metodo, alvo, _) = partes
+
+    cabecalhos = {}
+    while True:
+        linha = await leitor.readline()
+        if linha in (b'\r\n', b'\n', b''):
+            break
+        (nome, _, valor) = linha.decode('latin-1').partition(':')
+        cabecalhos[nome.strip().lower()] = valor.strip()
+
+    tamanho = int(cabecalhos.get('content-length', 0))
+    if tamanho > TAMANHO_MAXIMO_CORPO:
+        raise ValueError('Corpo da requisição muito grande')
+    corpo = await leitor.readexactly(tamanho) if tamanho else b''
+    return (metodo, alvo, cabecalhos, corpo)
+
+
+async def responder(metodo, alvo, corpo, executor, buscar):
+    '''Retorna (status, objeto JSON da resposta) da requisição'''
+    url = urlsplit(alvo)
+    if url.path == '/saude':
+        return (200, {'status': 'ok'})
+    if url.path == '/metricas' and instrumentacao.ativa():
+        # no pool de processos, os totais ficam em cada processo trabalhador
+        if parse_qs(url.query).get('formato') == ['prometheus']:
+            return (200, instrumentacao.exportar_prometheus())
+        return (200, instrumentacao.totais())
+    if url.path != '/busca':
+        return (404, {'erro': f'Rota desconhecida: {url.path}'})
+
+    if metodo == 'GET':
+        parametros = {c: v[0] for (c, v) in parse_qs(url.query).items()}
+    elif metodo == 'POST':
+        try:
+            parametros = json.loads(corpo or b'{}')
+        except json.JSONDecodeError:
+            return (400, {'erro': 'Corpo JSON inválido'})
+        if not isinstance(parametros, dict):
+            return (400, {'erro': 'O corpo JSON deve ser um objeto'})
+    else:
+        return (405, {'erro': f'Método não suportado: {metodo}'})
+
+    consulta = str(parametros.get('q', '')).strip()
+    modo = parametros.get('modo', 'ordenado')
+    try:
+        k = min(int(parametros.get('k', 10)), K_MAXIMO)
+    except (TypeError, ValueError):
+        return (400, {'erro': 'k deve ser um número inteiro'})
+    if not consulta:
+        return (400, {'erro': 'Consulta vazia'})
+    if k < 1:
+        return (400, {'erro': 'k deve ser positivo'})
+
+    loop = asyncio.get_running_loop()
+    try:
+        resultado = await loop.run_in_executor(executor, buscar, consulta, modo, k)
+    except ValueError as e:
+        return (400, {'erro': str(e)})
+    except Exception as e:
+        return (500, {'erro': repr(e)})
+    return (200, resultado)
+
+
+def escrever_resposta(escritor, status, resposta, manter):
+    '''Escreve a resposta: texto puro se for uma string, senão JSON'''
+    if isinstance(resposta, str):
+        (corpo, tipo) = (resposta.encode('utf-8'), 'text/plain; version=0.0.4')
+    else:
+        (corpo, tipo) = (json.dumps(resposta, ensure_ascii=False).encode('utf-8'), 'application/json')
+    cabecalho = (
+        f'HTTP/1.1 {status} {MENSAGENS[status]}\r\n'
+        f'Content-Type: {tipo}; charset=utf-8\r\n'
+        f'Content-Length: {len(corpo)}\r\n'
+        f'Connection: {"keep-alive" if manter else "close"}\r\n'
+        '\r\n'
+    )
+    escritor.write(cabecalho.encode('latin-1') + corpo)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,118 @@
+'''
+Tokenização e vocabulário com ids inteiros.
+
+obter_tokens quebra o texto em uma única passada: o texto inteiro é posto em
+lower case (e, opcionalmente, tem os acentos removidos) e uma expressão
+regular pré-compilada devolve os tokens já normalizados, sem uma segunda
+lista de tokens normalizados.
+
+O Vocabulario dá a cada termo um id inteiro sequencial (na ordem em que o
+termo aparece pela primeira vez) e guarda uma única cópia de cada termo
+(sys.intern). O IndiceInvertido guarda as postings em uma lista indexada
+por esse id, cada uma um array de inteiros de 4 bytes em vez de uma lista
+de objetos int; a linha de cada termo na matriz de pesos é o próprio id.
+'''
+from array import array
+from collections.abc import Mapping
+import re
+import sys
+import unicodedata
+
+
+TOKEN = re.compile(r'\w+')
+
+# marcas diacríticas combinantes, que sobram da decomposição NFD de letras
+# acentuadas (á -> a + ´, ç -> c + ¸)
+_SEM_DIACRITICOS = dict.fromkeys(range(0x300, 0x370))
+
+
+def dobrar_acentos(texto):
+    '''Remove os acentos do texto: "ação" -> "acao"'''
+    return unicodedata.normalize('NFD', texto).translate(_SEM_DIACRITICOS)
+
+
+def obter_tokens(texto, sem_acentos=False):
+    '''Quebra um texto em tokens normalizados em lower case (e sem acentos)'''
+    texto = texto.lower()
+    if sem_acentos:
+        texto = dobrar_acentos(texto)
+    return TOKEN.findall(texto)
+
+
+def normalizar_tokens(tokens, sem_acentos=False):
+    '''Coloca os tokens em lower case (e sem acentos) e remove espaços no começo/final'''
+    if sem_acentos:
+        return [dobrar_acentos(t.strip().lower()) for t in tokens]
+    return [t.strip().lower() for t in tokens]
+
+
+class Vocabulario(dict):
+    '''
+    Dicionário de termo para id inteiro; termos[id] é o termo do id.
+    Por ser um dict, serve diretamente como o ids_termos de busca_ordenada.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.termos = []
+
+    def adicionar(self, termo):
+        '''Retorna o id do termo, que é criado se o termo for novo'''
+        i = self.get(termo)
+        if i is None:
+            i = len(self.termos)
+            termo = sys.intern(termo)
+            self[termo] = i
+            self.termos.append(termo)
+        return i
+
+    def ids(self, tokens):
+        '''Ids dos tokens, criando os dos tokens novos'''
+        obter = self.get
+        return [
+            i if (i := obter(t)) is not None else self.adicionar(t)
+            for t in tokens
+        ]
+
+
+class IndiceInvertido(Mapping):
+    '''
+    Índice invertido com postings indexadas pelo id do termo no vocabulário.
+    Funciona como o dicionário de termo para lista de doc ids, mas as
+    listas são arrays de inteiros de 4 bytes.
+    '''
+
+    def __init__(self, vocabulario=None):
+        self.vocabulario = vocabulario if vocabulario is not None else Vocabulario()
+        self.postings = [array('i') for _ in self.vocabulario.termos]
+
+    def adicionar(self, doc_id, tokens, com_repeticao=False):
+        '''
+        Indexa os tokens do documento doc_id (maior que os já indexados).
+        Se com_repeticao, o doc id é adicionado uma vez por ocorrência.
+        '''
+        ids = self.vocabulario.ids(tokens)
+        postings = self.postings
+        while len(postings) < len(self.vocabulario.termos):
+            postings.append(array('i'))
+        for i in (ids if com_repeticao else dict.fromkeys(ids)):
+            postings[i].append(doc_id)
+
+    def estender(self, termo, doc_ids):
+        '''Acrescenta doc_ids (maiores que os já indexados) às postings do termo'''
+        i = self.vocabulario.adicionar(termo)
+        if i == len(self.postings):
+            self.postings.append(array('i'))
+        self.postings[i].extend(doc_ids)
+
+    def __getitem__(self, termo):
+        return self.postings[self.vocabulario[termo]]
+
+    def __contains__(self, termo):
+        return termo in self.vocabulario
+
+    def __iter__(self):
+        return iter(self.vocabulario.termos)
+
+    def __len__(self):
+        return len(self.vocabulario.termos)